@@ -1,3 +1,20 @@
+import datetime
+
 from django.test import TestCase
+from django.urls import reverse
+
+from .models import Article
+
+
+class LatestArticlesFeedTestCase(TestCase):
+    async def test_feed_lists_latest_articles(self):
+        await Article.objects.acreate(title="Old post", body="...", pub_date=datetime.date(2023, 1, 1))
+        await Article.objects.acreate(title="New post", body="...", pub_date=datetime.date(2024, 1, 1))
 
-# Create your tests here.
+        response = await self.async_client.get(
+            reverse("blogapp:posts_feed"),
+            headers={'User-Agent': 'Mozilla/5.0'},
+        )
+        self.assertEqual(response.status_code, 200)
+        content = response.content.decode()
+        self.assertLess(content.index("New post"), content.index("Old post"))
@@ -1,7 +1,10 @@
+from asgiref.sync import markcoroutinefunction
 from django.contrib.syndication.views import Feed
 from django.urls import reverse, reverse_lazy
 from django.views.generic import ListView, DetailView
 
+from shopapp.caching import aget_change_stamp, aget_or_compute
+
 from .models import Article
 
 
@@ -28,12 +31,34 @@ class LatestArticlesFeed(Feed):
     description = "Updates on changes and addition blog articles"
     link = reverse_lazy("blogapp:posts_list")
 
-    def items(self):
-        return (
+    def __init__(self):
+        # The feed instance is the view itself: lets Django await it.
+        markcoroutinefunction(self)
+
+    async def __call__(self, request, *args, **kwargs):
+        request.latest_articles = await aget_or_compute(
+            "blog_latest_articles",
+            self.fetch_latest_articles,
+            timeout=60 * 10,
+            version=await aget_change_stamp("article"),
+        )
+        # Rendering runs no queries, so it stays in the event loop.
+        return super().__call__(request, *args, **kwargs)
+
+    @staticmethod
+    async def fetch_latest_articles() -> list:
+        articles = (
             Article.objects
             .filter(pub_date__isnull=False)
             .order_by("-pub_date")[:5]
         )
+        return [article async for article in articles]
+
+    def get_object(self, request, *args, **kwargs):
+        return request.latest_articles
+
+    def items(self, articles):
+        return articles
 
     def item_title(self, item: Article):
         return item.title
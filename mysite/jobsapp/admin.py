@@ -0,0 +1,10 @@
+from django.contrib import admin
+
+from .models import Job
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = 'pk', 'task', 'state', 'progress', 'attempts', 'created_by', 'created_at', 'finished_at'
+    list_filter = 'state', 'task'
+    readonly_fields = 'started_at', 'finished_at', 'heartbeat_at', 'attempts'
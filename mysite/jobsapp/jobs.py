@@ -0,0 +1,221 @@
+"""
+Простая очередь фоновых задач поверх базы данных.
+
+Задача регистрируется декоратором ``@task("app.name")``, ставится в
+очередь через ``enqueue`` и выполняется командой ``manage.py run_jobs``.
+Брокер не нужен: состояние задач хранится в модели Job.
+
+Пока задача выполняется, воркер раз в ``JOB_HEARTBEAT_INTERVAL`` секунд
+обновляет ``heartbeat_at``. Задачу упавшего воркера ``claim_next_job``
+возвращает в очередь через ``JOB_LEASE_TIMEOUT`` секунд тишины, а после
+``JOB_MAX_ATTEMPTS`` запусков помечает проваленной.
+
+Запуск задачи принадлежит воркеру, пока совпадает номер попытки
+(``attempts``): пульс и запись результата обновляют строку только при
+этом условии. Воркер, у которого задачу забрали, не может отметить её
+выполненной, а его пульс останавливается.
+"""
+import logging
+import threading
+import traceback
+from datetime import timedelta
+from time import monotonic
+from typing import Callable, Dict, Optional
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files import File
+from django.db import connections, transaction
+from django.db.models import F, QuerySet
+from django.utils import timezone
+
+from .models import Job
+
+log = logging.getLogger(__name__)
+
+TaskFunc = Callable[..., Optional[dict]]
+
+registry: Dict[str, TaskFunc] = {}
+
+
+def task(name: str) -> Callable[[TaskFunc], TaskFunc]:
+    """
+    Registers a function as a job task.
+
+    The function is called as ``func(job, **job.kwargs)``; its return
+    value is stored in ``Job.result``.
+    """
+    def decorator(func: TaskFunc) -> TaskFunc:
+        registry[name] = func
+        return func
+    return decorator
+
+
+def enqueue(
+        name: str,
+        *,
+        created_by: Optional[User] = None,
+        input_file: Optional[File] = None,
+        **kwargs,
+) -> Job:
+    if name not in registry:
+        raise KeyError(f"Unknown job task {name!r}")
+    job = Job(task=name, kwargs=kwargs, created_by=created_by)
+    if input_file is not None:
+        job.input_file.save(input_file.name, input_file, save=False)
+    job.save()
+    log.info("Enqueued %s", job)
+    return job
+
+
+def requeue_lost_jobs() -> int:
+    """
+    Queues running jobs whose worker stopped sending heartbeats again,
+    or fails them after ``JOB_MAX_ATTEMPTS`` runs. Returns how many
+    were queued.
+    """
+    now = timezone.now()
+    lost = Job.objects.filter(
+        state=Job.State.RUNNING,
+        heartbeat_at__lt=now - timedelta(seconds=settings.JOB_LEASE_TIMEOUT),
+    )
+    failed = lost.filter(attempts__gte=settings.JOB_MAX_ATTEMPTS).update(
+        state=Job.State.FAILED,
+        error="The worker running the job was lost.",
+        finished_at=now,
+    )
+    requeued = lost.update(state=Job.State.PENDING, started_at=None, heartbeat_at=None)
+    if failed or requeued:
+        log.warning("Lost jobs: %s queued again, %s failed", requeued, failed)
+    return requeued
+
+
+def owned_run(job_id: int, attempt: int) -> QuerySet:
+    """
+    The job row as long as the given attempt is still running it.
+    """
+    return Job.objects.filter(pk=job_id, state=Job.State.RUNNING, attempts=attempt)
+
+
+def claim_job(job_id: int) -> Optional[Job]:
+    """
+    Moves a pending job to RUNNING as a new attempt and returns it, or
+    None if it is not pending anymore.
+    """
+    with transaction.atomic():
+        claimed = Job.objects.filter(
+            pk=job_id,
+            state=Job.State.PENDING,
+        ).update(
+            state=Job.State.RUNNING,
+            started_at=timezone.now(),
+            heartbeat_at=timezone.now(),
+            attempts=F("attempts") + 1,
+        )
+    if not claimed:
+        return None
+    return Job.objects.get(pk=job_id)
+
+
+def claim_next_job() -> Optional[Job]:
+    """
+    Atomically moves the oldest pending job to RUNNING and returns it.
+    """
+    requeue_lost_jobs()
+    while True:
+        job_id = Job.objects.filter(state=Job.State.PENDING).order_by("pk").values_list("pk", flat=True).first()
+        if job_id is None:
+            return None
+        job = claim_job(job_id)
+        if job is not None:
+            return job
+
+
+class Heartbeat:
+    """
+    Refreshes ``heartbeat_at`` of a running job from a background thread.
+
+    Stops and sets ``lost`` once the attempt no longer owns the job, or
+    when no heartbeat got through for ``JOB_LEASE_TIMEOUT`` seconds: by
+    then another worker may have claimed it.
+    """
+    def __init__(self, job: Job, interval: float):
+        self.job = job
+        self.interval = interval
+        self.lost = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"job-heartbeat-{job.pk}", daemon=True)
+
+    def __enter__(self) -> "Heartbeat":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        last_beat = monotonic()
+        try:
+            while not self._stopped.wait(self.interval):
+                try:
+                    owned = owned_run(self.job.pk, self.job.attempts).update(heartbeat_at=timezone.now())
+                except Exception:
+                    log.exception("Heartbeat of %s failed", self.job)
+                    if monotonic() - last_beat < settings.JOB_LEASE_TIMEOUT:
+                        continue
+                    log.error("No heartbeat of %s for %ss, stopping it", self.job, settings.JOB_LEASE_TIMEOUT)
+                    self.lost.set()
+                    return
+                if not owned:
+                    log.warning("%s is not owned by attempt %s anymore", self.job, self.job.attempts)
+                    self.lost.set()
+                    return
+                last_beat = monotonic()
+        finally:
+            connections.close_all()
+
+
+def run_job(job_id: int, attempt: Optional[int] = None) -> str:
+    """
+    Executes a claimed job and records its outcome; returns the final state.
+
+    ``attempt`` is the one the job was claimed with; without it a pending
+    job is claimed here. The outcome is only stored while that attempt
+    still owns the job.
+    """
+    if attempt is None:
+        job = claim_job(job_id)
+        if job is None:
+            job = Job.objects.get(pk=job_id)
+            log.warning("%s is not pending, not running it", job)
+            return job.state
+    else:
+        job = Job.objects.get(pk=job_id)
+        if job.attempts != attempt:
+            log.warning("%s was claimed again, attempt %s does not run it", job, attempt)
+            return job.state
+    try:
+        func = registry[job.task]
+        with Heartbeat(job, settings.JOB_HEARTBEAT_INTERVAL):
+            job.result = func(job, **job.kwargs)
+    except Exception:
+        log.exception("%s failed", job)
+        job.state = Job.State.FAILED
+        job.error = traceback.format_exc()
+    else:
+        job.state = Job.State.DONE
+        job.progress = 100
+    job.finished_at = timezone.now()
+    finished = owned_run(job.pk, job.attempts).update(
+        state=job.state,
+        progress=job.progress,
+        result=job.result,
+        result_file=job.result_file.name,
+        error=job.error,
+        finished_at=job.finished_at,
+    )
+    if not finished:
+        log.warning("%s was claimed again, outcome %s of attempt %s is dropped", job, job.state, job.attempts)
+        return Job.objects.values_list("state", flat=True).get(pk=job.pk)
+    return job.state
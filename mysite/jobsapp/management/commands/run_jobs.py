@@ -0,0 +1,94 @@
+import logging
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
+from typing import Dict
+
+import django
+from django.core.management import BaseCommand
+from django.db import connections
+
+from jobsapp.jobs import claim_next_job, run_job
+from jobsapp.models import Job
+
+log = logging.getLogger(__name__)
+
+
+def _run_job_in_worker(job_id: int, attempt: int) -> str:
+    try:
+        return run_job(job_id, attempt)
+    finally:
+        connections.close_all()
+
+
+class Command(BaseCommand):
+    """
+    Runs background jobs from the Job table in a pool of processes.
+    """
+    help = "Run queued background jobs"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=2)
+        parser.add_argument("--poll-interval", type=float, default=1.0)
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Exit when the queue is empty",
+        )
+
+    def handle(self, *args, **options):
+        workers = options["workers"]
+        self.stdout.write(f"Start job worker with {workers} processes")
+
+        executor = self.make_executor(workers)
+        running: Dict[Future, Job] = {}
+        try:
+            while True:
+                broken = False
+                for future in [future for future in running if future.done()]:
+                    broken = not self.collect(future, running.pop(future)) or broken
+                if broken:
+                    # A crashed child breaks the pool and all its jobs;
+                    # they are queued again once their lease expires.
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    executor = self.make_executor(workers)
+                job = claim_next_job() if len(running) < workers else None
+                if job is not None:
+                    self.stdout.write(f"Run {job}")
+                    running[executor.submit(_run_job_in_worker, job.pk, job.attempts)] = job
+                    continue
+                if options["once"] and not running:
+                    break
+                time.sleep(options["poll_interval"])
+        except KeyboardInterrupt:
+            self.stdout.write("Stopping, waiting for running jobs")
+        finally:
+            executor.shutdown(wait=True)
+            for future, job in running.items():
+                if future.done():
+                    self.collect(future, job)
+
+        self.stdout.write(self.style.SUCCESS("Done"))
+
+    def make_executor(self, workers: int) -> ProcessPoolExecutor:
+        # Spawned children set up Django from scratch instead of
+        # inheriting the parent's database connections.
+        return ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=get_context("spawn"),
+            initializer=django.setup,
+        )
+
+    def collect(self, future: Future, job: Job) -> bool:
+        """
+        Logs the outcome of a finished job; returns False if the pool broke.
+        """
+        try:
+            self.stdout.write(f"{job}: {future.result()}")
+        except BrokenProcessPool:
+            log.error("Worker process running %s died", job)
+            return False
+        except Exception:
+            log.exception("Running %s failed", job)
+        return True
@@ -0,0 +1,58 @@
+from django.contrib.auth.models import User
+from django.db import models
+
+from django.utils.translation import gettext_lazy as _
+
+
+def job_file_directly_path(instance: "Job", filename: str) -> str:
+    return "jobs/{name}/{filename}".format(
+        name=instance.task.replace(".", "_"),
+        filename=filename,
+    )
+
+
+class Job(models.Model):
+    """
+    Модель Job представляет фоновую задачу, которую выполняет
+    команда ``manage.py run_jobs`` вне HTTP-запроса.
+    """
+    class State(models.TextChoices):
+        PENDING = "pending", _("Pending")
+        RUNNING = "running", _("Running")
+        DONE = "done", _("Done")
+        FAILED = "failed", _("Failed")
+
+    class Meta:
+        ordering = ['pk']
+        verbose_name = _("Job")
+        verbose_name_plural = _("Jobs")
+
+    task = models.CharField(max_length=100)
+    state = models.CharField(
+        max_length=10,
+        choices=State.choices,
+        default=State.PENDING,
+        db_index=True,
+    )
+    progress = models.PositiveSmallIntegerField(default=0)
+    kwargs = models.JSONField(default=dict, blank=True)
+
+    input_file = models.FileField(null=True, blank=True, upload_to=job_file_directly_path)
+    result = models.JSONField(null=True, blank=True)
+    result_file = models.FileField(null=True, blank=True, upload_to=job_file_directly_path)
+    error = models.TextField(blank=True)
+
+    created_by = models.ForeignKey(User, null=True, blank=True, on_delete=models.SET_NULL)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    # Refreshed by the worker while the job runs, see jobs.Heartbeat.
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+
+    def set_progress(self, progress: int) -> None:
+        self.progress = max(0, min(int(progress), 100))
+        Job.objects.filter(pk=self.pk).update(progress=self.progress)
+
+    def __str__(self) -> str:
+        return f"Job(pk={self.pk}, task={self.task!r}, state={str(self.state)!r})"
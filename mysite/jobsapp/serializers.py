@@ -0,0 +1,19 @@
+from rest_framework import serializers
+
+from .models import Job
+
+
+class JobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Job
+        fields = [
+            'pk',
+            'task',
+            'state',
+            'progress',
+            'result',
+            'result_file',
+            'created_at',
+            'started_at',
+            'finished_at',
+        ]
@@ -0,0 +1,128 @@
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.db.models import F
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from jobsapp.jobs import Heartbeat, claim_next_job, enqueue, registry, run_job, task
+from jobsapp.models import Job
+
+
+@task("jobsapp.tests.add")
+def add_task(job: Job, a: int, b: int) -> dict:
+    return {"sum": a + b}
+
+
+@task("jobsapp.tests.fail")
+def fail_task(job: Job) -> None:
+    raise RuntimeError("boom")
+
+
+class JobRunTestCase(TestCase):
+    def test_run_job_done(self):
+        job = enqueue("jobsapp.tests.add", a=2, b=3)
+        claimed = claim_next_job()
+        self.assertEqual(claimed.pk, job.pk)
+        self.assertEqual(claimed.state, Job.State.RUNNING)
+        self.assertIsNone(claim_next_job())
+
+        self.assertEqual(run_job(job.pk, claimed.attempts), Job.State.DONE)
+        job.refresh_from_db()
+        self.assertEqual(job.result, {"sum": 5})
+        self.assertEqual(job.progress, 100)
+
+    def test_run_job_failed(self):
+        job = enqueue("jobsapp.tests.fail")
+        self.assertEqual(run_job(job.pk), Job.State.FAILED)
+        job.refresh_from_db()
+        self.assertIn("boom", job.error)
+
+    @override_settings(JOB_LEASE_TIMEOUT=60, JOB_MAX_ATTEMPTS=2)
+    def test_lost_job_is_queued_again(self):
+        job = enqueue("jobsapp.tests.add", a=2, b=3)
+        claim_next_job()
+        lost = Job.objects.filter(pk=job.pk)
+        lost.update(heartbeat_at=timezone.now() - timedelta(seconds=61))
+
+        claimed = claim_next_job()
+        self.assertEqual(claimed.pk, job.pk)
+        self.assertEqual(claimed.attempts, 2)
+
+        lost.update(heartbeat_at=timezone.now() - timedelta(seconds=61))
+        self.assertIsNone(claim_next_job())
+        job.refresh_from_db()
+        self.assertEqual(job.state, Job.State.FAILED)
+
+    def test_stale_attempt_does_not_finish_job(self):
+        job = enqueue("jobsapp.tests.add", a=2, b=3)
+        stale = claim_next_job()
+        Job.objects.filter(pk=job.pk).update(state=Job.State.PENDING)
+        claimed = claim_next_job()
+
+        with self.assertLogs("jobsapp.jobs", "WARNING"):
+            self.assertEqual(run_job(job.pk, stale.attempts), Job.State.RUNNING)
+        Job.objects.filter(pk=job.pk).update(attempts=stale.attempts)
+        with self.assertLogs("jobsapp.jobs", "WARNING"):
+            self.assertEqual(run_job(job.pk, claimed.attempts), Job.State.RUNNING)
+        job.refresh_from_db()
+        self.assertIsNone(job.result)
+
+    def test_enqueue_unknown_task(self):
+        self.assertNotIn("no.such.task", registry)
+        with self.assertRaises(KeyError):
+            enqueue("no.such.task")
+
+
+class HeartbeatTestCase(TransactionTestCase):
+    # The heartbeat thread has its own connection and must see the job.
+    def test_heartbeat_stops_when_job_is_claimed_again(self):
+        enqueue("jobsapp.tests.add", a=2, b=3)
+        job = claim_next_job()
+        with self.assertLogs("jobsapp.jobs", "WARNING"), Heartbeat(job, 0.01) as heartbeat:
+            Job.objects.filter(pk=job.pk).update(attempts=F("attempts") + 1)
+            self.assertTrue(heartbeat.lost.wait(5))
+
+
+class JobStatusViewTestCase(TestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username='Jack', password='qwerty')
+        self.client.force_login(self.user)
+
+    def test_job_status(self):
+        job = enqueue("jobsapp.tests.add", created_by=self.user, a=1, b=1)
+        response = self.client.get(
+            reverse("jobsapp:job-status", kwargs={"pk": job.pk}),
+            HTTP_USER_AGENT='Mozilla/5.0',
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["state"], Job.State.PENDING)
+
+    def test_job_status_hides_traceback(self):
+        job = enqueue("jobsapp.tests.fail", created_by=self.user)
+        run_job(job.pk)
+        response = self.client.get(
+            reverse("jobsapp:job-status", kwargs={"pk": job.pk}),
+            HTTP_USER_AGENT='Mozilla/5.0',
+        )
+        self.assertEqual(response.json()["state"], Job.State.FAILED)
+        self.assertNotIn("Traceback", response.content.decode())
+
+    def test_job_status_anonymous(self):
+        job = enqueue("jobsapp.tests.add", a=1, b=1)
+        self.client.logout()
+        response = self.client.get(
+            reverse("jobsapp:job-status", kwargs={"pk": job.pk}),
+            HTTP_USER_AGENT='Mozilla/5.0',
+        )
+        self.assertEqual(response.status_code, 403)
+
+    def test_job_status_other_user(self):
+        other = User.objects.create_user(username='Jill', password='qwerty')
+        job = enqueue("jobsapp.tests.add", created_by=other, a=1, b=1)
+        response = self.client.get(
+            reverse("jobsapp:job-status", kwargs={"pk": job.pk}),
+            HTTP_USER_AGENT='Mozilla/5.0',
+        )
+        self.assertEqual(response.status_code, 404)
@@ -0,0 +1,20 @@
+from rest_framework.generics import RetrieveAPIView
+from rest_framework.permissions import IsAuthenticated
+
+from .models import Job
+from .serializers import JobSerializer
+
+
+class JobStatusView(RetrieveAPIView):
+    """
+    Статус фоновой задачи: состояние, прогресс и результат.
+    Пользователь видит только свои задачи, персонал — все.
+    """
+    serializer_class = JobSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        user = self.request.user
+        if user.is_staff:
+            return Job.objects.all()
+        return Job.objects.filter(created_by=user)
@@ -0,0 +1,11 @@
+from django.contrib.auth.models import Group
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from shopapp.caching import touch_change_stamp
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def group_changed(sender, **kwargs) -> None:
+    touch_change_stamp("group")
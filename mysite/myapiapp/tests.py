@@ -1,3 +1,46 @@
+from django.contrib.auth.models import Group
+from django.core.cache import cache
 from django.test import TestCase
+from django.urls import reverse
 
-# Create your tests here.
+
+class GroupsListViewTestCase(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+
+    def get(self):
+        return self.client.get(
+            reverse("myapiapp:groups"),
+            HTTP_USER_AGENT='Mozilla/5.0',
+            HTTP_ACCEPT='application/json',
+        )
+
+    def test_groups_list_cache(self):
+        first = self.get()
+        self.assertEqual(first["X-Cache"], "MISS")
+        response = self.get()
+        self.assertEqual(response["X-Cache"], "HIT")
+        self.assertEqual(response["Content-Type"], first["Content-Type"])
+        self.assertEqual(response["Allow"], first["Allow"])
+        self.assertEqual(response["Vary"], first["Vary"])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Group.objects.create(name="managers")
+        response = self.get()
+        self.assertEqual(response["X-Cache"], "MISS")
+        self.assertEqual(response.json()["count"], 1)
+
+
+class HelloWorldViewTestCase(TestCase):
+    async def test_hello_world(self):
+        response = await self.async_client.get(
+            reverse("myapiapp:hello"),
+            headers={'User-Agent': 'Mozilla/5.0'},
+        )
+        self.assertEqual(response.json(), {"message": "Hello World!"})
+
+        response = await self.async_client.post(
+            reverse("myapiapp:hello"),
+            headers={'User-Agent': 'Mozilla/5.0'},
+        )
+        self.assertEqual(response.status_code, 405)
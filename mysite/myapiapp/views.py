@@ -1,20 +1,27 @@
 from django.contrib.auth.models import Group
-from rest_framework.decorators import api_view
-from rest_framework.response import Response
-from rest_framework.request import Request
+from django.http import HttpRequest, HttpResponseNotAllowed, JsonResponse
+from django.utils.decorators import method_decorator
 
 from rest_framework.generics import GenericAPIView, ListCreateAPIView
 
 from rest_framework.mixins import ListModelMixin
 
+from shopapp.caching import cache_api_response
+
 from .serializers import GroupSerializer
 
 
-@api_view()
-def hello_world_view(request: Request) -> Response:
-    return Response({"message": "Hello World!"})
+async def hello_world_view(request: HttpRequest) -> JsonResponse:
+    """
+    Plain async view: DRF views are sync only and would take a thread
+    per request under ASGI. The response is constant, so nothing is cached.
+    """
+    if request.method not in ("GET", "HEAD"):
+        return HttpResponseNotAllowed(["GET", "HEAD"])
+    return JsonResponse({"message": "Hello World!"})
 
 
+@method_decorator(cache_api_response("groups", stamps=["group"]), name="list")
 class GroupsListView(ListCreateAPIView):
 
     queryset = Group.objects.all()
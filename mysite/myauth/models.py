@@ -15,3 +15,5 @@ class Profile(models.Model):
     bio = models.TextField(max_length=500, blank=True)
     agreement_accepted = models.BooleanField(default=False)
     avatar = models.ImageField(null=True, blank=True, upload_to=profile_avatar_directly_path)
+    # Resized copies of the avatar, see shopapp.images.
+    avatar_variants = models.JSONField(default=dict, blank=True, editable=False)
@@ -0,0 +1,11 @@
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from shopapp.images import schedule_variants
+from .models import Profile
+
+
+@receiver(post_save, sender=Profile)
+def profile_avatar_changed(sender, instance: Profile, raw: bool = False, **kwargs) -> None:
+    if not raw:
+        schedule_variants(instance)
@@ -7,6 +7,13 @@ class GetCookieViewTestCase(TestCase):
         response = self.client.get(reverse("myauth:cookie-get"), HTTP_USER_AGENT='Mozilla/5.0')
         self.assertContains(response, "Cookie value")
 
+    def test_cookie_value_is_not_shared(self):
+        for value in ("buzz", "fuzz"):
+            self.client.cookies["fizz"] = value
+            response = self.client.get(reverse("myauth:cookie-get"), HTTP_USER_AGENT='Mozilla/5.0')
+            self.assertContains(response, f"Cookie value: {value!r}")
+            self.assertIn("Cookie", response["Vary"])
+
 
 class FooBarViewTest(TestCase):
     def test_foo_bar_view(self):
@@ -20,7 +20,7 @@ from django.views import View
 from .models import Profile
 from django.utils.translation import gettext_lazy as _, ngettext
 
-from django.views.decorators.cache import cache_page
+from shopapp.caching import cache_view_page
 
 
 class HelloView(View):
@@ -47,8 +47,9 @@ class AboutMeView(TemplateView):
 
 class ProfilesListView(ListView):
     template_name = 'myauth/users_list.html'
-    model = User
+    queryset = User.objects.select_related("profile").order_by("pk")
     context_object_name = "users"
+    query_budget = 4
 
 
 class ProfileDetailsView(DetailView):
@@ -129,7 +130,7 @@ def login_view(request: HttpRequest) -> HttpResponse:
 #     return response
 #
 #
-@cache_page(60 * 2)
+@cache_view_page(60 * 2, vary_on_cookies=["fizz"])
 def get_cookie_view(request: HttpRequest) -> HttpResponse:
     value = request.COOKIES.get('fizz', 'default_value')
     return HttpResponse(f"Cookie value: {value!r} + {random()}")
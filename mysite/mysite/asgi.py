@@ -13,4 +13,8 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mysite.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from requestdataapp.uploadhandlers import RequestBodyLimitMiddleware  # noqa: E402 needs django.setup()
+
+application = RequestBodyLimitMiddleware(django_application)
@@ -0,0 +1,182 @@
+"""
+Двухуровневый кэш: локальный LRU в памяти процесса перед общим бэкендом.
+
+Локальный уровень ограничен числом записей и временем жизни. Запись идёт
+в оба уровня сразу. Ключи с версией (см. ``shopapp.caching``) неизменяемы,
+поэтому их можно держать локально; сами отметки версий, а также записи и
+блокировки ``get_or_compute``, чья версия лежит внутри значения
+(``LOCAL_BYPASS_PREFIXES``), всегда читаются из общего уровня, так что
+изменение в одном воркере сразу видно остальным.
+
+Пример настройки::
+
+    CACHES = {
+        "default": {
+            "BACKEND": "mysite.cache_backends.TwoTierCache",
+            "OPTIONS": {"SHARED": "shared"},
+        },
+        "shared": {
+            "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+            "LOCATION": "/var/tmp/django_cache",
+        },
+    }
+"""
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+from .metrics import CACHE_REQUESTS
+
+# Values of these types are stored as is, everything else is pickled so
+# callers never share a mutable object through the local tier.
+IMMUTABLE_TYPES = (bytes, str, int, float, bool, type(None))
+
+_MISSING = object()
+
+
+class TierStats:
+    def __init__(self, tier: str):
+        self.tier = tier
+        self.hits = 0
+        self.misses = 0
+
+    def hit(self) -> None:
+        self.hits += 1
+        CACHE_REQUESTS.inc(tier=self.tier, result="hit")
+
+    def miss(self) -> None:
+        self.misses += 1
+        CACHE_REQUESTS.inc(tier=self.tier, result="miss")
+
+    def as_dict(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0,
+        }
+
+
+class TwoTierCache(BaseCache):
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get("OPTIONS", {})
+        self._shared_alias = options.get("SHARED", "shared")
+        self._local_max_entries = int(options.get("LOCAL_MAX_ENTRIES", 1000))
+        self._local_timeout = float(options.get("LOCAL_TIMEOUT", 10))
+        self._bypass_prefixes = tuple(options.get("LOCAL_BYPASS_PREFIXES", ("change_stamp:", "computed:")))
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+        self.local_stats = TierStats("local")
+        self.shared_stats = TierStats("shared")
+
+    @property
+    def shared(self) -> BaseCache:
+        return caches[self._shared_alias]
+
+    def stats(self) -> dict:
+        return {
+            "local": self.local_stats.as_dict(),
+            "shared": self.shared_stats.as_dict(),
+            "local_entries": len(self._local),
+        }
+
+    # Local tier
+
+    def _bypass(self, key: str) -> bool:
+        return key.startswith(self._bypass_prefixes)
+
+    def _local_get(self, local_key: tuple) -> Any:
+        with self._lock:
+            entry = self._local.get(local_key)
+            if entry is None:
+                return _MISSING
+            expires_at, pickled, value = entry
+            if expires_at < time.monotonic():
+                del self._local[local_key]
+                return _MISSING
+            self._local.move_to_end(local_key)
+        return pickle.loads(value) if pickled else value
+
+    def _local_set(self, local_key: tuple, value: Any, timeout) -> None:
+        local_timeout = self._local_timeout
+        if timeout is not DEFAULT_TIMEOUT and timeout is not None:
+            local_timeout = min(local_timeout, timeout)
+        if local_timeout <= 0:
+            self._local_delete(local_key)
+            return
+        pickled = not isinstance(value, IMMUTABLE_TYPES)
+        if pickled:
+            value = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._local[local_key] = (time.monotonic() + local_timeout, pickled, value)
+            self._local.move_to_end(local_key)
+            while len(self._local) > self._local_max_entries:
+                self._local.popitem(last=False)
+
+    def _local_delete(self, local_key: tuple) -> None:
+        with self._lock:
+            self._local.pop(local_key, None)
+
+    def _local_key(self, key: str, version: Optional[int]) -> tuple:
+        return key, self.version if version is None else version
+
+    # Cache API
+
+    def get(self, key, default=None, version=None):
+        local_key = self._local_key(key, version)
+        if not self._bypass(key):
+            value = self._local_get(local_key)
+            if value is not _MISSING:
+                self.local_stats.hit()
+                return value
+            self.local_stats.miss()
+
+        value = self.shared.get(key, _MISSING, version=version)
+        if value is _MISSING:
+            self.shared_stats.miss()
+            return default
+        self.shared_stats.hit()
+        if not self._bypass(key):
+            self._local_set(local_key, value, DEFAULT_TIMEOUT)
+        return value
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.shared.set(key, value, timeout, version=version)
+        if not self._bypass(key):
+            self._local_set(self._local_key(key, version), value, timeout)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        added = self.shared.add(key, value, timeout, version=version)
+        if added and not self._bypass(key):
+            self._local_set(self._local_key(key, version), value, timeout)
+        return added
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self.shared.touch(key, timeout, version=version)
+
+    def delete(self, key, version=None):
+        self._local_delete(self._local_key(key, version))
+        return self.shared.delete(key, version=version)
+
+    def incr(self, key, delta=1, version=None):
+        self._local_delete(self._local_key(key, version))
+        return self.shared.incr(key, delta, version=version)
+
+    def has_key(self, key, version=None):
+        if not self._bypass(key) and self._local_get(self._local_key(key, version)) is not _MISSING:
+            return True
+        return self.shared.has_key(key, version=version)
+
+    def clear(self):
+        with self._lock:
+            self._local.clear()
+        self.shared.clear()
+
+    def close(self, **kwargs):
+        self.shared.close(**kwargs)
@@ -0,0 +1,228 @@
+"""
+SQLite, настроенный для работы сайта под нагрузкой.
+
+При подключении применяются PRAGMA из ``OPTIONS["pragmas"]`` (по умолчанию
+WAL, ``synchronous=NORMAL``, ``busy_timeout``, кэш страниц, mmap и
+временные таблицы в памяти). В режиме WAL читатели не блокируют писателя и
+наоборот, а ``busy_timeout`` заставляет ждать блокировку вместо мгновенной
+ошибки ``database is locked``.
+
+Соединения переиспользуются через пул процесса: под ASGI у каждого запроса
+свой поток, поэтому ``CONN_MAX_AGE`` (соединение на поток) там ничего не
+даёт. Перед выдачей из пула соединение проверяется: не старше
+``pool_max_age``, файл базы не подменён и ``SELECT 1`` проходит.
+
+Пример настройки::
+
+    DATABASES = {
+        "default": {
+            "ENGINE": "mysite.db_backends.sqlite3",
+            "NAME": BASE_DIR / "db.sqlite3",
+            "OPTIONS": {
+                "pragmas": {"busy_timeout": 10000},
+                "pool_size": 8,
+                "pool_max_age": 600,
+                "transaction_mode": "IMMEDIATE",
+            },
+        },
+    }
+"""
+import os
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from typing import Optional, Tuple
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.sqlite3 import base
+
+Database = base.Database
+
+DEFAULT_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    # Milliseconds to wait for a lock before "database is locked".
+    "busy_timeout": 5000,
+    # Negative: KiB, i.e. 20 MB of page cache per connection.
+    "cache_size": -20000,
+    "mmap_size": 128 * 1024 * 1024,
+    "temp_store": "MEMORY",
+}
+DEFAULT_POOL_SIZE = 8
+DEFAULT_POOL_MAX_AGE = 600
+TRANSACTION_MODES = ("DEFERRED", "IMMEDIATE", "EXCLUSIVE")
+
+# Keys of OPTIONS handled here and not passed to sqlite3.connect().
+BACKEND_OPTIONS = ("pragmas", "pool_size", "pool_max_age", "transaction_mode")
+
+FileId = Optional[Tuple[int, int]]
+
+
+def apply_pragmas(connection, pragmas: dict) -> None:
+    for name, value in pragmas.items():
+        connection.execute(f"PRAGMA {name} = {value}")
+
+
+def file_id(path) -> FileId:
+    """
+    Identifies the database file, so a replaced file (restored backup,
+    swapped replica) is noticed by connections opened before.
+    """
+    try:
+        stat = os.stat(path)
+    except (OSError, ValueError):
+        return None
+    return stat.st_dev, stat.st_ino
+
+
+class ConnectionPool:
+    """
+    Idle connections to one database file, shared by the threads of the
+    process.
+    """
+    def __init__(self, size: int, max_age: float):
+        self.size = size
+        self.max_age = max_age
+        self.pid = os.getpid()
+        self._idle = deque()
+        self._lock = threading.Lock()
+
+    def take(self, path) -> Optional[tuple]:
+        """
+        Returns a healthy ``(connection, created_at)`` or None.
+        """
+        current_file = file_id(path)
+        while True:
+            with self._lock:
+                if self.pid != os.getpid():
+                    # Connections must not cross a fork, just forget them.
+                    self._idle.clear()
+                    self.pid = os.getpid()
+                if not self._idle:
+                    return None
+                connection, created_at, opened_file = self._idle.pop()
+            if self.is_healthy(connection, created_at, opened_file, current_file):
+                return connection, created_at
+            connection.close()
+
+    def put(self, connection, created_at: float, opened_file: FileId) -> bool:
+        if connection.in_transaction or time.monotonic() - created_at > self.max_age:
+            return False
+        with self._lock:
+            if self.pid != os.getpid() or len(self._idle) >= self.size:
+                return False
+            self._idle.append((connection, created_at, opened_file))
+        return True
+
+    def is_healthy(self, connection, created_at: float, opened_file: FileId, current_file: FileId) -> bool:
+        if time.monotonic() - created_at > self.max_age or opened_file != current_file:
+            return False
+        try:
+            connection.execute("SELECT 1").fetchone()
+        except Database.Error:
+            return False
+        return True
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(path: str, size: int, max_age: float) -> ConnectionPool:
+    with _pools_lock:
+        pool = _pools.get(path)
+        if pool is None:
+            pool = _pools[path] = ConnectionPool(size, max_age)
+        return pool
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        options = self.settings_dict["OPTIONS"]
+        self.pragmas = {**DEFAULT_PRAGMAS, **options.get("pragmas", {})}
+        self.transaction_mode = options.get("transaction_mode", "DEFERRED").upper()
+        if self.transaction_mode not in TRANSACTION_MODES:
+            raise ImproperlyConfigured(
+                f"transaction_mode must be one of {', '.join(TRANSACTION_MODES)}"
+            )
+        self.pool_size = options.get("pool_size", DEFAULT_POOL_SIZE)
+        self.pool_max_age = options.get("pool_max_age", DEFAULT_POOL_MAX_AGE)
+        self.connection_created_at = None
+        self.connection_file = None
+
+    @property
+    def pool(self) -> Optional[ConnectionPool]:
+        if not self.pool_size or self.is_in_memory_db():
+            return None
+        return get_pool(str(self.settings_dict["NAME"]), self.pool_size, self.pool_max_age)
+
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        for key in BACKEND_OPTIONS:
+            params.pop(key, None)
+        return params
+
+    def get_new_connection(self, conn_params):
+        pool = self.pool
+        pooled = pool.take(conn_params["database"]) if pool is not None else None
+        if pooled is not None:
+            connection, self.connection_created_at = pooled
+        else:
+            connection = super().get_new_connection(conn_params)
+            apply_pragmas(connection, self.pragmas)
+            self.connection_created_at = time.monotonic()
+        self.connection_file = file_id(conn_params["database"])
+        return connection
+
+    def _close(self):
+        pool = self.pool
+        if self.connection is None or pool is None or self.in_atomic_block:
+            return super()._close()
+        if self.connection.in_transaction:
+            with self.wrap_database_errors:
+                self.connection.rollback()
+        if not pool.put(self.connection, self.connection_created_at, self.connection_file):
+            super()._close()
+
+    def is_usable(self):
+        # Lets CONN_HEALTH_CHECKS drop a persistent connection whose file
+        # was replaced or that stopped working.
+        if self.connection_file != file_id(self.settings_dict["NAME"]):
+            return False
+        try:
+            self.connection.execute("SELECT 1")
+        except Database.Error:
+            return False
+        return True
+
+    def backup_to(self, path) -> None:
+        """
+        Copies the database to ``path`` with the online backup API. The
+        copy is written next to it and renamed over it, so readers of
+        ``path`` never see a half-written file and their pooled
+        connections reopen it.
+        """
+        self.ensure_connection()
+        path = Path(path)
+        temporary = path.with_name(f".{path.name}.tmp")
+        temporary.unlink(missing_ok=True)
+        target = Database.connect(temporary)
+        try:
+            # One step: in WAL mode the database keeps accepting writes meanwhile.
+            with self.wrap_database_errors:
+                self.connection.backup(target)
+            # The file is replaced as a whole, a WAL must not outlive it.
+            target.execute("PRAGMA journal_mode = DELETE")
+        finally:
+            target.close()
+        os.replace(temporary, path)
+
+    def _start_transaction_under_autocommit(self):
+        # IMMEDIATE takes the write lock at BEGIN: a transaction that reads
+        # first then writes cannot fail on the lock upgrade, which
+        # busy_timeout does not cover.
+        if self.transaction_mode == "DEFERRED":
+            return super()._start_transaction_under_autocommit()
+        self.cursor().execute(f"BEGIN {self.transaction_mode}")
@@ -0,0 +1,130 @@
+"""
+Чтение с реплики для тяжёлых read-only view.
+
+View включает чтение с реплики атрибутом ``use_replica = True``. Тогда
+``ReplicaRoutingMiddleware`` разрешает роутеру отправлять на реплику
+чтения моделей из ``DATABASE_REPLICA_APPS``, если запрос безопасный (GET,
+HEAD, OPTIONS) и файл реплики обновлялся не позже ``DATABASE_REPLICA_MAX_LAG``
+секунд назад. Всё остальное идёт в ``default``:
+
+- любые записи, а после первой записи в запросе и все чтения;
+- чтения внутри транзакции;
+- пользователи, сессии и прочие модели вне ``DATABASE_REPLICA_APPS``,
+  чтобы отставание реплики не разлогинивало пользователей.
+
+Реплику обновляет команда ``sync_replica``.
+"""
+import os
+import time
+from contextvars import ContextVar
+from typing import Callable, Optional
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.http import HttpRequest, HttpResponse
+
+REPLICA_DB_ALIAS = "replica"
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+
+class RoutingState:
+    """
+    Routing decisions of one request.
+    """
+    def __init__(self):
+        self.replica = False
+        self.written = False
+
+
+_state_var: ContextVar[Optional[RoutingState]] = ContextVar("db_routing", default=None)
+
+
+def replica_is_fresh() -> bool:
+    if REPLICA_DB_ALIAS not in settings.DATABASES:
+        return False
+    try:
+        synced_at = os.stat(settings.DATABASES[REPLICA_DB_ALIAS]["NAME"]).st_mtime
+    except (OSError, ValueError):
+        return False
+    return time.time() - synced_at <= settings.DATABASE_REPLICA_MAX_LAG
+
+
+def view_uses_replica(view_func: Callable) -> bool:
+    # as_view() keeps the class in "view_class", DRF viewsets in "cls".
+    for view in (view_func, getattr(view_func, "view_class", None), getattr(view_func, "cls", None)):
+        if getattr(view, "use_replica", False):
+            return True
+    return False
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints) -> Optional[str]:
+        state = _state_var.get()
+        if state is None or not state.replica or state.written:
+            return None
+        if model._meta.app_label not in settings.DATABASE_REPLICA_APPS:
+            return None
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return None
+        return REPLICA_DB_ALIAS
+
+    def db_for_write(self, model, **hints) -> str:
+        state = _state_var.get()
+        if state is not None:
+            # Later reads must see this write.
+            state.written = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints) -> bool:
+        # The replica is a copy of default, objects of both may be related.
+        return True
+
+    def allow_migrate(self, db: str, app_label: str, model_name=None, **hints) -> bool:
+        return db != REPLICA_DB_ALIAS
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Starts the routing state of every request and enables the replica for
+    safe requests to views with ``use_replica``.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+            # A sync hook would cost a thread hop per request.
+            self.process_view = self.aprocess_view
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = _state_var.set(RoutingState())
+        try:
+            return self.get_response(request)
+        finally:
+            _state_var.reset(token)
+
+    async def __acall__(self, request: HttpRequest) -> HttpResponse:
+        token = _state_var.set(RoutingState())
+        try:
+            return await self.get_response(request)
+        finally:
+            _state_var.reset(token)
+
+    def process_view(self, request: HttpRequest, view_func, view_args, view_kwargs):
+        state = _state_var.get()
+        if state is not None:
+            state.replica = (
+                request.method in SAFE_METHODS
+                and view_uses_replica(view_func)
+                and replica_is_fresh()
+            )
+        return None
+
+    async def aprocess_view(self, request: HttpRequest, view_func, view_args, view_kwargs):
+        # Not self.process_view, __init__ points it here.
+        return ReplicaRoutingMiddleware.process_view(self, request, view_func, view_args, view_kwargs)
@@ -0,0 +1,219 @@
+"""
+Неблокирующее структурированное логирование.
+
+``QueueStreamHandler`` только кладёт запись в очередь, а вывод в поток
+делает отдельный поток ``QueueListener``, поэтому медленный stdout (драйвер
+логов Docker) не задерживает обработку запросов. ``JsonFormatter`` пишет
+по одной JSON-строке на запись с id запроса, именем view и длительностью,
+которые проставляют ``RequestContextFilter`` и ``RequestLogMiddleware``.
+``SamplingFilter`` оставляет лишь долю записей ниже WARNING для шумных
+логгеров.
+"""
+import atexit
+import copy
+import json
+import logging
+import os
+import random
+import threading
+import uuid
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener
+from queue import Full, Queue
+from time import perf_counter
+from typing import Dict, Optional
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+request_id_var: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+view_name_var: ContextVar[Optional[str]] = ContextVar("view_name", default=None)
+
+log = logging.getLogger(__name__)
+
+# Attributes every LogRecord has; anything else came in through "extra".
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class RequestContextFilter(logging.Filter):
+    """
+    Adds ``request_id`` and ``view`` of the current request to records.
+    Must run in the logging thread, i.e. on the handler, not the listener.
+    """
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        record.view = view_name_var.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps only a fraction of the records below WARNING of the given
+    loggers (and their children), e.g. ``{"shopapp.views": 0.1}``.
+    """
+    def __init__(self, rates: Optional[Dict[str, float]] = None):
+        super().__init__()
+        self.rates = rates or {}
+
+    def rate_for(self, name: str) -> float:
+        while name:
+            if name in self.rates:
+                return self.rates[name]
+            name = name.rpartition(".")[0]
+        return 1.0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rate_for(record.name)
+        return rate >= 1.0 or random.random() < rate
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and value is not None:
+                data[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data["exc_info"] = record.exc_text
+        if record.stack_info:
+            data["stack_info"] = self.formatStack(record.stack_info)
+        return json.dumps(data, default=str, ensure_ascii=False)
+
+
+class QueueStreamHandler(QueueHandler):
+    """
+    Hands records to a background thread writing them to ``stream``.
+
+    The queue is bounded: when the writer cannot keep up, records are
+    dropped instead of blocking the caller.
+    """
+    def __init__(self, stream=None, queue_size: int = 10000):
+        super().__init__(Queue(queue_size))
+        self.dropped = 0
+        self.target = logging.StreamHandler(stream)
+        self._reset_listener()
+        os.register_at_fork(after_in_child=self._reset_listener)
+        atexit.register(self.stop_listener)
+
+    def _reset_listener(self) -> None:
+        # A forked child inherits the listener but not its thread.
+        self.queue = Queue(self.queue.maxsize)
+        self.listener = QueueListener(self.queue, self.target)
+        self._listener_lock = threading.Lock()
+
+    def start_listener(self) -> None:
+        with self._listener_lock:
+            if self.listener._thread is None:
+                self.listener.start()
+
+    def stop_listener(self) -> None:
+        """
+        Flushes the queue; safe to call more than once.
+        """
+        with self._listener_lock:
+            if self.listener._thread is not None:
+                self.listener.stop()
+
+    def setFormatter(self, fmt: Optional[logging.Formatter]) -> None:
+        # Formatting happens on the listener thread.
+        self.target.setFormatter(fmt)
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Merges args now, as they may change after the call returns, but
+        # leaves the formatting to the target handler.
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        # Started lazily: logging reconfiguration (e.g. in django.setup())
+        # closes all handlers, stopping the listener.
+        if self.listener._thread is None:
+            self.start_listener()
+        try:
+            self.queue.put_nowait(record)
+        except Full:
+            self.dropped += 1
+
+    def close(self) -> None:
+        self.stop_listener()
+        super().close()
+
+
+class RequestLogMiddleware:
+    """
+    Assigns a request id (``X-Request-ID`` or a new one), exposes it and
+    the view name to log records and writes one access log line.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+            # A sync hook would cost a thread hop per request.
+            self.process_view = self.aprocess_view
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        tokens = self.start(request)
+        started = perf_counter()
+        try:
+            return self.finish(request, self.get_response(request), started)
+        finally:
+            self.reset(tokens)
+
+    async def __acall__(self, request):
+        tokens = self.start(request)
+        started = perf_counter()
+        try:
+            return self.finish(request, await self.get_response(request), started)
+        finally:
+            self.reset(tokens)
+
+    def start(self, request) -> tuple:
+        request_id = request.META.get("HTTP_X_REQUEST_ID") or uuid.uuid4().hex
+        request.request_id = request_id
+        return request_id_var.set(request_id), view_name_var.set(None)
+
+    def finish(self, request, response, started: float):
+        response["X-Request-ID"] = request.request_id
+        log.info(
+            "%s %s %s",
+            request.method,
+            request.get_full_path(),
+            response.status_code,
+            extra={
+                "status": response.status_code,
+                "duration_ms": round((perf_counter() - started) * 1000, 2),
+            },
+        )
+        return response
+
+    def reset(self, tokens: tuple) -> None:
+        request_token, view_token = tokens
+        view_name_var.reset(view_token)
+        request_id_var.reset(request_token)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        match = request.resolver_match
+        view_name_var.set(match.view_name if match is not None else None)
+        return None
+
+    async def aprocess_view(self, request, view_func, view_args, view_kwargs):
+        # Not self.process_view, __init__ points it here.
+        return RequestLogMiddleware.process_view(self, request, view_func, view_args, view_kwargs)
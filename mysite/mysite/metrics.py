@@ -0,0 +1,426 @@
+"""
+Метрики приложения в текстовом формате Prometheus.
+
+Каждый процесс (воркер gunicorn, ``run_jobs``) пишет свои значения в
+собственный файл ``metrics_<host>_<pid>.db`` в ``settings.METRICS_DIR``,
+отображённый в память. Имя хоста различает контейнеры, у которых общий
+каталог, но свои номера процессов.
+
+Файлы завершившихся процессов своего хоста новый процесс при старте
+складывает в ``metrics_<host>_exited.db`` и удаляет, так что счётчики не
+теряют накопленное. Файлы других хостов (например, пересозданных
+контейнеров) не удаляются никогда: их значения остаются в суммах, пока
+каталог не очистят вручную. Запись идёт без межпроцессных блокировок: только
+короткий локальный lock процесса. Эндпоинт ``/metrics`` читает файлы
+всех процессов и суммирует значения, поэтому счётчики общие для всех
+воркеров.
+
+Пример::
+
+    REQUESTS = Counter("app_requests_total", "Requests", ["view"])
+    REQUESTS.inc(view="shopapp:products_list")
+"""
+import fcntl
+import json
+import mmap
+import os
+import socket
+import struct
+import threading
+from pathlib import Path
+from time import perf_counter
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import HttpRequest, HttpResponse
+
+from mysite.queries import wrap_queries
+
+# Header: bytes used (uint32) + padding; entry: key length (uint32),
+# key padded to 8 bytes, value (double).
+_HEADER = struct.Struct("I4x")
+_KEY_LENGTH = struct.Struct("I")
+_VALUE = struct.Struct("d")
+INITIAL_FILE_SIZE = 64 * 1024
+
+LabelSet = Tuple[Tuple[str, str], ...]
+SampleKey = Tuple[str, LabelSet]
+
+
+class MmapValues:
+    """
+    Float values keyed by sample, stored in one memory-mapped file.
+    """
+    def __init__(self, path: Path, readonly: bool = False):
+        self.path = path
+        self.readonly = readonly
+        self._positions: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        if readonly:
+            self._file = open(path, "rb")
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self._file = open(path, "a+b")
+            if os.fstat(self._file.fileno()).st_size == 0:
+                self._file.truncate(INITIAL_FILE_SIZE)
+            self._map = mmap.mmap(self._file.fileno(), 0)
+            if self._used() == 0:
+                _HEADER.pack_into(self._map, 0, _HEADER.size)
+        for key, position in self._read_entries():
+            self._positions[key] = position
+
+    def _used(self) -> int:
+        return _HEADER.unpack_from(self._map, 0)[0]
+
+    def _read_entries(self) -> Iterator[Tuple[str, int]]:
+        position = _HEADER.size
+        # A reader may have mapped the file before a writer grew it.
+        used = min(self._used(), len(self._map))
+        while position < used:
+            (length,) = _KEY_LENGTH.unpack_from(self._map, position)
+            key_start = position + _KEY_LENGTH.size
+            key = self._map[key_start:key_start + length].decode()
+            position = key_start + _padded_length(length)
+            yield key, position
+            position += _VALUE.size
+
+    def _allocate(self, key: str) -> int:
+        encoded = key.encode()
+        padded = _padded_length(len(encoded))
+        entry_size = _KEY_LENGTH.size + padded + _VALUE.size
+        used = self._used()
+        if used + entry_size > len(self._map):
+            size = len(self._map)
+            while used + entry_size > size:
+                size *= 2
+            self._map.close()
+            self._file.truncate(size)
+            self._map = mmap.mmap(self._file.fileno(), 0)
+        _KEY_LENGTH.pack_into(self._map, used, len(encoded))
+        key_start = used + _KEY_LENGTH.size
+        self._map[key_start:key_start + len(encoded)] = encoded
+        position = key_start + padded
+        _VALUE.pack_into(self._map, position, 0.0)
+        # Readers only look below "used", so the entry is complete first.
+        _HEADER.pack_into(self._map, 0, used + entry_size)
+        self._positions[key] = position
+        return position
+
+    def add(self, key: str, amount: float) -> None:
+        with self._lock:
+            position = self._positions.get(key)
+            if position is None:
+                position = self._allocate(key)
+            (value,) = _VALUE.unpack_from(self._map, position)
+            _VALUE.pack_into(self._map, position, value + amount)
+
+    def items(self) -> Iterator[Tuple[str, float]]:
+        for key, position in self._read_entries():
+            yield key, _VALUE.unpack_from(self._map, position)[0]
+
+    def close(self) -> None:
+        self._map.close()
+        self._file.close()
+
+
+def _padded_length(length: int) -> int:
+    # Keeps every value 8-byte aligned.
+    return length + (-(length + _KEY_LENGTH.size) % 8)
+
+
+def _sample_key(name: str, labels: dict) -> str:
+    return json.dumps([name, sorted(labels.items())])
+
+
+def metrics_dir() -> Path:
+    return Path(settings.METRICS_DIR)
+
+
+_values: Optional[MmapValues] = None
+_values_lock = threading.Lock()
+
+
+def _pid_exists(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def prune_exited_processes() -> None:
+    """
+    Adds the files of exited processes of this host to
+    ``metrics_<host>_exited.db`` and removes them.
+    """
+    prefix = f"metrics_{socket.gethostname()}_"
+    directory = metrics_dir()
+    with open(directory / f"{prefix}exited.lock", "a") as lock:
+        # Two processes starting together must not add a file twice.
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        exited = None
+        try:
+            for path in directory.glob(f"{prefix}*.db"):
+                pid = path.stem[len(prefix):]
+                if not pid.isdigit() or int(pid) == os.getpid() or _pid_exists(int(pid)):
+                    continue
+                if exited is None:
+                    exited = MmapValues(directory / f"{prefix}exited.db")
+                values = MmapValues(path, readonly=True)
+                try:
+                    for key, value in values.items():
+                        exited.add(key, value)
+                finally:
+                    values.close()
+                path.unlink()
+        finally:
+            if exited is not None:
+                exited.close()
+
+
+def _process_values() -> MmapValues:
+    """
+    The file of the current process, reopened after a fork.
+    """
+    global _values
+    path = metrics_dir() / f"metrics_{socket.gethostname()}_{os.getpid()}.db"
+    values = _values
+    if values is None or values.path != path:
+        with _values_lock:
+            if _values is None or _values.path != path:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                prune_exited_processes()
+                _values = MmapValues(path)
+            values = _values
+    return values
+
+
+def collect() -> Dict[SampleKey, float]:
+    """
+    Sums the samples of all processes.
+    """
+    samples: Dict[SampleKey, float] = {}
+    for path in sorted(metrics_dir().glob("metrics_*.db")):
+        try:
+            values = MmapValues(path, readonly=True)
+        except (OSError, ValueError):
+            continue
+        try:
+            for key, value in values.items():
+                name, labels = json.loads(key)
+                sample = (name, tuple(tuple(pair) for pair in labels))
+                samples[sample] = samples.get(sample, 0.0) + value
+        finally:
+            values.close()
+    return samples
+
+
+registry: Dict[str, "Metric"] = {}
+
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        registry[name] = self
+
+    def _labels(self, labels: dict) -> dict:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return {name: str(value) for name, value in labels.items()}
+
+    def render(self, samples: Dict[SampleKey, float]) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type}",
+        ]
+        for (name, labels), value in sorted(samples.items()):
+            if name == self.name:
+                lines.append(_sample_line(name, labels, value))
+        return lines
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        _process_values().add(_sample_key(self.name, self._labels(labels)), amount)
+
+
+class Histogram(Metric):
+    type = "histogram"
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, *args, buckets: Sequence[float] = DEFAULT_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels) -> None:
+        labels = self._labels(labels)
+        values = _process_values()
+        # Buckets are stored per interval and made cumulative on export.
+        for bound in self.buckets:
+            if value <= bound:
+                values.add(_sample_key(f"{self.name}_bucket", {**labels, "le": repr(bound)}), 1)
+                break
+        values.add(_sample_key(f"{self.name}_sum", labels), value)
+        values.add(_sample_key(f"{self.name}_count", labels), 1)
+
+    def render(self, samples: Dict[SampleKey, float]) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type}",
+        ]
+        counts = {
+            labels: value
+            for (name, labels), value in samples.items()
+            if name == f"{self.name}_count"
+        }
+        for labels in sorted(counts):
+            cumulative = 0.0
+            for bound in self.buckets:
+                le = (("le", repr(bound)),)
+                cumulative += samples.get((f"{self.name}_bucket", tuple(sorted(labels + le))), 0.0)
+                lines.append(_sample_line(f"{self.name}_bucket", labels + le, cumulative))
+            lines.append(_sample_line(f"{self.name}_bucket", labels + (("le", "+Inf"),), counts[labels]))
+            lines.append(_sample_line(f"{self.name}_sum", labels, samples.get((f"{self.name}_sum", labels), 0.0)))
+            lines.append(_sample_line(f"{self.name}_count", labels, counts[labels]))
+        return lines
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _sample_line(name: str, labels: LabelSet, value: float) -> str:
+    if labels:
+        rendered = ",".join(f'{label}="{_escape(label_value)}"' for label, label_value in labels)
+        return f"{name}{{{rendered}}} {value!r}"
+    return f"{name} {value!r}"
+
+
+def render_metrics() -> str:
+    samples = collect()
+    lines = []
+    for metric in registry.values():
+        lines.extend(metric.render(samples))
+    return "\n".join(lines) + "\n"
+
+
+HTTP_REQUESTS = Counter(
+    "django_http_requests_total",
+    "HTTP responses by URL name, method and status.",
+    ["view", "method", "status"],
+)
+HTTP_EXCEPTIONS = Counter(
+    "django_http_exceptions_total",
+    "Unhandled view exceptions by URL name and type.",
+    ["view", "type"],
+)
+HTTP_LATENCY = Histogram(
+    "django_http_request_duration_seconds",
+    "Request processing time by URL name.",
+    ["view"],
+)
+DB_QUERIES = Counter(
+    "django_db_queries_total",
+    "Database queries by connection alias.",
+    ["alias"],
+)
+DB_LATENCY = Histogram(
+    "django_db_query_duration_seconds",
+    "Database query time by connection alias.",
+    ["alias"],
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0),
+)
+CACHE_REQUESTS = Counter(
+    "django_cache_requests_total",
+    "Cache lookups by tier and result.",
+    ["tier", "result"],
+)
+
+
+def _view_name(request: HttpRequest) -> str:
+    match = getattr(request, "resolver_match", None)
+    return match.view_name if match is not None else "<unresolved>"
+
+
+def record_query(execute, sql, params, many, context):
+    """
+    ``execute_wrapper`` counting queries and their time per alias.
+    """
+    alias = context["connection"].alias
+    started = perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        DB_QUERIES.inc(alias=alias)
+        DB_LATENCY.observe(perf_counter() - started, alias=alias)
+
+
+class MetricsMiddleware:
+    """
+    Records request counts, latencies and database queries. Should be
+    the first middleware so the latency covers the whole stack.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        started = perf_counter()
+        with wrap_queries(record_query):
+            response = self.get_response(request)
+        self.record(request, response, started)
+        return response
+
+    async def __acall__(self, request: HttpRequest) -> HttpResponse:
+        started = perf_counter()
+        with wrap_queries(record_query):
+            response = await self.get_response(request)
+        self.record(request, response, started)
+        return response
+
+    def record(self, request: HttpRequest, response: HttpResponse, started: float) -> None:
+        view = _view_name(request)
+        HTTP_REQUESTS.inc(view=view, method=request.method, status=response.status_code)
+        HTTP_LATENCY.observe(perf_counter() - started, view=view)
+
+    def process_exception(self, request: HttpRequest, exception: Exception) -> None:
+        HTTP_EXCEPTIONS.inc(view=_view_name(request), type=type(exception).__name__)
+        return None
+
+
+def metrics_view(request: HttpRequest) -> HttpResponse:
+    """
+    Prometheus scrape endpoint; requires ``Authorization: Bearer
+    <METRICS_TOKEN>``. Without a configured token only staff users and
+    ``INTERNAL_IPS`` may read it.
+    """
+    token = getattr(settings, "METRICS_TOKEN", "")
+    if token:
+        allowed = request.META.get("HTTP_AUTHORIZATION", "") == f"Bearer {token}"
+    else:
+        user = getattr(request, "user", None)
+        allowed = (
+            request.META.get("REMOTE_ADDR") in settings.INTERNAL_IPS
+            or (user is not None and user.is_staff)
+        )
+    if not allowed:
+        return HttpResponse(status=403)
+    return HttpResponse(
+        render_metrics(),
+        content_type="text/plain; version=0.0.4; charset=utf-8",
+    )
@@ -0,0 +1,198 @@
+"""
+Учёт SQL-запросов каждого запроса к сайту.
+
+``QueryInspectionMiddleware`` через ``wrap_queries`` считает запросы и
+их время, ищет многократно повторённые запросы одной формы (признак
+N+1) и сверяет число запросов с бюджетом view. В проде
+превышение бюджета пишется в лог, в тестах с ``QUERY_BUDGET_STRICT``
+оно вызывает исключение. Сотрудникам (``is_staff``) время и число
+запросов отдаются в заголовке ``Server-Timing``.
+
+Бюджет задаётся атрибутом view::
+
+    class OrdersListView(ListView):
+        query_budget = 8
+
+    @query_budget(3)
+    def hello_world_view(request): ...
+"""
+import logging
+import re
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import partial
+from time import perf_counter
+from typing import Callable, Iterator, Optional
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpRequest, HttpResponse
+
+log = logging.getLogger(__name__)
+
+_PLACEHOLDER_LIST = re.compile(r"%s(?:\s*,\s*%s)+")
+
+_wrappers_var: ContextVar[tuple] = ContextVar("query_wrappers", default=())
+
+
+def _run_wrappers(execute, sql, params, many, context):
+    for wrapper in reversed(_wrappers_var.get()):
+        execute = partial(wrapper, execute)
+    return execute(sql, params, many, context)
+
+
+def install_query_hook(sender, connection, **kwargs) -> None:
+    if _run_wrappers not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_run_wrappers)
+
+
+connection_created.connect(install_query_hook)
+for _connection in connections.all(initialized_only=True):
+    install_query_hook(None, _connection)
+
+
+@contextmanager
+def wrap_queries(wrapper: Callable) -> Iterator[None]:
+    """
+    Runs the ``execute_wrapper`` ``wrapper`` around every query of the
+    current context on all connections.
+
+    Unlike ``connection.execute_wrapper`` it follows the context into
+    the ``sync_to_async`` threads where the async ORM runs its queries,
+    as connections are per thread.
+    """
+    token = _wrappers_var.set(_wrappers_var.get() + (wrapper,))
+    try:
+        yield
+    finally:
+        _wrappers_var.reset(token)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def sql_shape(sql: str) -> str:
+    """
+    The query with variable-length placeholder lists collapsed, so
+    ``IN (%s, %s)`` and ``IN (%s, %s, %s)`` count as the same shape.
+    """
+    return _PLACEHOLDER_LIST.sub("%s, ...", sql)
+
+
+class QueryRecorder:
+    """
+    ``execute_wrapper`` collecting the queries of one request.
+    """
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.shapes = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += perf_counter() - started
+            self.count += 1
+            self.shapes[sql_shape(sql)] += 1
+
+    def repeated(self, threshold: int) -> list:
+        return [
+            (shape, count)
+            for shape, count in self.shapes.most_common()
+            if count >= threshold
+        ]
+
+
+def query_budget(budget: int) -> Callable:
+    """
+    Declares the max number of queries of a function view.
+    """
+    def decorator(view_func: Callable) -> Callable:
+        view_func.query_budget = budget
+        return view_func
+    return decorator
+
+
+def get_query_budget(view_func: Callable) -> Optional[int]:
+    # as_view() keeps the class in "view_class", DRF viewsets in "cls".
+    for view in (view_func, getattr(view_func, "view_class", None), getattr(view_func, "cls", None)):
+        budget = getattr(view, "query_budget", None)
+        if budget is not None:
+            return budget
+    return None
+
+
+def is_staff(request: HttpRequest) -> bool:
+    user = getattr(request, "user", None)
+    return user is not None and user.is_staff
+
+
+class QueryInspectionMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+            # A sync hook would cost a thread hop per request.
+            self.process_view = self.aprocess_view
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        started = perf_counter()
+        recorder = QueryRecorder()
+        with wrap_queries(recorder):
+            response = self.get_response(request)
+        return self.finish(request, response, recorder, started, is_staff(request))
+
+    async def __acall__(self, request: HttpRequest) -> HttpResponse:
+        started = perf_counter()
+        recorder = QueryRecorder()
+        with wrap_queries(recorder):
+            response = await self.get_response(request)
+        # Loading the user reads the session and the database.
+        staff = await sync_to_async(is_staff)(request)
+        return self.finish(request, response, recorder, started, staff)
+
+    def finish(self, request: HttpRequest, response: HttpResponse, recorder: QueryRecorder,
+               started: float, staff: bool) -> HttpResponse:
+        request.queries = recorder
+        self.inspect(request, recorder)
+
+        if staff:
+            response["Server-Timing"] = (
+                f'db;dur={recorder.duration * 1000:.1f};desc="{recorder.count} queries", '
+                f"total;dur={(perf_counter() - started) * 1000:.1f}"
+            )
+        return response
+
+    def process_view(self, request: HttpRequest, view_func, view_args, view_kwargs):
+        request.query_budget = get_query_budget(view_func)
+        return None
+
+    async def aprocess_view(self, request: HttpRequest, view_func, view_args, view_kwargs):
+        # Not self.process_view, __init__ points it here.
+        return QueryInspectionMiddleware.process_view(self, request, view_func, view_args, view_kwargs)
+
+    def inspect(self, request: HttpRequest, recorder: QueryRecorder) -> None:
+        match = getattr(request, "resolver_match", None)
+        view = match.view_name if match is not None else request.path
+
+        for shape, count in recorder.repeated(settings.QUERY_REPEAT_THRESHOLD):
+            log.warning("Possible N+1 in %s: %d x %s", view, count, shape[:300])
+
+        budget = getattr(request, "query_budget", None)
+        if budget is None or recorder.count <= budget:
+            return
+        message = f"{view} ran {recorder.count} queries, budget is {budget}"
+        if settings.QUERY_BUDGET_STRICT:
+            raise QueryBudgetExceeded(message)
+        log.warning(message)
@@ -70,28 +70,85 @@ INSTALLED_APPS = [
     'myauth.apps.MyauthConfig',
     'myapiapp.apps.MyapiappConfig',
     'blogapp.apps.BlogappConfig',
+    'jobsapp.apps.JobsappConfig',
 ]
 
 MIDDLEWARE = [
+    'mysite.jsonlog.RequestLogMiddleware',
+    'mysite.metrics.MetricsMiddleware',
+    'mysite.queries.QueryInspectionMiddleware',
+    'mysite.db_routers.ReplicaRoutingMiddleware',
+    'mysite.write_queue.WriteTimeoutMiddleware',
     # 'django.middleware.cache.UpdateCacheMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.locale.LocaleMiddleware',
     'django.middleware.common.CommonMiddleware',
+    'requestdataapp.uploadhandlers.UploadLimitMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'django.contrib.admindocs.middleware.XViewMiddleware',
-    'debug_toolbar.middleware.DebugToolbarMiddleware',
     # 'django.middleware.cache.FetchFromCacheMiddleware',
 
     'requestdataapp.middlewares.setup_useragent_on_request_middleware',
-    'requestdataapp.middlewares.CountRequestsMiddleware',
 ]
 
+if DEBUG:
+    # Sync only: under ASGI it would move every request into a thread.
+    MIDDLEWARE.insert(
+        MIDDLEWARE.index('django.contrib.admindocs.middleware.XViewMiddleware') + 1,
+        'debug_toolbar.middleware.DebugToolbarMiddleware',
+    )
+
+# Per-process metric files, aggregated by the /metrics endpoint. Shared by
+# all containers, so the job workers show up too.
+METRICS_DIR = getenv("DJANGO_METRICS_DIR", "/var/tmp/django_metrics")
+# When set, /metrics requires "Authorization: Bearer <token>"; otherwise
+# only staff users and INTERNAL_IPS may read it.
+METRICS_TOKEN = getenv("DJANGO_METRICS_TOKEN", "")
+
+# A running job whose worker sent no heartbeat for JOB_LEASE_TIMEOUT
+# seconds is queued again, and failed after JOB_MAX_ATTEMPTS runs.
+JOB_HEARTBEAT_INTERVAL = 10
+JOB_LEASE_TIMEOUT = int(getenv("DJANGO_JOB_LEASE_TIMEOUT") or 60)
+JOB_MAX_ATTEMPTS = 3
+
+# Identical SQL shapes per request from which an N+1 is reported.
+QUERY_REPEAT_THRESHOLD = 5
+# Raise instead of logging when a view exceeds its query_budget.
+QUERY_BUDGET_STRICT = getenv("DJANGO_QUERY_BUDGET_STRICT", "0") == "1"
+
 ROOT_URLCONF = 'mysite.urls'
 
+# Keeps tests out of the shared cache and metrics directories.
+TEST_RUNNER = 'mysite.test_runner.TestRunner'
+
+FILE_UPLOAD_HANDLERS = [
+    'requestdataapp.uploadhandlers.SizeLimitUploadHandler',
+    'django.core.files.uploadhandler.MemoryFileUploadHandler',
+    'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+]
+
+# Max size of one uploaded file in bytes, checked while it is received:
+# per view name first, then per form field, then the default.
+UPLOAD_SIZE_LIMITS = {
+    "default": int(getenv("DJANGO_UPLOAD_MAX_SIZE", 10 * 1024 * 1024)),
+    "views": {
+        "requestdataapp:file-upload": 1024 * 1024,
+        "shopapp:product-upload-csv": 50 * 1024 * 1024,
+        "admin:import_products_csv": 50 * 1024 * 1024,
+    },
+    "fields": {
+        "preview": 5 * 1024 * 1024,
+        "avatar": 2 * 1024 * 1024,
+    },
+}
+# Max size of a whole request body under ASGI, checked before Django
+# reads it; leaves room for the largest file above and the form around it.
+UPLOAD_MAX_REQUEST_SIZE = int(getenv("DJANGO_UPLOAD_MAX_REQUEST_SIZE") or 64 * 1024 * 1024)
+
 
 TEMPLATES = [
     {
@@ -117,15 +174,74 @@ WSGI_APPLICATION = 'mysite.wsgi.application'
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        'ENGINE': 'mysite.db_backends.sqlite3',
         'NAME': DATABASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            'pragmas': {
+                'journal_mode': getenv("DJANGO_SQLITE_JOURNAL_MODE") or "WAL",
+                'synchronous': getenv("DJANGO_SQLITE_SYNCHRONOUS") or "NORMAL",
+                'busy_timeout': int(getenv("DJANGO_SQLITE_BUSY_TIMEOUT") or 5000),
+                'cache_size': int(getenv("DJANGO_SQLITE_CACHE_SIZE") or -20000),
+                'mmap_size': int(getenv("DJANGO_SQLITE_MMAP_SIZE") or 128 * 1024 * 1024),
+                'temp_store': getenv("DJANGO_SQLITE_TEMP_STORE") or "MEMORY",
+            },
+            # Idle connections kept per process, see mysite.db_backends.sqlite3.
+            'pool_size': int(getenv("DJANGO_SQLITE_POOL_SIZE") or 8),
+            'pool_max_age': int(getenv("DJANGO_SQLITE_POOL_MAX_AGE") or 600),
+            'transaction_mode': getenv("DJANGO_SQLITE_TRANSACTION_MODE") or "IMMEDIATE",
+        },
+        # The pool above reuses connections; a connection per thread
+        # would not survive an ASGI request anyway.
+        'CONN_MAX_AGE': 0,
+        'CONN_HEALTH_CHECKS': True,
     }
 }
+# Read-only copy of default refreshed by "manage.py sync_replica", used by
+# views with use_replica = True, see mysite.db_routers.
+DATABASES['replica'] = {
+    **DATABASES['default'],
+    'NAME': DATABASE_DIR / 'replica.sqlite3',
+    'OPTIONS': {
+        **DATABASES['default']['OPTIONS'],
+        'pragmas': {
+            **DATABASES['default']['OPTIONS']['pragmas'],
+            # The file is replaced as a whole, a WAL must not outlive it.
+            'journal_mode': "DELETE",
+            'query_only': "ON",
+        },
+        'transaction_mode': "DEFERRED",
+    },
+    'TEST': {'MIRROR': 'default'},
+}
+DATABASE_ROUTERS = ['mysite.db_routers.PrimaryReplicaRouter']
+DATABASE_REPLICA_APPS = ['shopapp']
+# Older replicas are not read, so keep it above the sync interval.
+DATABASE_REPLICA_MAX_LAG = int(getenv("DJANGO_DATABASE_REPLICA_MAX_LAG") or 120)
+
+# Short writes of the shop views are committed in batches by one thread
+# per process, see mysite.write_queue.
+WRITE_QUEUE_ENABLED = (getenv("DJANGO_WRITE_QUEUE_ENABLED") or "1") == "1"
+WRITE_QUEUE_MAX_BATCH = int(getenv("DJANGO_WRITE_QUEUE_MAX_BATCH") or 64)
+# Seconds the writer waits for more operations after the first one.
+WRITE_QUEUE_MAX_WAIT = float(getenv("DJANGO_WRITE_QUEUE_MAX_WAIT") or 0.002)
 
 CACHES = {
     "default": {
+        "BACKEND": "mysite.cache_backends.TwoTierCache",
+        "OPTIONS": {
+            "SHARED": "shared",
+            "LOCAL_MAX_ENTRIES": int(getenv("DJANGO_LOCAL_CACHE_MAX_ENTRIES", "1000")),
+            "LOCAL_TIMEOUT": int(getenv("DJANGO_LOCAL_CACHE_TIMEOUT", "10")),
+        },
+    },
+    # Must be shared by the web and job worker containers: change stamps
+    # bumped by a job invalidate the pages cached by the web workers.
+    "shared": {
         "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
-        "LOCATION": "/var/tmp/django_cache",
+        "LOCATION": getenv("DJANGO_CACHE_DIR") or "/var/tmp/django_cache",
+        # Room for cached API responses, pages and change stamps; the
+        # default 300 culls them early.
+        "OPTIONS": {"MAX_ENTRIES": 5000},
     },
 }
 
@@ -201,6 +317,8 @@ REST_FRAMEWORK = {
         "django_filters.rest_framework.DjangoFilterBackend",
     ],
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
+    # WriteTimeout of the write queue becomes 503 with Retry-After.
+    'EXCEPTION_HANDLER': 'mysite.write_queue.api_exception_handler',
 }
 
 # SPECTACULAR_SETTINGS = {
@@ -211,19 +329,40 @@ REST_FRAMEWORK = {
 # }
 
 LOGLEVEL = getenv("DJANGO_LOGLEVEL", "info").upper()
+# "json" for one JSON object per line, "console" for plain text.
+LOG_FORMAT = getenv("DJANGO_LOG_FORMAT", "json")
+# Share of records below WARNING kept per logger, for chatty debug output.
+LOG_SAMPLING = {
+    "requestdataapp.middlewares": 0.01,
+    "shopapp.views": 0.1,
+}
 
 logging.config.dictConfig({
     "version": 1,
     "disable_existing_loggers": False,
     "formatters": {
         "console": {
-            "format": "%(asctime)s %(levelname)s [%(name)s:%(lineno)s] %(module)s %(message)s",
+            "format": "%(asctime)s %(levelname)s [%(name)s:%(lineno)s] %(request_id)s %(message)s",
+        },
+        "json": {
+            "()": "mysite.jsonlog.JsonFormatter",
+        },
+    },
+    "filters": {
+        "request_context": {
+            "()": "mysite.jsonlog.RequestContextFilter",
+        },
+        "sampling": {
+            "()": "mysite.jsonlog.SamplingFilter",
+            "rates": LOG_SAMPLING,
         },
     },
     "handlers": {
         "console": {
-            "class": "logging.StreamHandler",
-            "formatter": "console",
+            # Writes from a background thread, see mysite.jsonlog.
+            "class": "mysite.jsonlog.QueueStreamHandler",
+            "formatter": LOG_FORMAT,
+            "filters": ["sampling", "request_context"],
         },
     },
     "loggers": {
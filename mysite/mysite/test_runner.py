@@ -0,0 +1,36 @@
+"""
+Запуск тестов без общих каталогов кэша и метрик.
+
+Кэш ``"shared"`` и ``METRICS_DIR`` по умолчанию лежат в ``/var/tmp`` и
+переживают прогон: закэшированные ответы прошлого запуска давали бы
+``HIT`` там, где тест ждёт ``MISS``. На время тестов общий уровень кэша
+заменяется на LocMem, а метрики пишутся во временный каталог. Тесты,
+зависящие от пустого кэша, сами чистят его в ``setUp``.
+"""
+from tempfile import TemporaryDirectory
+
+from django.conf import settings
+from django.test import override_settings
+from django.test.runner import DiscoverRunner
+
+
+class TestRunner(DiscoverRunner):
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._metrics_dir = TemporaryDirectory(prefix="django_metrics_")
+        self._overrides = override_settings(
+            CACHES={
+                **settings.CACHES,
+                "shared": {
+                    "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+                    "LOCATION": "tests",
+                },
+            },
+            METRICS_DIR=self._metrics_dir.name,
+        )
+        self._overrides.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self._overrides.disable()
+        self._metrics_dir.cleanup()
+        super().teardown_test_environment(**kwargs)
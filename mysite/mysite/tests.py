@@ -0,0 +1,378 @@
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+from pathlib import Path
+from tempfile import mkdtemp
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth.models import Group, User
+from django.core.cache import caches
+from django.db import transaction
+from django.db.utils import ConnectionHandler, IntegrityError
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+
+from mysite.cache_backends import TwoTierCache
+from mysite.db_backends.sqlite3.base import DEFAULT_PRAGMAS
+from mysite.db_routers import PrimaryReplicaRouter, RoutingState, _state_var
+from mysite.jsonlog import JsonFormatter, RequestContextFilter, SamplingFilter, request_id_var
+from mysite.metrics import Counter, Histogram, MmapValues, collect, prune_exited_processes, render_metrics
+from mysite.queries import QueryRecorder, sql_shape
+from mysite.write_queue import WriteQueue, WriteTimeout
+from shopapp.models import Product
+
+CACHES = {
+    "default": {
+        "BACKEND": "mysite.cache_backends.TwoTierCache",
+        "OPTIONS": {
+            "SHARED": "shared",
+            "LOCAL_MAX_ENTRIES": 2,
+        },
+    },
+    "shared": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "two-tier-tests",
+    },
+}
+
+
+@override_settings(CACHES=CACHES)
+class TwoTierCacheTestCase(SimpleTestCase):
+    def setUp(self) -> None:
+        self.cache: TwoTierCache = caches["default"]
+        self.cache.clear()
+
+    def test_local_hit_after_shared_hit(self):
+        # Stats are kept per cache object, across tests.
+        before = self.cache.stats()
+        caches["shared"].set("key", {"a": 1})
+        self.assertEqual(self.cache.get("key"), {"a": 1})
+        self.assertEqual(self.cache.get("key"), {"a": 1})
+        stats = self.cache.stats()
+        self.assertEqual(stats["local"]["hits"] - before["local"]["hits"], 1)
+        self.assertEqual(stats["shared"]["hits"] - before["shared"]["hits"], 1)
+
+    def test_local_values_are_copies(self):
+        self.cache.set("key", {"a": 1})
+        self.cache.get("key")["a"] = 2
+        self.assertEqual(self.cache.get("key"), {"a": 1})
+
+    def test_local_tier_is_bounded(self):
+        for key in ("a", "b", "c"):
+            self.cache.set(key, key)
+        self.assertEqual(self.cache.stats()["local_entries"], 2)
+        self.assertEqual(self.cache.get("a"), "a")
+
+    def test_stamps_bypass_local_tier(self):
+        self.cache.set("change_stamp:product", 1)
+        caches["shared"].set("change_stamp:product", 2)
+        self.assertEqual(self.cache.get("change_stamp:product"), 2)
+
+    def test_computed_entries_bypass_local_tier(self):
+        # Another worker refreshed the entry of get_or_compute.
+        self.cache.set("computed:export", {"version": 1})
+        caches["shared"].set("computed:export", {"version": 2})
+        self.assertEqual(self.cache.get("computed:export"), {"version": 2})
+
+
+class SQLiteBackendTestCase(SimpleTestCase):
+    def setUp(self):
+        self.path = Path(mkdtemp()) / "db.sqlite3"
+        self.connections = ConnectionHandler({
+            "default": {
+                "ENGINE": "mysite.db_backends.sqlite3",
+                "NAME": self.path,
+                "OPTIONS": {"pool_size": 2, "transaction_mode": "IMMEDIATE"},
+            },
+        })
+        self.connection = self.connections["default"]
+
+    def tearDown(self):
+        self.connections.close_all()
+
+    def test_pragmas_applied(self):
+        with self.connection.cursor() as cursor:
+            self.assertEqual(cursor.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+            self.assertEqual(cursor.execute("PRAGMA synchronous").fetchone()[0], 1)
+            self.assertEqual(cursor.execute("PRAGMA busy_timeout").fetchone()[0], DEFAULT_PRAGMAS["busy_timeout"])
+            self.assertEqual(cursor.execute("PRAGMA temp_store").fetchone()[0], 2)
+
+    def test_connections_are_pooled(self):
+        self.connection.ensure_connection()
+        raw = self.connection.connection
+        self.connection.close()
+        self.connection.ensure_connection()
+        self.assertIs(self.connection.connection, raw)
+
+    def test_replaced_file_is_reopened(self):
+        self.connection.ensure_connection()
+        raw = self.connection.connection
+        self.connection.close()
+        replacement = self.path.with_name("new.sqlite3")
+        sqlite3.connect(replacement).close()
+        os.replace(replacement, self.path)
+        self.assertFalse(self.connection.is_usable())
+
+        self.connection.ensure_connection()
+        self.assertIsNot(self.connection.connection, raw)
+
+    def test_backup(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute("CREATE TABLE item (name TEXT)")
+            cursor.execute("INSERT INTO item VALUES ('copied')")
+        output = self.path.with_name("replica.sqlite3")
+        self.connection.backup_to(output)
+
+        replica = sqlite3.connect(output)
+        try:
+            self.assertEqual(replica.execute("PRAGMA journal_mode").fetchone()[0], "delete")
+            self.assertEqual(replica.execute("SELECT name FROM item").fetchall(), [("copied",)])
+        finally:
+            replica.close()
+
+    def test_transaction_takes_write_lock(self):
+        # What atomic() runs first on SQLite.
+        self.connection._start_transaction_under_autocommit()
+        other = sqlite3.connect(self.path, timeout=0)
+        try:
+            with self.assertRaisesMessage(sqlite3.OperationalError, "locked"):
+                other.execute("BEGIN IMMEDIATE")
+        finally:
+            other.close()
+            self.connection.connection.rollback()
+
+
+class ReplicaRoutingTestCase(TransactionTestCase):
+    # Not TestCase: its transaction would keep all reads on default.
+    def setUp(self):
+        self.router = PrimaryReplicaRouter()
+        self.state = RoutingState()
+        self.state.replica = True
+        token = _state_var.set(self.state)
+        self.addCleanup(_state_var.reset, token)
+
+    def test_reads_of_replica_apps_go_to_replica(self):
+        self.assertEqual(self.router.db_for_read(Product), "replica")
+        self.assertIsNone(self.router.db_for_read(User))
+
+        self.state.replica = False
+        self.assertIsNone(self.router.db_for_read(Product))
+
+    def test_reads_after_write_stay_on_default(self):
+        self.assertEqual(self.router.db_for_write(Product), "default")
+        self.assertIsNone(self.router.db_for_read(Product))
+
+    def test_reads_in_transaction_stay_on_default(self):
+        with transaction.atomic():
+            self.assertIsNone(self.router.db_for_read(Product))
+
+
+class WriteQueueTestCase(TransactionTestCase):
+    def setUp(self):
+        self.queue = WriteQueue(max_batch=5, max_wait=0.2)
+        self.addCleanup(self.queue.stop)
+
+    def test_operations_share_one_commit(self):
+        events = []
+
+        def create(name):
+            transaction.on_commit(lambda: events.append(f"commit {name}"))
+            events.append(f"create {name}")
+            return Group.objects.create(name=name)
+
+        futures = [self.queue.submit(create, str(number)) for number in range(5)]
+
+        self.assertEqual([future.result().name for future in futures], ["0", "1", "2", "3", "4"])
+        self.assertEqual(events[:5], ["create 0", "create 1", "create 2", "create 3", "create 4"])
+        self.assertEqual(sorted(events[5:]), ["commit 0", "commit 1", "commit 2", "commit 3", "commit 4"])
+
+    def test_failed_operation_is_rolled_back_alone(self):
+        futures = [
+            self.queue.submit(Group.objects.create, name="buyers"),
+            self.queue.submit(Group.objects.create, name="buyers"),
+            self.queue.submit(Group.objects.create, name="sellers"),
+        ]
+
+        futures[0].result()
+        with self.assertRaises(IntegrityError):
+            futures[1].result()
+        futures[2].result()
+        self.assertQuerysetEqual(Group.objects.order_by("name"), ["buyers", "sellers"], transform=str)
+
+    def test_runs_inline_in_transaction(self):
+        with transaction.atomic():
+            future = self.queue.submit(Group.objects.create, name="buyers")
+            self.assertTrue(future.done())
+            self.assertIsNone(self.queue._thread)
+
+    def test_wait_gives_up_on_a_stuck_queue(self):
+        busy_timeout = settings.DATABASES["default"]["OPTIONS"]["pragmas"]["busy_timeout"]
+        self.assertEqual(self.queue.result_timeout(), 2 * busy_timeout / 1000 + 0.2)
+
+        queue = WriteQueue(max_batch=1, max_wait=0, timeout=0.1)
+        self.addCleanup(queue.stop)
+        release = threading.Event()
+        self.addCleanup(release.set)
+        stuck = queue.submit(release.wait, 5)
+
+        with self.assertRaisesMessage(WriteTimeout, "it was dropped") as raised:
+            queue.wait(queue.submit(Group.objects.create, name="buyers"))
+        self.assertEqual(raised.exception.retry_after, 1)
+        with self.assertRaisesMessage(WriteTimeout, "it may still be committed"):
+            queue.wait(stuck)
+
+        release.set()
+        self.assertTrue(stuck.result())
+        queue.stop()
+        self.assertFalse(Group.objects.exists())
+
+
+@override_settings(METRICS_DIR=mkdtemp(), METRICS_TOKEN="")
+class MetricsTestCase(TestCase):
+    def test_values_of_all_processes_are_summed(self):
+        counter = Counter("test_jobs_total", "Jobs.", ["state"])
+        counter.inc(state="done")
+        counter.inc(2, state="done")
+
+        # Another worker's file in the same directory.
+        other = MmapValues(Path(settings.METRICS_DIR) / "metrics_999999.db")
+        other.add('["test_jobs_total", [["state", "done"]]]', 4)
+        other.close()
+
+        self.assertEqual(collect()[("test_jobs_total", (("state", "done"),))], 7)
+        self.assertIn('test_jobs_total{state="done"} 7.0', render_metrics())
+
+    def test_file_grows(self):
+        counter = Counter("test_wide_total", "Many label values.", ["key"])
+        for number in range(3000):
+            counter.inc(key=f"value-{number}")
+        self.assertEqual(collect()[("test_wide_total", (("key", "value-2999"),))], 1)
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = Histogram("test_seconds", "Durations.", buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 5):
+            histogram.observe(value)
+        text = render_metrics()
+        self.assertIn('test_seconds_bucket{le="0.1"} 1.0', text)
+        self.assertIn('test_seconds_bucket{le="1.0"} 2.0', text)
+        self.assertIn('test_seconds_bucket{le="+Inf"} 3.0', text)
+        self.assertIn("test_seconds_count 3.0", text)
+
+    def test_requests_are_recorded(self):
+        self.client.get(reverse("requestdataapp:get_view"), HTTP_USER_AGENT='Mozilla/5.0')
+        response = self.client.get(reverse("metrics"), HTTP_USER_AGENT='Mozilla/5.0')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain; version=0.0.4"))
+        text = response.content.decode()
+        self.assertIn(
+            'django_http_requests_total{method="GET",status="200",view="requestdataapp:get_view"} 1.0',
+            text,
+        )
+        self.assertIn('django_http_request_duration_seconds_count{view="requestdataapp:get_view"} 1.0', text)
+        self.assertIn("# TYPE django_db_queries_total counter", text)
+
+    def test_files_of_exited_processes_are_folded(self):
+        path = Path(settings.METRICS_DIR) / f"metrics_{socket.gethostname()}_999999.db"
+        exited = MmapValues(path)
+        exited.add('["test_exited_total", []]', 3)
+        exited.close()
+
+        prune_exited_processes()
+        self.assertFalse(path.exists())
+        self.assertEqual(collect()[("test_exited_total", ())], 3)
+
+    def test_internal_ips_or_staff_without_token(self):
+        url = reverse("metrics")
+        outside = {"HTTP_USER_AGENT": "Mozilla/5.0", "REMOTE_ADDR": "203.0.113.5"}
+        self.assertEqual(self.client.get(url, **outside).status_code, 403)
+        self.client.force_login(User.objects.create_user("ops", is_staff=True))
+        self.assertEqual(self.client.get(url, **outside).status_code, 200)
+
+    @override_settings(METRICS_TOKEN="secret")
+    def test_token_required(self):
+        url = reverse("metrics")
+        self.assertEqual(self.client.get(url, HTTP_USER_AGENT='Mozilla/5.0').status_code, 403)
+        response = self.client.get(url, HTTP_USER_AGENT='Mozilla/5.0', HTTP_AUTHORIZATION="Bearer secret")
+        self.assertEqual(response.status_code, 200)
+
+
+class QueryInspectionTestCase(TestCase):
+    def test_sql_shape_collapses_placeholder_lists(self):
+        self.assertEqual(
+            sql_shape("SELECT * FROM t WHERE id IN (%s, %s, %s) AND a = %s"),
+            sql_shape("SELECT * FROM t WHERE id IN (%s,%s) AND a = %s"),
+        )
+
+    def test_repeated_shapes(self):
+        recorder = QueryRecorder()
+        execute = lambda sql, params, many, context: None  # noqa: E731
+        for pk in range(6):
+            recorder(execute, "SELECT * FROM profile WHERE user_id = %s", [pk], False, {})
+        recorder(execute, "SELECT * FROM auth_user", [], False, {})
+        self.assertEqual(recorder.count, 7)
+        self.assertEqual(recorder.repeated(5), [("SELECT * FROM profile WHERE user_id = %s", 6)])
+
+    def test_server_timing_for_staff_only(self):
+        user = User.objects.create_user(username="viewer", password="qwerty")
+        self.client.force_login(user)
+        url = reverse("myauth:users-list")
+        response = self.client.get(url, HTTP_USER_AGENT='Mozilla/5.0')
+        self.assertNotIn("Server-Timing", response)
+
+        user.is_staff = True
+        user.save()
+        response = self.client.get(url, HTTP_USER_AGENT='Mozilla/5.0')
+        self.assertRegex(response["Server-Timing"], r'^db;dur=[0-9.]+;desc="\d+ queries", total;dur=')
+
+    def test_async_view_queries_are_recorded(self):
+        user = User.objects.create_user(username="viewer", password="qwerty", is_staff=True)
+        self.async_client.force_login(user)
+        response = async_to_sync(self.async_client.get)(
+            reverse("shopapp:products-export"),
+            {"after": 0},
+            headers={'User-Agent': 'Mozilla/5.0'},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("X-Request-ID", response)
+        self.assertRegex(response["Server-Timing"], r'desc="1 queries"')
+
+
+class StructuredLoggingTestCase(TestCase):
+    def make_record(self, name: str = "shopapp.views", level: int = logging.DEBUG) -> logging.LogRecord:
+        return logging.LogRecord(name, level, __file__, 1, "Loaded %s", ("products",), None)
+
+    def test_json_record_with_request_context(self):
+        record = self.make_record()
+        record.duration_ms = 1.5
+        token = request_id_var.set("abc")
+        try:
+            RequestContextFilter().filter(record)
+        finally:
+            request_id_var.reset(token)
+        data = json.loads(JsonFormatter().format(record))
+        self.assertEqual(data["message"], "Loaded products")
+        self.assertEqual(data["request_id"], "abc")
+        self.assertEqual(data["duration_ms"], 1.5)
+        self.assertNotIn("view", data)
+
+    def test_sampling_by_logger(self):
+        sampling = SamplingFilter({"shopapp": 0.0})
+        self.assertFalse(sampling.filter(self.make_record("shopapp.views")))
+        self.assertTrue(sampling.filter(self.make_record("shopapp.views", logging.WARNING)))
+        self.assertTrue(sampling.filter(self.make_record("myauth.views")))
+
+    def test_access_log_and_request_id(self):
+        with self.assertLogs("mysite.jsonlog", "INFO") as logs:
+            response = self.client.get(
+                reverse("requestdataapp:get_view"),
+                HTTP_USER_AGENT='Mozilla/5.0',
+                HTTP_X_REQUEST_ID="req-1",
+            )
+        self.assertEqual(response["X-Request-ID"], "req-1")
+        [record] = logs.records
+        self.assertEqual(record.status, 200)
+        self.assertGreaterEqual(record.duration_ms, 0)
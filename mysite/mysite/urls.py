@@ -27,6 +27,7 @@ from drf_spectacular.views import (SpectacularAPIView,
 
 from django.contrib.sitemaps.views import sitemap
 
+from .metrics import metrics_view
 from .sitemaps import sitemaps
 
 urlpatterns = [
@@ -35,6 +36,7 @@ urlpatterns = [
 
     path('', include('main.urls')),
     path('req/', include('requestdataapp.urls')),
+    path('metrics', metrics_view, name='metrics'),
 ]
 
 urlpatterns += i18n_patterns(
@@ -45,6 +47,7 @@ urlpatterns += i18n_patterns(
     path('api/schema/swagger/', SpectacularSwaggerView.as_view(url_name='schema'), name='swagger'),
     path('api/schema/redoc/', SpectacularRedocView.as_view(url_name='schema'), name='redoc'),
     path('api/', include('myapiapp.urls')),
+    path('jobs/', include('jobsapp.urls')),
 
     path('blog/', include('blogapp.urls')),
 
@@ -0,0 +1,310 @@
+"""
+Групповая фиксация коротких записей в SQLite.
+
+SQLite допускает одного писателя, и каждая фиксация транзакции стоит
+fsync. ``submit_write(func, ...)`` не пишет сам, а передаёт ``func``
+потоку-писателю процесса. Тот набирает пачку до ``WRITE_QUEUE_MAX_BATCH``
+операций, ожидая следующие не дольше ``WRITE_QUEUE_MAX_WAIT`` секунд, и
+выполняет её одной транзакцией: каждая операция в своей точке сохранения,
+поэтому ошибка одной откатывает только её. Вызывающий ждёт future и
+получает результат (или исключение) лишь после фиксации всей пачки.
+Ждёт он не дольше двух ожиданий блокировки базы (``busy_timeout``):
+своей пачки и пачки перед ней. Иначе ``submit_write`` бросает
+``WriteTimeout``; ещё не начатая операция при этом отменяется.
+``WriteTimeoutMiddleware`` и ``api_exception_handler`` отвечают на него
+503 с ``Retry-After``.
+
+Очередь упорядочивает записи только внутри процесса. Между процессами
+(воркеры gunicorn, обработчик задач) писателей по-прежнему разводят
+``BEGIN IMMEDIATE`` и ``busy_timeout`` SQLite.
+
+Операции выполняются в контексте вызвавшего, так что метрики запросов и
+маршрутизация по репликам видят их как свои. Если вызывающий уже внутри
+транзакции (``atomic``), операция выполняется сразу в ней: её запись
+должна быть видна и откатываться вместе с транзакцией.
+
+Запись становится надёжной в смысле ``PRAGMA synchronous``: при ``NORMAL``
+в режиме WAL она переживает падение процесса, при ``FULL`` и отключение
+питания.
+"""
+import contextvars
+import logging
+import math
+import os
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from queue import Empty, SimpleQueue
+from time import monotonic
+from typing import Any, Callable, List, Optional, Tuple
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.http import HttpRequest, HttpResponse
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.views import exception_handler
+
+from .metrics import Histogram
+
+log = logging.getLogger(__name__)
+
+DB_WRITE_BATCH_SIZE = Histogram(
+    "django_db_write_batch_size",
+    "Operations committed together by the write queue.",
+    ["alias"],
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128),
+)
+
+Operation = Tuple[Future, contextvars.Context, Callable, tuple, dict]
+
+# Stops the writer thread.
+_STOP = None
+
+
+class WriteTimeout(TimeoutError):
+    """
+    The write queue did not commit an operation in time.
+    """
+    def __init__(self, message: str, retry_after: int = 1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class WriteQueue:
+    """
+    One writer thread committing the queued operations on ``using`` in
+    batches.
+    """
+    def __init__(
+            self,
+            using: str = DEFAULT_DB_ALIAS,
+            max_batch: int = 64,
+            max_wait: float = 0.002,
+            timeout: Optional[float] = None,
+    ):
+        self.using = using
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._reset()
+        os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self) -> None:
+        # A forked child inherits the queue but not the writer thread.
+        self._queue = SimpleQueue()
+        self._thread = None
+
+    def submit(self, func: Callable, *args, **kwargs) -> Future:
+        """
+        Queues ``func(*args, **kwargs)``; the future resolves once its
+        batch is committed.
+        """
+        future = Future()
+        if self.runs_inline():
+            try:
+                future.set_result(func(*args, **kwargs))
+            except Exception as exc:
+                future.set_exception(exc)
+            return future
+        self.start()
+        self._queue.put((future, contextvars.copy_context(), func, args, kwargs))
+        return future
+
+    def wait(self, future: Future) -> Any:
+        """
+        Returns the result of a submitted operation, raising WriteTimeout
+        if it is not committed within ``result_timeout()`` seconds.
+        """
+        timeout = self.result_timeout()
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeout:
+            retry_after = max(1, math.ceil(timeout))
+            if future.cancel():
+                raise WriteTimeout(
+                    f"Write queue of {self.using!r} did not start the write within {timeout:g}s, it was dropped",
+                    retry_after,
+                ) from None
+            raise WriteTimeout(
+                f"Write queue of {self.using!r} did not commit the write within {timeout:g}s, it may still be committed",
+                retry_after,
+            ) from None
+
+    def result_timeout(self) -> float:
+        if self.timeout is not None:
+            return self.timeout
+        # The batch ahead and the caller's own may each wait for the lock.
+        return 2 * self.lock_timeout() + self.max_wait
+
+    def lock_timeout(self) -> float:
+        """
+        Seconds a connection to ``using`` waits for the write lock.
+        """
+        options = connections[self.using].settings_dict.get("OPTIONS", {})
+        busy_timeout = options.get("pragmas", {}).get("busy_timeout")
+        if busy_timeout is not None:
+            return busy_timeout / 1000
+        return options.get("timeout", 5)
+
+    def runs_inline(self) -> bool:
+        # The writer thread itself, or a caller whose transaction must
+        # contain the write.
+        return (
+            threading.current_thread() is self._thread
+            or connections[self.using].in_atomic_block
+        )
+
+    def start(self) -> None:
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=f"write-queue-{self.using}", daemon=True)
+                self._thread.start()
+
+    def stop(self) -> None:
+        """
+        Commits what is queued and stops the writer thread.
+        """
+        with self._lock:
+            thread = self._thread
+            if thread is None:
+                return
+            self._queue.put(_STOP)
+        thread.join()
+        with self._lock:
+            self._thread = None
+
+    def _run(self) -> None:
+        try:
+            while True:
+                batch, stop = self._next_batch()
+                if batch:
+                    self._commit(batch)
+                    connections[self.using].close_if_unusable_or_obsolete()
+                if stop:
+                    return
+        finally:
+            connections[self.using].close()
+
+    def _next_batch(self) -> Tuple[List[Operation], bool]:
+        first = self._queue.get()
+        if first is _STOP:
+            return [], True
+        batch = [first]
+        deadline = monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            try:
+                operation = self._queue.get(timeout=max(deadline - monotonic(), 0))
+            except Empty:
+                break
+            if operation is _STOP:
+                return batch, True
+            batch.append(operation)
+        return batch, False
+
+    def _commit(self, batch: List[Operation]) -> None:
+        # Skips operations given up by wait(), the rest can't be cancelled.
+        batch = [operation for operation in batch if operation[0].set_running_or_notify_cancel()]
+        if not batch:
+            return
+        results = []
+        try:
+            with transaction.atomic(using=self.using):
+                for future, context, func, args, kwargs in batch:
+                    results.append(context.run(self._apply, func, args, kwargs))
+        except Exception as exc:
+            log.exception("Write batch of %s operations failed", len(batch))
+            for future, *_ in batch:
+                future.set_exception(exc)
+            return
+        DB_WRITE_BATCH_SIZE.observe(len(batch), alias=self.using)
+        for (future, *_), (result, exc) in zip(batch, results):
+            if exc is None:
+                future.set_result(result)
+            else:
+                future.set_exception(exc)
+
+    def _apply(self, func: Callable, args: tuple, kwargs: dict) -> Tuple[Any, Optional[Exception]]:
+        try:
+            with transaction.atomic(using=self.using):
+                return func(*args, **kwargs), None
+        except Exception as exc:
+            return None, exc
+
+
+_queue: Optional[WriteQueue] = None
+_queue_lock = threading.Lock()
+
+
+def get_write_queue() -> WriteQueue:
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = WriteQueue(
+                max_batch=settings.WRITE_QUEUE_MAX_BATCH,
+                max_wait=settings.WRITE_QUEUE_MAX_WAIT,
+            )
+        return _queue
+
+
+def submit_write(func: Callable, *args, **kwargs) -> Any:
+    """
+    Runs ``func(*args, **kwargs)`` through the write queue and returns its
+    result once committed; runs it directly if the queue is disabled.
+
+    Raises WriteTimeout if the queue does not commit it in time.
+    """
+    if not settings.WRITE_QUEUE_ENABLED:
+        return func(*args, **kwargs)
+    queue = get_write_queue()
+    return queue.wait(queue.submit(func, *args, **kwargs))
+
+
+class WriteTimeoutMiddleware:
+    """
+    Answers a WriteTimeout raised by a view with 503 and ``Retry-After``
+    instead of a 500.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.get_response(request)
+
+    async def __acall__(self, request: HttpRequest) -> HttpResponse:
+        return await self.get_response(request)
+
+    def process_exception(self, request: HttpRequest, exception: Exception) -> Optional[HttpResponse]:
+        if not isinstance(exception, WriteTimeout):
+            return None
+        log.warning("Write timed out: %s", exception)
+        response = HttpResponse(
+            "The database is busy, please retry.",
+            status=503,
+            content_type="text/plain; charset=utf-8",
+        )
+        response["Retry-After"] = str(exception.retry_after)
+        return response
+
+
+def api_exception_handler(exc: Exception, context: dict) -> Optional[Response]:
+    """
+    DRF exception handler answering a WriteTimeout with 503 and
+    ``Retry-After``; everything else goes to the default handler.
+    """
+    if isinstance(exc, WriteTimeout):
+        log.warning("Write timed out: %s", exc)
+        return Response(
+            {"detail": "The database is busy, please retry."},
+            status=status.HTTP_503_SERVICE_UNAVAILABLE,
+            headers={"Retry-After": str(exc.retry_after)},
+        )
+    return exception_handler(exc, context)
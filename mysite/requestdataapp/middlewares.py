@@ -1,48 +1,26 @@
-from django.http import HttpRequest
-import time
-from django.shortcuts import render
-
-
-def setup_useragent_on_request_middleware(get_response):
-    print('initial call')
+import logging
 
-    def middleware(request: HttpRequest):
-        print('before get response')
-        request.user_agent = request.META['HTTP_USER_AGENT']
-        response = get_response(request)
-        print('after get response')
-        return response
+from asgiref.sync import iscoroutinefunction
+from django.http import HttpRequest
+from django.utils.decorators import sync_and_async_middleware
 
-    return middleware
+log = logging.getLogger(__name__)
 
 
-class CountRequestsMiddleware:
-    def __init__(self, get_response):
-        self.get_response = get_response
-        self.requests_count = 0
-        self.responses_count = 0
-        self.exceptions_count = 0
-        self.request_time = {}
+def set_user_agent(request: HttpRequest) -> None:
+    request.user_agent = request.META['HTTP_USER_AGENT']
+    log.debug("User agent: %s", request.user_agent)
 
-    def __call__(self, request: HttpRequest):
-        # time_delay = 10
-        # if not self.request_time:
-        #     print('This is a first request since server restart. The dictionary is empty yet!')
-        # else:
-        #     if ((round(time.time()) * 1) - self.request_time['time'] < time_delay
-        #             and self.request_time['ip_address'] == request.META.get('REMOTE_ADDR')):
-        #         print('Less than 10 seconds have passed since for re-request from your IP!')
-        #         return render(request, 'requestdataapp/error-request.html')
-        #
-        # self.request_time = {'time': round(time.time()) * 1, 'ip_address': request.META.get('REMOTE_ADDR')}
 
-        self.requests_count += 1
-        print('requests count: ', self.responses_count)
-        response = self.get_response(request)
-        self.responses_count += 1
-        print('responses count: ', self.responses_count)
-        return response
+@sync_and_async_middleware
+def setup_useragent_on_request_middleware(get_response):
+    if iscoroutinefunction(get_response):
+        async def middleware(request: HttpRequest):
+            set_user_agent(request)
+            return await get_response(request)
+    else:
+        def middleware(request: HttpRequest):
+            set_user_agent(request)
+            return get_response(request)
 
-    def process_exception(self, request: HttpRequest, exception: Exception):
-        self.exceptions_count += 1
-        print('got ', self.exceptions_count, 'exceptions so far')
+    return middleware
@@ -1,3 +1,81 @@
-from django.test import TestCase
+import json
+from tempfile import mkdtemp
 
-# Create your tests here.
+from django.core.asgi import get_asgi_application
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from .uploadhandlers import RequestBodyLimitMiddleware
+
+UPLOAD_LIMITS = {
+    "default": 1000,
+    "views": {"requestdataapp:file-upload": 100},
+    "fields": {},
+}
+
+
+@override_settings(UPLOAD_SIZE_LIMITS=UPLOAD_LIMITS, MEDIA_ROOT=mkdtemp())
+class UploadSizeLimitTestCase(TestCase):
+    def upload(self, size: int, **extra):
+        return self.client.post(
+            reverse("requestdataapp:file-upload"),
+            {"file": SimpleUploadedFile("data.txt", b"x" * size)},
+            HTTP_USER_AGENT='Mozilla/5.0',
+            **extra,
+        )
+
+    def test_small_file_accepted(self):
+        response = self.upload(100, HTTP_ACCEPT="text/html")
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("upload_too_large", response.wsgi_request.__dict__)
+
+    def test_large_file_rejected_while_streaming(self):
+        response = self.upload(101, HTTP_ACCEPT="text/html")
+        self.assertEqual(response.status_code, 413)
+        self.assertContains(response, "larger than 100 bytes", status_code=413)
+
+    def test_json_response_for_api_clients(self):
+        response = self.upload(5000, HTTP_ACCEPT="application/json")
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(response.json(), {"detail": "File 'file' is larger than 100 bytes"})
+
+
+class RequestBodyLimitMiddlewareTestCase(SimpleTestCase):
+    def setUp(self):
+        self.application = RequestBodyLimitMiddleware(get_asgi_application(), limit=100)
+        self.chunks = []
+        self.sent = []
+
+    async def receive(self):
+        if not self.chunks:
+            return {"type": "http.request", "body": b"", "more_body": False}
+        return {"type": "http.request", "body": self.chunks.pop(0), "more_body": True}
+
+    async def send(self, message):
+        self.sent.append(message)
+
+    async def call(self, headers=()):
+        scope = {
+            "type": "http",
+            "method": "POST",
+            "path": reverse("requestdataapp:file-upload"),
+            "query_string": b"",
+            "headers": [(b"user-agent", b"Mozilla/5.0"), *headers],
+        }
+        await self.application(scope, self.receive, self.send)
+        return self.sent[0]["status"], json.loads(self.sent[-1]["body"])
+
+    async def test_content_length_rejected_before_body_is_read(self):
+        self.chunks = [b"x" * 1000]
+        status, data = await self.call(headers=[(b"content-length", b"1000")])
+        self.assertEqual(status, 413)
+        self.assertEqual(data, {"detail": "Request body is larger than 100 bytes"})
+        self.assertEqual(self.chunks, [b"x" * 1000])
+
+    async def test_streamed_body_stopped_at_limit(self):
+        self.chunks = [b"x" * 60] * 5
+        status, data = await self.call()
+        self.assertEqual(status, 413)
+        self.assertEqual(data, {"detail": "Request body is larger than 100 bytes"})
+        self.assertEqual(len(self.chunks), 3)
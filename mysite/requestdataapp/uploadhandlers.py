@@ -0,0 +1,180 @@
+"""
+Ограничение размера загружаемых файлов во время загрузки.
+
+``SizeLimitUploadHandler`` считает байты по мере поступления частей
+файла и прерывает разбор запроса, как только файл превысил лимит,
+не дожидаясь записи его на диск. ``UploadLimitMiddleware`` отвечает
+на такой запрос кодом 413.
+
+Под ASGI Django читает всё тело запроса до middleware, поэтому
+``RequestBodyLimitMiddleware`` оборачивает само ASGI-приложение: запрос
+с ``Content-Length`` больше ``settings.UPLOAD_MAX_REQUEST_SIZE``
+отклоняется до чтения тела, а тело без длины обрывается, как только
+пришло больше лимита.
+
+Лимиты задаются в ``settings.UPLOAD_SIZE_LIMITS``: сначала ищется лимит
+для view (``"namespace:url_name"``), затем для имени поля формы, затем
+берётся ``"default"``.
+"""
+import json
+import logging
+from typing import Optional
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.files.uploadhandler import FileUploadHandler, StopUpload
+from django.http import HttpRequest, HttpResponse, JsonResponse
+from django.shortcuts import render
+
+log = logging.getLogger(__name__)
+
+
+def get_upload_limit(request: HttpRequest, field_name: str) -> Optional[int]:
+    limits = getattr(settings, "UPLOAD_SIZE_LIMITS", {})
+    match = getattr(request, "resolver_match", None)
+    view_limits = limits.get("views", {})
+    if match is not None and match.view_name in view_limits:
+        return view_limits[match.view_name]
+    return limits.get("fields", {}).get(field_name, limits.get("default"))
+
+
+class SizeLimitUploadHandler(FileUploadHandler):
+    """
+    Passes chunks through to the next handler while counting them.
+
+    Must come first in ``FILE_UPLOAD_HANDLERS``.
+    """
+    def new_file(self, field_name, *args, **kwargs):
+        super().new_file(field_name, *args, **kwargs)
+        self.limit = get_upload_limit(self.request, field_name)
+        self.received = 0
+
+    def receive_data_chunk(self, raw_data: bytes, start: int) -> bytes:
+        self.received += len(raw_data)
+        if self.limit is not None and self.received > self.limit:
+            log.warning(
+                "Upload of %r to %s stopped after %d bytes, limit is %d",
+                self.field_name, self.request.path, self.received, self.limit,
+            )
+            self.request.upload_too_large = (self.field_name, self.limit)
+            # Stop reading the body right away instead of draining it.
+            raise StopUpload(connection_reset=True)
+        return raw_data
+
+    def file_complete(self, file_size: int):
+        return None
+
+
+def upload_too_large_response(request: HttpRequest) -> HttpResponse:
+    field_name, limit = request.upload_too_large
+    detail = f"File {field_name!r} is larger than {limit} bytes"
+    if "text/html" not in request.META.get("HTTP_ACCEPT", ""):
+        return JsonResponse({"detail": detail}, status=413)
+    return render(request, "requestdataapp/error-upload.html", {"detail": detail}, status=413)
+
+
+class UploadLimitMiddleware:
+    """
+    Parses multipart POST bodies before the view, so an oversized file
+    is answered with 413 without running the view. Place it before
+    ``CsrfViewMiddleware``.
+
+    Under ASGI Django receives the whole body before the middleware runs,
+    so there the limit only saves parsing and storing the file; the whole
+    body is capped by ``RequestBodyLimitMiddleware``.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.check_response(request, self.get_response(request))
+
+    async def __acall__(self, request: HttpRequest) -> HttpResponse:
+        return self.check_response(request, await self.get_response(request))
+
+    def check_response(self, request: HttpRequest, response: HttpResponse) -> HttpResponse:
+        # Uploads parsed later by the view itself, e.g. DRF PUT/PATCH.
+        if getattr(request, "upload_too_large", None):
+            return upload_too_large_response(request)
+        return response
+
+    def process_view(self, request: HttpRequest, view_func, view_args, view_kwargs):
+        # Stays sync: parsing reads and writes files, under ASGI Django
+        # runs it in a thread.
+        if request.method == "POST" and request.content_type == "multipart/form-data":
+            try:
+                request.FILES  # runs the upload handlers
+            except OSError:
+                # Broken body, CsrfViewMiddleware reports it.
+                pass
+        if getattr(request, "upload_too_large", None):
+            return upload_too_large_response(request)
+        return None
+
+
+class RequestBodyLimitMiddleware:
+    """
+    ASGI middleware capping the request body at ``limit`` bytes
+    (``settings.UPLOAD_MAX_REQUEST_SIZE`` by default) before Django
+    reads it.
+    """
+    def __init__(self, app, limit: Optional[int] = None):
+        self.app = app
+        self.limit = limit
+
+    async def __call__(self, scope, receive, send):
+        limit = self.limit if self.limit is not None else getattr(settings, "UPLOAD_MAX_REQUEST_SIZE", None)
+        if scope["type"] != "http" or limit is None:
+            return await self.app(scope, receive, send)
+        content_length = dict(scope.get("headers", ())).get(b"content-length", b"")
+        if content_length.isdigit() and int(content_length) > limit:
+            log.warning("Request to %s rejected, Content-Length %s exceeds %d", scope["path"], content_length.decode(), limit)
+            return await self.reject(send, limit)
+
+        received = 0
+        exceeded = False
+        started = False
+
+        async def limited_receive():
+            nonlocal received, exceeded
+            if exceeded:
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    log.warning("Request to %s stopped after %d bytes, limit is %d", scope["path"], received, limit)
+                    exceeded = True
+                    # ASGIHandler gives up on the request without a response.
+                    return {"type": "http.disconnect"}
+            return message
+
+        async def tracking_send(message):
+            nonlocal started
+            started = started or message["type"] == "http.response.start"
+            await send(message)
+
+        await self.app(scope, limited_receive, tracking_send)
+        if exceeded and not started:
+            await self.reject(send, limit)
+
+    @staticmethod
+    async def reject(send, limit: int) -> None:
+        body = json.dumps({"detail": f"Request body is larger than {limit} bytes"}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"connection", b"close"),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
@@ -1,9 +1,13 @@
+import logging
+
 from django.core.files.storage import FileSystemStorage
 from django.http import HttpRequest, HttpResponse
 from django.shortcuts import render
 
 from .forms import UserBioForm, UploadFileForm
 
+log = logging.getLogger(__name__)
+
 
 def process_get_view(request: HttpRequest) -> HttpResponse:
     a = request.GET.get('a', '')
@@ -25,21 +29,15 @@ def user_form(request: HttpRequest) -> HttpResponse:
 
 
 def handle_file_upload(request: HttpRequest) -> HttpResponse:
-    if request.method == 'POST' and request.FILES.get('myfile'):
+    # The size limit is enforced while the file streams in, see
+    # requestdataapp.uploadhandlers and settings.UPLOAD_SIZE_LIMITS.
+    if request.method == 'POST':
         form = UploadFileForm(request.POST, request.FILES)
         if form.is_valid():
-            # myfile = request.FILES['myfile']
             myfile = form.cleaned_data['file']
             fs = FileSystemStorage()
             filename = fs.save(myfile.name, myfile)
-
-            file_size = fs.size(filename)
-            if file_size > 1048576:
-                fs.delete(filename)
-                print('file is deleted: ', filename)
-                error_upload(request)
-            else:
-                print('file saved as: ', filename)
+            log.info("File saved as %s", filename)
     else:
         form = UploadFileForm()
 
@@ -4,8 +4,12 @@ from django.http import HttpRequest, HttpResponse
 from django.shortcuts import render, redirect
 from django.urls import path
 
-from .common import save_csv_products
+from jobsapp.jobs import enqueue
+from mysite.write_queue import submit_write
+
+from .caching import bump_catalog_version
 from .models import Product, Order
+from .search import full_text_search, search_index_exists
 from .admin_mixins import ExportAsCSVMixin
 
 from .forms import CSVImportForm
@@ -13,12 +17,14 @@ from .forms import CSVImportForm
 
 @admin.action(description='Archive products')
 def mark_archived(modeladmin: admin.ModelAdmin, request: HttpRequest, queryset: QuerySet):
-    queryset.update(archived=True)
+    submit_write(queryset.update, archived=True)
+    bump_catalog_version()
 
 
 @admin.action(description='Unarchive products')
 def mark_unarchived(modeladmin: admin.ModelAdmin, request: HttpRequest, queryset: QuerySet):
-    queryset.update(archived=False)
+    submit_write(queryset.update, archived=False)
+    bump_catalog_version()
 
 
 class OrderInline(admin.TabularInline):
@@ -44,11 +50,14 @@ class ProductAdmin(admin.ModelAdmin, ExportAsCSVMixin):
             }
             return render(request, "admin/csv_form.html", context, status=400)
 
-        save_csv_products(
-            file=form.files["csv_file"].file,
+        job = enqueue(
+            "shopapp.import_products_csv",
+            created_by=request.user,
+            input_file=form.files["csv_file"],
             encoding=request.encoding,
+            upsert=form.cleaned_data["upsert"],
         )
-        self.message_user(request, "Data from CSV was imported")
+        self.message_user(request, f"CSV import was queued as job #{job.pk}")
         return redirect("..")
 
     def get_urls(self):
@@ -89,6 +98,12 @@ class ProductAdmin(admin.ModelAdmin, ExportAsCSVMixin):
         })
     ]
 
+    def get_search_results(self, request: HttpRequest, queryset: QuerySet, search_term: str):
+        terms = search_term.split()
+        if not terms or not search_index_exists(queryset.db):
+            return super().get_search_results(request, queryset, search_term)
+        return full_text_search(queryset, terms, rank=False), False
+
     def description_short(self, obj: Product) -> str:
         if len(obj.description) < 48:
             return obj.description
@@ -103,6 +118,7 @@ class ProductAdmin(admin.ModelAdmin, ExportAsCSVMixin):
 
 class ProductInline(admin.StackedInline):
     model = Order.products.through
+    fields = 'product', 'quantity', 'price'
     extra = 0
 
 
@@ -111,10 +127,11 @@ class OrderAdmin(admin.ModelAdmin):
     inlines = [
         ProductInline,
     ]
-    list_display = 'delivery_address', 'promocode', 'created_at', 'user_verbose'
+    list_display = 'delivery_address', 'promocode', 'created_at', 'user_verbose', 'item_count', 'total'
+    readonly_fields = 'item_count', 'total'
 
     def get_queryset(self, request):
-        return Order.objects.select_related('user').prefetch_related('products')
+        return Order.objects.select_related('user')
 
     def user_verbose(self, obj: Order) -> str:
         return obj.user.first_name or obj.user.username
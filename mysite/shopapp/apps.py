@@ -1,6 +1,16 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
+
+
+def create_product_search_index(sender, using, **kwargs):
+    from .search import create_search_index
+    create_search_index(using)
 
 
 class ShopappConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'shopapp'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        post_migrate.connect(create_product_search_index, sender=self)
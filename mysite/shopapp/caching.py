@@ -0,0 +1,485 @@
+"""
+Версионированный кэш и условные GET-запросы.
+
+Для каждой модели хранится отметка последнего изменения (время в нс).
+Любое изменение товаров обновляет отметку каталога, поэтому ключи,
+построенные через ``catalog_cache_key``, устаревают мгновенно и могут
+храниться в кэше долго. Эти же отметки дают ETag/Last-Modified без
+сериализации ответа и инвалидируют кэш ответов API.
+"""
+import asyncio
+import datetime
+import gzip
+import hashlib
+import math
+import random
+import time
+import uuid
+from functools import wraps
+from typing import Awaitable, Callable, Sequence
+from urllib.parse import urlencode
+
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpRequest, HttpResponse
+from django.utils.cache import patch_vary_headers
+from django.utils.translation import get_language
+from django.views.decorators.http import condition
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+CATALOG_STAMP = "product"
+CATALOG_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def _stamp_key(name: str) -> str:
+    return f"change_stamp:{name}"
+
+
+def get_change_stamp(name: str) -> int:
+    stamp = cache.get(_stamp_key(name))
+    if stamp is None:
+        # "Changed now" after an eviction: the new stamp must not collide
+        # with entries cached under an old one, and clients simply refetch.
+        cache.add(_stamp_key(name), time.time_ns(), None)
+        stamp = cache.get(_stamp_key(name))
+    return stamp
+
+
+async def aget_change_stamp(name: str) -> int:
+    stamp = await cache.aget(_stamp_key(name))
+    if stamp is None:
+        await cache.aadd(_stamp_key(name), time.time_ns(), None)
+        stamp = await cache.aget(_stamp_key(name))
+    return stamp
+
+
+def _bump_change_stamp(name: str) -> None:
+    key = _stamp_key(name)
+    if cache.add(key, time.time_ns(), None):
+        return
+    try:
+        current = cache.get(key) or 0
+        # A delta rather than a new value: concurrent bumps both apply and
+        # never produce the same stamp, and the stamp still follows the clock
+        # for Last-Modified. Atomic only where the shared backend's incr is.
+        cache.incr(key, max(1, time.time_ns() - current))
+    except ValueError:
+        # Evicted between add and incr.
+        cache.add(key, time.time_ns(), None)
+
+
+def touch_change_stamp(name: str) -> None:
+    """
+    Bumps the stamp of ``name`` once the current transaction commits.
+
+    Bumping inside the transaction would let a concurrent reader cache the
+    old rows under the new stamp.
+    """
+    transaction.on_commit(lambda: _bump_change_stamp(name))
+
+
+def get_catalog_version() -> int:
+    return get_change_stamp(CATALOG_STAMP)
+
+
+async def aget_catalog_version() -> int:
+    return await aget_change_stamp(CATALOG_STAMP)
+
+
+def bump_catalog_version() -> None:
+    touch_change_stamp(CATALOG_STAMP)
+
+
+def catalog_cache_key(name: str) -> str:
+    return f"{name}:v{get_catalog_version()}"
+
+
+def condition_on_stamp(name: str, weak: bool = False) -> Callable:
+    """
+    ``condition`` decorator answering If-None-Match/If-Modified-Since
+    from the change stamp of ``name``.
+
+    The ETag also covers the URL, Accept, language and user, so every
+    representation a view can render gets its own validator. Last-Modified
+    has one-second resolution; clients relying on it alone may miss a
+    change made within the same second.
+    """
+    def etag_func(request: HttpRequest, *args, **kwargs) -> str:
+        variant = "|".join([
+            request.build_absolute_uri(request.path),
+            "&".join(sorted(request.GET.urlencode().split("&"))),
+            request.META.get("HTTP_ACCEPT", ""),
+            get_language() or "",
+            str(request.user.pk) if hasattr(request, "user") else "",
+        ])
+        digest = hashlib.md5(variant.encode(), usedforsecurity=False).hexdigest()
+        etag = f'"{name}-{get_change_stamp(name)}-{digest}"'
+        return f"W/{etag}" if weak else etag
+
+    def last_modified_func(request: HttpRequest, *args, **kwargs) -> datetime.datetime:
+        return datetime.datetime.fromtimestamp(
+            get_change_stamp(name) / 1e9,
+            tz=datetime.timezone.utc,
+        )
+
+    return condition(etag_func=etag_func, last_modified_func=last_modified_func)
+
+
+API_CACHE_TIMEOUT = 60 * 60
+
+
+def _requester(request: HttpRequest) -> str:
+    user = getattr(request, "user", None)
+    if user is None or not user.is_authenticated:
+        return "anon"
+    return f"user:{user.pk}"
+
+
+def api_cache_key(namespace: str, request: HttpRequest, stamps: Sequence[str]) -> str:
+    """
+    Hashes everything a cached API response depends on: the scheme, host
+    and path (DRF renders absolute pagination and hyperlink URLs),
+    normalized query params, Accept, language, the requesting user and
+    the change stamps. Old entries are left to the cache's own eviction.
+    """
+    params = sorted(
+        (key, value)
+        for key, values in request.GET.lists()
+        for value in values
+        if value != ""
+    )
+    full_key = "|".join([
+        request.build_absolute_uri(request.path),
+        urlencode(params),
+        request.META.get("HTTP_ACCEPT", ""),
+        get_language() or "",
+        _requester(request),
+        *(f"{name}={get_change_stamp(name)}" for name in stamps),
+    ])
+    digest = hashlib.sha256(full_key.encode()).hexdigest()
+    return f"api_response:{namespace}:{digest}"
+
+
+def cache_api_response(
+        namespace: str,
+        stamps: Sequence[str] = (),
+        timeout: int = API_CACHE_TIMEOUT,
+) -> Callable:
+    """
+    Caches rendered GET responses of an API view.
+
+    Entries are invalidated by touching any of the ``stamps`` and marked
+    with an ``X-Cache: HIT``/``MISS`` header. Only successful non-HTML
+    responses without cookies are stored, with their headers: the
+    browsable API embeds per-user data.
+    """
+    def decorator(view_func: Callable) -> Callable:
+        @wraps(view_func)
+        def wrapper(*args, **kwargs):
+            # Works for function views and, via method_decorator, methods.
+            request = args[0]
+            if request.method not in ("GET", "HEAD"):
+                return view_func(*args, **kwargs)
+
+            key = api_cache_key(namespace, request, stamps)
+            cached = cache.get(key)
+            if cached is not None:
+                response = HttpResponse(cached["content"], status=cached["status"])
+                for name, value in cached["headers"].items():
+                    response[name] = value
+                response["X-Cache"] = "HIT"
+                return response
+
+            response = view_func(*args, **kwargs)
+            response["X-Cache"] = "MISS"
+
+            def store(rendered: HttpResponse) -> None:
+                content_type = rendered.get("Content-Type", "")
+                if rendered.status_code != 200 or rendered.cookies or content_type.startswith("text/html"):
+                    return
+                headers = {name: value for name, value in rendered.headers.items() if name != "X-Cache"}
+                cache.set(key, {
+                    "content": rendered.content,
+                    "headers": headers,
+                    "status": rendered.status_code,
+                }, timeout)
+
+            if hasattr(response, "add_post_render_callback"):
+                response.add_post_render_callback(store)
+            else:
+                store(response)
+            return response
+        return wrapper
+    return decorator
+
+
+# Entries and locks of get_or_compute. The two-tier cache never keeps
+# them in a worker's local tier: their version is inside the value, so a
+# local copy would hide a refresh done by another worker.
+COMPUTED_KEY_PREFIX = "computed:"
+COMPUTE_LOCK_TIMEOUT = 30
+# Longest a request waits for another worker's computation before it
+# computes the value itself.
+COMPUTE_MAX_WAIT = 5
+COMPUTE_WAIT_INTERVAL = 0.05
+COMPUTE_MAX_WAIT_INTERVAL = 0.5
+
+
+def _computed_entry(value, timeout: int, version, delta: float) -> dict:
+    return {
+        "value": value,
+        "version": version,
+        "expires_at": time.time() + timeout,
+        "delta": delta,
+    }
+
+
+def _is_fresh(entry: dict, version, beta: float) -> bool:
+    # XFetch: the closer to expiry and the slower the last computation,
+    # the likelier an early refresh.
+    early = time.time() - entry["delta"] * beta * math.log(random.random() or 1e-12) >= entry["expires_at"]
+    return entry["version"] == version and not early
+
+
+def _release_lock(lock_key: str, token: str) -> None:
+    # After lock_timeout the lock may belong to another worker, so only
+    # our own token is deleted. The cache API has no atomic
+    # compare-and-delete; the gap between the calls is tiny next to the
+    # lock timeout.
+    if cache.get(lock_key) == token:
+        cache.delete(lock_key)
+
+
+async def _arelease_lock(lock_key: str, token: str) -> None:
+    if await cache.aget(lock_key) == token:
+        await cache.adelete(lock_key)
+
+
+def get_or_compute(
+        key: str,
+        compute: Callable[[], object],
+        timeout: int = 300,
+        version=None,
+        stale_timeout: int = 60,
+        beta: float = 1.0,
+        lock_timeout: int = COMPUTE_LOCK_TIMEOUT,
+        max_wait: float = COMPUTE_MAX_WAIT,
+):
+    """
+    Returns the cached value of ``key``, computing it at most once at a time.
+
+    - Single flight: only the worker holding ``<key>:lock`` recomputes,
+      the others wait for its result instead of hitting the database,
+      but no longer than ``max_wait`` seconds; then they compute it
+      themselves.
+    - Early refresh: shortly before expiry a request may recompute with
+      a probability that grows as expiry approaches (XFetch), weighted
+      by how long the last computation took.
+    - Stale while revalidate: a value that expired or whose ``version``
+      differs is still served for ``stale_timeout`` seconds to everybody
+      except the one worker refreshing it.
+    """
+    key = f"{COMPUTED_KEY_PREFIX}{key}"
+    lock_key = f"{key}:lock"
+    token = uuid.uuid4().hex
+
+    def refresh(locked: bool):
+        started = time.monotonic()
+        try:
+            value = compute()
+        finally:
+            if locked:
+                _release_lock(lock_key, token)
+        entry = _computed_entry(value, timeout, version, time.monotonic() - started)
+        cache.set(key, entry, timeout + stale_timeout)
+        return value
+
+    entry = cache.get(key)
+    if entry is not None:
+        if _is_fresh(entry, version, beta) or not cache.add(lock_key, token, lock_timeout):
+            return entry["value"]
+        return refresh(locked=True)
+
+    deadline = time.monotonic() + max_wait
+    interval = COMPUTE_WAIT_INTERVAL
+    while not cache.add(lock_key, token, lock_timeout):
+        if time.monotonic() + interval > deadline:
+            # Slow or dead lock holder: compute without the lock.
+            return refresh(locked=False)
+        time.sleep(interval)
+        interval = min(interval * 2, COMPUTE_MAX_WAIT_INTERVAL)
+        entry = cache.get(key)
+        if entry is not None and entry["version"] == version:
+            return entry["value"]
+    return refresh(locked=True)
+
+
+async def aget_or_compute(
+        key: str,
+        compute: Callable[[], Awaitable[object]],
+        timeout: int = 300,
+        version=None,
+        stale_timeout: int = 60,
+        beta: float = 1.0,
+        lock_timeout: int = COMPUTE_LOCK_TIMEOUT,
+        max_wait: float = COMPUTE_MAX_WAIT,
+):
+    """
+    ``get_or_compute`` for async views, ``compute`` is a coroutine
+    function. Waiting for another worker suspends the coroutine instead
+    of holding a thread.
+    """
+    key = f"{COMPUTED_KEY_PREFIX}{key}"
+    lock_key = f"{key}:lock"
+    token = uuid.uuid4().hex
+
+    async def refresh(locked: bool):
+        started = time.monotonic()
+        try:
+            value = await compute()
+        finally:
+            if locked:
+                await _arelease_lock(lock_key, token)
+        entry = _computed_entry(value, timeout, version, time.monotonic() - started)
+        await cache.aset(key, entry, timeout + stale_timeout)
+        return value
+
+    entry = await cache.aget(key)
+    if entry is not None:
+        if _is_fresh(entry, version, beta) or not await cache.aadd(lock_key, token, lock_timeout):
+            return entry["value"]
+        return await refresh(locked=True)
+
+    deadline = time.monotonic() + max_wait
+    interval = COMPUTE_WAIT_INTERVAL
+    while not await cache.aadd(lock_key, token, lock_timeout):
+        if time.monotonic() + interval > deadline:
+            return await refresh(locked=False)
+        await asyncio.sleep(interval)
+        interval = min(interval * 2, COMPUTE_MAX_WAIT_INTERVAL)
+        entry = await cache.aget(key)
+        if entry is not None and entry["version"] == version:
+            return entry["value"]
+    return await refresh(locked=True)
+
+
+class _UncacheablePage(Exception):
+    def __init__(self, response: HttpResponse):
+        self.response = response
+
+
+def cache_view_page(
+        timeout: int,
+        stale_timeout: int = 60,
+        vary_on_headers: Sequence[str] = (),
+        vary_on_cookies: Sequence[str] = (),
+) -> Callable:
+    """
+    Stampede-safe replacement for ``cache_page`` on function views:
+    caches the rendered page with ``get_or_compute``.
+
+    The key covers the URL, language and the given request headers and
+    cookies, so list everything the view reads from the request. Only
+    200 responses that set no cookies and are not private are stored;
+    their headers are replayed.
+    """
+    def decorator(view_func: Callable) -> Callable:
+        @wraps(view_func)
+        def wrapper(request: HttpRequest, *args, **kwargs):
+            if request.method not in ("GET", "HEAD"):
+                return view_func(request, *args, **kwargs)
+
+            def render_page() -> dict:
+                response = view_func(request, *args, **kwargs)
+                if hasattr(response, "render"):
+                    response = response.render()
+                cache_control = response.get("Cache-Control", "")
+                if (
+                    response.status_code != 200
+                    or response.cookies
+                    or "private" in cache_control
+                    or "no-store" in cache_control
+                ):
+                    raise _UncacheablePage(response)
+                return {
+                    "content": response.content,
+                    "headers": dict(response.headers),
+                    "status": response.status_code,
+                }
+
+            variant = [request.get_full_path(), get_language() or ""]
+            variant += [f"{name}={request.headers.get(name, '')}" for name in vary_on_headers]
+            variant += [f"{name}={request.COOKIES.get(name, '')}" for name in vary_on_cookies]
+            digest = hashlib.md5("|".join(variant).encode(), usedforsecurity=False).hexdigest()
+            try:
+                page = get_or_compute(
+                    f"view_page:{view_func.__module__}.{view_func.__name__}:{digest}",
+                    render_page,
+                    timeout=timeout,
+                    stale_timeout=stale_timeout,
+                )
+            except _UncacheablePage as exc:
+                return exc.response
+            response = HttpResponse(page["content"], status=page["status"])
+            for name, value in page["headers"].items():
+                response[name] = value
+            patch_vary_headers(response, [*vary_on_headers, *(["Cookie"] if vary_on_cookies else [])])
+            return response
+        return wrapper
+    return decorator
+
+
+def encode_payloads(content: bytes) -> dict:
+    """
+    Pre-compressed variants of a response body, keyed by content coding.
+    Brotli is added when the optional ``brotli`` package is installed.
+    """
+    payloads = {
+        "identity": content,
+        "gzip": gzip.compress(content, compresslevel=6, mtime=0),
+    }
+    if brotli is not None:
+        payloads["br"] = brotli.compress(content)
+    return payloads
+
+
+def accepted_encodings(request: HttpRequest) -> dict:
+    """
+    Parses Accept-Encoding into ``{coding: q}``.
+    """
+    accepted = {}
+    for item in request.META.get("HTTP_ACCEPT_ENCODING", "").split(","):
+        coding, _sep, params = item.strip().partition(";")
+        if not coding:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[coding.strip().lower()] = q
+    return accepted
+
+
+def payload_response(request: HttpRequest, payloads: dict, content_type: str) -> HttpResponse:
+    """
+    Serves the best pre-compressed variant the client accepts, as is.
+    """
+    accepted = accepted_encodings(request)
+    encoding = "identity"
+    for coding in ("br", "gzip"):
+        if coding in payloads and accepted.get(coding, accepted.get("*", 0)) > 0:
+            encoding = coding
+            break
+    response = HttpResponse(payloads[encoding], content_type=content_type)
+    if encoding != "identity":
+        response["Content-Encoding"] = encoding
+    response["Content-Length"] = str(len(payloads[encoding]))
+    patch_vary_headers(response, ("Accept-Encoding",))
+    return response
@@ -1,18 +1,234 @@
-from csv import DictReader
+import json
+from csv import DictReader, writer
+from dataclasses import dataclass, field
 from io import TextIOWrapper
+from itertools import islice
+from typing import AsyncIterator, Callable, Iterable, Iterator, List, Optional, Sequence, Tuple
 
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.db.models import QuerySet
+from django.utils.translation import gettext as _
+
+from shopapp.caching import bump_catalog_version
 from shopapp.models import Product
 
 
-def save_csv_products(file, encoding):
+IMPORT_FIELDS = (
+    "name",
+    "description",
+    "price",
+    "discount",
+    "archived",
+    "created_by",
+)
+IMPORT_UNIQUE_FIELDS = ("name",)
+IMPORT_BATCH_SIZE = 1000
+
+
+@dataclass
+class ImportReport:
+    """
+    Result of a CSV import: number of stored rows and per-row errors.
+    """
+    imported: int = 0
+    errors: List[dict] = field(default_factory=list)
+
+    def add_error(self, row_number: int, errors: dict) -> None:
+        self.errors.append({"row": row_number, "errors": errors})
+
+    def as_dict(self) -> dict:
+        return {
+            "imported": self.imported,
+            "failed": len(self.errors),
+            "errors": self.errors,
+        }
+
+
+def iter_batches(iterable: Iterable, size: int) -> Iterator[list]:
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def clean_product_row(row: dict) -> Tuple[dict, dict]:
+    """
+    Coerces raw CSV strings with the model fields.
+
+    Returns ``(values, errors)``; empty or missing columns fall back
+    to the model defaults.
+    """
+    values = {}
+    errors = {}
+    for name in IMPORT_FIELDS:
+        raw = row.get(name)
+        if raw is None or (raw == "" and name != "name"):
+            continue
+        model_field = Product._meta.get_field(name)
+        attname = model_field.attname
+        if model_field.is_relation:
+            model_field = model_field.target_field
+        try:
+            values[attname] = model_field.clean(raw.strip(), None)
+        except ValidationError as exc:
+            # Errors are keyed by the CSV column.
+            errors[name] = exc.messages
+    if "name" not in values and "name" not in errors:
+        errors["name"] = [_("This field is required.")]
+    return values, errors
+
+
+def save_product_batch(
+        batch: List[Tuple[int, dict]],
+        report: ImportReport,
+        created_by: Optional[User] = None,
+        upsert: bool = False,
+        columns: Sequence[str] = IMPORT_FIELDS,
+) -> None:
+    cleaned = {}
+    for row_number, row in batch:
+        values, errors = clean_product_row(row)
+        if not values.get("created_by_id") and "created_by" not in errors:
+            if created_by is None:
+                errors["created_by"] = [_("This field is required.")]
+            else:
+                values["created_by_id"] = created_by.pk
+        if errors:
+            report.add_error(row_number, errors)
+            continue
+        # The first occurrence of a natural key within a batch is stored,
+        # later ones are reported: names are unique.
+        key = tuple(values[name] for name in IMPORT_UNIQUE_FIELDS)
+        if key in cleaned:
+            report.add_error(row_number, {
+                name: [_("Duplicate of row %(row)s.") % {"row": cleaned[key][0]}]
+                for name in IMPORT_UNIQUE_FIELDS
+            })
+            continue
+        cleaned[key] = (row_number, values)
+
+    user_ids = {values["created_by_id"] for _row_number, values in cleaned.values()}
+    known_user_ids = set(
+        User.objects.filter(pk__in=user_ids).values_list("pk", flat=True)
+    )
+    products = []
+    for row_number, values in cleaned.values():
+        if values["created_by_id"] not in known_user_ids:
+            report.add_error(row_number, {"created_by": [_("Unknown user.")]})
+            continue
+        products.append((row_number, Product(**values)))
+    if not products:
+        return
+
+    options = {}
+    if upsert:
+        # Only columns present in the file overwrite existing values.
+        update_fields = [
+            name
+            for name in IMPORT_FIELDS
+            if name in columns and name not in IMPORT_UNIQUE_FIELDS
+        ]
+        if update_fields:
+            options = {
+                "update_conflicts": True,
+                "unique_fields": IMPORT_UNIQUE_FIELDS,
+                "update_fields": update_fields,
+            }
+        else:
+            options = {"ignore_conflicts": True}
+    try:
+        with transaction.atomic():
+            Product.objects.bulk_create([product for _row_number, product in products], **options)
+    except IntegrityError:
+        # Some row conflicts: retry them one by one to fail only that row.
+        with transaction.atomic():
+            for row_number, product in products:
+                try:
+                    with transaction.atomic():
+                        Product.objects.bulk_create([product], **options)
+                except IntegrityError as exc:
+                    report.add_error(row_number, {"__all__": [str(exc)]})
+                else:
+                    report.imported += 1
+        return
+    report.imported += len(products)
+
+
+def save_csv_products(
+        file,
+        encoding,
+        created_by: Optional[User] = None,
+        upsert: bool = False,
+        batch_size: int = IMPORT_BATCH_SIZE,
+        on_batch: Optional[Callable[[ImportReport], None]] = None,
+) -> ImportReport:
+    """
+    Imports products from a CSV file in fixed-size batches.
+
+    Each batch is validated, coerced and committed in its own
+    transaction, so memory use does not depend on the file size and a
+    bad row only fails itself. With ``upsert`` existing products are
+    updated by name instead of raising a conflict.
+    """
     csv_file = TextIOWrapper(
         file,
         encoding=encoding,
     )
     reader = DictReader(csv_file)
+    report = ImportReport()
+
+    # Row numbers count the header line, as spreadsheets do.
+    for batch in iter_batches(enumerate(reader, start=2), batch_size):
+        save_product_batch(
+            batch,
+            report,
+            created_by=created_by,
+            upsert=upsert,
+            columns=reader.fieldnames or (),
+        )
+        if on_batch is not None:
+            on_batch(report)
+
+    if report.imported:
+        bump_catalog_version()
+    return report
+
+
+class Echo:
+    """
+    Pseudo-buffer for csv.writer: returns the written line instead of
+    storing it, so rows can be handed to StreamingHttpResponse.
+    """
+    def write(self, value: str) -> str:
+        return value
+
+
+def iter_csv_rows(
+        queryset: QuerySet,
+        fields: Sequence[str],
+        chunk_size: int = 2000,
+) -> Iterator[str]:
+    """
+    Lazily yields CSV lines (header first) for the given queryset.
+
+    Rows are read with ``values_list`` through a server-side iterator,
+    so no model instances are built and memory stays flat.
+    """
+    csv_writer = writer(Echo())
+    yield csv_writer.writerow(fields)
+    rows: Iterable[tuple] = queryset.values_list(*fields).iterator(chunk_size=chunk_size)
+    for row in rows:
+        yield csv_writer.writerow(row)
+
+
+async def aiter_ndjson(queryset: QuerySet, chunk_size: int = 2000) -> AsyncIterator[str]:
+    """
+    Lazily yields one JSON document per line for a ``values()`` queryset.
 
-    products = [
-        Product(**row)
-        for row in reader
-    ]
-    Product.objects.bulk_create(products)
+    Async, so a slow client of a streaming response holds only a
+    coroutine on the event loop and not a worker thread.
+    """
+    async for row in queryset.aiterator(chunk_size=chunk_size):
+        yield json.dumps(row, cls=DjangoJSONEncoder) + "\n"
@@ -34,4 +34,8 @@ class GroupForm(forms.ModelForm):
 
 
 class CSVImportForm(forms.Form):
-    csv_file = forms.FileField()
\ No newline at end of file
+    csv_file = forms.FileField()
+    upsert = forms.BooleanField(
+        required=False,
+        help_text="Update existing products with the same name",
+    )
\ No newline at end of file
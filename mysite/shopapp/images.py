@@ -0,0 +1,126 @@
+"""
+Уменьшенные копии загруженных изображений.
+
+Для каждого изображения создаются варианты фиксированной ширины в WebP
+и JPEG. Они складываются рядом с оригиналом в ``variants/`` и
+описываются в JSON-поле модели; сам оригинал не изменяется. Генерация
+идёт в фоновой задаче ``shopapp.generate_image_variants``, а тег
+``{% image_srcset %}`` выводит ``<picture>`` с ``srcset`` по вариантам.
+"""
+import posixpath
+from io import BytesIO
+from typing import Dict, List, Tuple
+
+from django.apps import apps
+from django.core.files.base import ContentFile
+from django.db import models, transaction
+from django.db.models.fields.files import ImageFieldFile
+from PIL import Image, ImageOps
+
+from jobsapp.jobs import enqueue
+
+VARIANT_WIDTHS = (160, 320, 640)
+
+# format -> (Pillow format, content type, extension, save options)
+VARIANT_FORMATS = {
+    "webp": ("WEBP", "image/webp", "webp", {"quality": 80, "method": 4}),
+    "jpeg": ("JPEG", "image/jpeg", "jpg", {"quality": 82, "optimize": True, "progressive": True}),
+}
+
+# "app_label.model" -> (image field, variants field)
+VARIANT_FIELDS: Dict[str, Tuple[str, str]] = {
+    "shopapp.product": ("preview", "preview_variants"),
+    "myauth.profile": ("avatar", "avatar_variants"),
+}
+
+
+def variants_are_current(image: ImageFieldFile, variants: dict) -> bool:
+    return (variants or {}).get("source") == (image.name or None)
+
+
+def _variant_name(source: str, width: int, extension: str) -> str:
+    directory, filename = posixpath.split(source)
+    stem = posixpath.splitext(filename)[0]
+    return posixpath.join(directory, "variants", f"{stem}-{width}w.{extension}")
+
+
+def generate_variants(image: ImageFieldFile) -> dict:
+    """
+    Renders every width up to the original one in every format and
+    returns the description stored in the model's variants field.
+    """
+    with image.open("rb"):
+        original = ImageOps.exif_transpose(Image.open(image.file))
+        original.load()
+
+    # Narrower originals are re-encoded at their own width as the largest
+    # variant; nothing is ever upscaled.
+    widths = [width for width in VARIANT_WIDTHS if width < original.width]
+    if original.width < VARIANT_WIDTHS[-1]:
+        widths.append(original.width)
+
+    images: List[dict] = []
+    for width in widths:
+        height = max(1, round(original.height * width / original.width))
+        resized = original.resize((width, height), Image.LANCZOS)
+        for pillow_format, content_type, extension, options in VARIANT_FORMATS.values():
+            converted = resized
+            if pillow_format == "JPEG" and resized.mode != "RGB":
+                converted = resized.convert("RGB")
+            buffer = BytesIO()
+            converted.save(buffer, pillow_format, **options)
+            name = _variant_name(image.name, width, extension)
+            image.storage.delete(name)
+            name = image.storage.save(name, ContentFile(buffer.getvalue()))
+            images.append({
+                "name": name,
+                "width": width,
+                "height": height,
+                "type": content_type,
+            })
+    return {"source": image.name, "images": images}
+
+
+def update_variants(instance: models.Model) -> dict:
+    """
+    Regenerates the variants of ``instance`` if its image changed.
+
+    The variants field is written with ``update()``, so no save signals
+    fire and the upload is not reprocessed.
+    """
+    image_field, variants_field = VARIANT_FIELDS[instance._meta.label_lower]
+    image = getattr(instance, image_field)
+    previous = getattr(instance, variants_field)
+    if variants_are_current(image, previous):
+        return previous
+
+    variants = generate_variants(image) if image else {}
+    stale = {item["name"] for item in (previous or {}).get("images", [])}
+    stale -= {item["name"] for item in variants.get("images", [])}
+    for name in stale:
+        image.storage.delete(name)
+
+    setattr(instance, variants_field, variants)
+    type(instance).objects.filter(pk=instance.pk).update(**{variants_field: variants})
+    return variants
+
+
+def schedule_variants(instance: models.Model) -> None:
+    """
+    Enqueues variant generation after the transaction commits, unless
+    the stored variants already match the image.
+    """
+    image_field, variants_field = VARIANT_FIELDS[instance._meta.label_lower]
+    if variants_are_current(getattr(instance, image_field), getattr(instance, variants_field)):
+        return
+    transaction.on_commit(lambda: enqueue(
+        "shopapp.generate_image_variants",
+        model=instance._meta.label_lower,
+        pk=instance.pk,
+    ))
+
+
+def get_variant_model(label: str):
+    if label not in VARIANT_FIELDS:
+        raise KeyError(f"No image variants for {label!r}")
+    return apps.get_model(label)
@@ -1,9 +1,7 @@
-from django.contrib.auth.models import User
-
 from django.core.management import BaseCommand
-from django.db.models import Avg, Max, Min, Count, Sum
+from django.db.models import Sum
 
-from shopapp.models import Product, Order
+from shopapp.models import Order
 
 
 class Command(BaseCommand):
@@ -20,16 +18,21 @@ class Command(BaseCommand):
         #     count=Count('id'),
         # )
 
-        orders = Order.objects.annotate(
-            total=Sum('products__price', default=0),
-            products_count=Count('products'),
-        )
-        for order in orders:
-            print(
-                f"order #{order.id} "
-                f"with {order.products_count} "
+        # Totals are denormalized on Order, no join with products is needed.
+        orders = Order.objects.only("pk", "total", "item_count").order_by("pk")
+        for order in orders.iterator():
+            self.stdout.write(
+                f"order #{order.pk} "
+                f"with {order.item_count} "
                 f"products worth {order.total}"
             )
 
+        summary = Order.objects.aggregate(
+            revenue=Sum("total", default=0),
+            items=Sum("item_count", default=0),
+        )
+        self.stdout.write(
+            f"{summary['items']} products worth {summary['revenue']} in total"
+        )
 
         self.stdout.write("Done")
@@ -0,0 +1,42 @@
+from django.core.management import BaseCommand
+
+from jobsapp.jobs import enqueue
+from shopapp.caching import bump_catalog_version
+from shopapp.images import VARIANT_FIELDS, get_variant_model, update_variants, variants_are_current
+
+
+class Command(BaseCommand):
+    """
+    Generates missing or outdated image variants of product previews
+    and profile avatars.
+    """
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--enqueue",
+            action="store_true",
+            help="Queue a job per image for run_jobs instead of resizing here",
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write("Backfill image variants")
+        for label, (image_field, variants_field) in VARIANT_FIELDS.items():
+            model = get_variant_model(label)
+            queryset = (
+                model.objects
+                .exclude(**{image_field: ""})
+                .exclude(**{f"{image_field}__isnull": True})
+                .only("pk", image_field, variants_field)
+            )
+            processed = 0
+            for instance in queryset.iterator():
+                if variants_are_current(getattr(instance, image_field), getattr(instance, variants_field)):
+                    continue
+                if options["enqueue"]:
+                    enqueue("shopapp.generate_image_variants", model=label, pk=instance.pk)
+                else:
+                    update_variants(instance)
+                processed += 1
+            self.stdout.write(f"{label}: {processed} images")
+        if not options["enqueue"]:
+            bump_catalog_version()
+        self.stdout.write(self.style.SUCCESS("Done"))
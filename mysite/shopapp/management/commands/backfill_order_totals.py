@@ -0,0 +1,22 @@
+from django.core.management import BaseCommand
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+
+from shopapp.models import Order, OrderItem, Product, calculated_order_totals
+
+
+class Command(BaseCommand):
+    """
+    Fills missing line item prices and recomputes denormalized order totals.
+    """
+    @transaction.atomic
+    def handle(self, *args, **options):
+        self.stdout.write("Backfill order totals")
+
+        prices = OrderItem.objects.filter(price__isnull=True).update(price=Subquery(
+            Product.objects.filter(pk=OuterRef("product_id")).values("price")[:1]
+        ))
+        self.stdout.write(f"Snapshotted prices of {prices} order items")
+
+        orders = Order.objects.update(**calculated_order_totals())
+        self.stdout.write(self.style.SUCCESS(f"Updated totals of {orders} orders"))
@@ -0,0 +1,100 @@
+import random
+import shutil
+import threading
+import time
+from pathlib import Path
+from tempfile import mkdtemp
+
+from django.conf import settings
+from django.core.management import BaseCommand
+from django.db.utils import ConnectionHandler, OperationalError
+
+
+class Command(BaseCommand):
+    """
+    Compares concurrent read/write throughput of the stock SQLite backend
+    with the configured one (WAL, pragmas, pooled connections) on a
+    scratch database. Each simulated request opens its connection, runs
+    a few reads or one write and closes it, as a view would.
+    """
+    def add_arguments(self, parser):
+        parser.add_argument("--readers", type=int, default=8)
+        parser.add_argument("--writers", type=int, default=2)
+        parser.add_argument("--duration", type=float, default=5.0, help="Seconds per backend")
+        parser.add_argument("--rows", type=int, default=10000)
+        parser.add_argument("--reads-per-request", type=int, default=5)
+
+    def handle(self, *args, **options):
+        tuned = settings.DATABASES["default"]
+        backends = {
+            "stock": {"ENGINE": "django.db.backends.sqlite3"},
+            "tuned": {"ENGINE": tuned["ENGINE"], "OPTIONS": tuned.get("OPTIONS", {})},
+        }
+        self.stdout.write(
+            f"{options['readers']} readers, {options['writers']} writers, "
+            f"{options['duration']:g} s per backend"
+        )
+        self.stdout.write(f"{'backend':<8} {'reads/s':>10} {'writes/s':>10} {'locked':>8}")
+        for name, database in backends.items():
+            directory = Path(mkdtemp())
+            try:
+                result = self.run_backend({**database, "NAME": directory / "bench.sqlite3"}, options)
+            finally:
+                shutil.rmtree(directory)
+            self.stdout.write(
+                f"{name:<8} {result['reads'] / options['duration']:>10.0f} "
+                f"{result['writes'] / options['duration']:>10.0f} {result['locked']:>8}"
+            )
+
+    def run_backend(self, database: dict, options: dict) -> dict:
+        connections = ConnectionHandler({"default": database})
+        with connections["default"].cursor() as cursor:
+            cursor.execute("CREATE TABLE item (id INTEGER PRIMARY KEY, name TEXT, quantity INTEGER)")
+            cursor.executemany(
+                "INSERT INTO item (name, quantity) VALUES (%s, %s)",
+                [(f"item {number}", number % 100) for number in range(options["rows"])],
+            )
+        connections.close_all()
+
+        result = {"reads": 0, "writes": 0, "locked": 0}
+        lock = threading.Lock()
+        deadline = time.monotonic() + options["duration"]
+
+        def work(write: bool):
+            connection = connections["default"]
+            done = locked = 0
+            while time.monotonic() < deadline:
+                try:
+                    with connection.cursor() as cursor:
+                        if write:
+                            cursor.execute(
+                                "UPDATE item SET quantity = quantity + 1 WHERE id = %s",
+                                [random.randint(1, options["rows"])],
+                            )
+                            done += 1
+                        else:
+                            for _ in range(options["reads_per_request"]):
+                                start = random.randint(1, options["rows"])
+                                cursor.execute(
+                                    "SELECT SUM(quantity) FROM item WHERE id BETWEEN %s AND %s",
+                                    [start, start + 50],
+                                )
+                                cursor.fetchone()
+                                done += 1
+                except OperationalError:
+                    locked += 1
+                finally:
+                    connection.close()
+            with lock:
+                result["writes" if write else "reads"] += done
+                result["locked"] += locked
+
+        threads = [
+            threading.Thread(target=work, args=(write,))
+            for write in [False] * options["readers"] + [True] * options["writers"]
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return result
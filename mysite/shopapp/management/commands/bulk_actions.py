@@ -1,6 +1,7 @@
 from django.contrib.auth.models import User
 
 from django.core.management import BaseCommand
+from shopapp.caching import bump_catalog_version
 from shopapp.models import Product
 
 
@@ -12,6 +13,7 @@ class Command(BaseCommand):
         result = Product.objects.filter(
             name__contains="Smartphone",
         ).update(discount=10)
+        bump_catalog_version()
 
         print(result)
 
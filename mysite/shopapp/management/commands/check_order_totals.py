@@ -0,0 +1,37 @@
+from django.core.management import BaseCommand, CommandError
+
+from shopapp.models import Order, calculated_order_totals
+
+
+class Command(BaseCommand):
+    """
+    Compares denormalized order totals with their line items.
+    """
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--fix",
+            action="store_true",
+            help="Recompute totals of inconsistent orders",
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write("Check order totals")
+
+        orders = Order.objects.inconsistent_totals()
+        broken = []
+        for order in orders.only("pk", "total", "item_count"):
+            broken.append(order.pk)
+            self.stdout.write(
+                f"order #{order.pk}: "
+                f"total {order.total} != {order.calculated_total}, "
+                f"items {order.item_count} != {order.calculated_item_count}"
+            )
+
+        if not broken:
+            self.stdout.write(self.style.SUCCESS("All order totals are consistent"))
+            return
+        if not options["fix"]:
+            raise CommandError(f"{len(broken)} orders have inconsistent totals")
+
+        Order.objects.filter(pk__in=broken).update(**calculated_order_totals())
+        self.stdout.write(self.style.SUCCESS(f"Fixed totals of {len(broken)} orders"))
@@ -0,0 +1,19 @@
+from django.core.management import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from shopapp.search import create_search_index, rebuild_search_index
+
+
+class Command(BaseCommand):
+    """
+    Creates (if needed) and rebuilds the FTS5 product search index.
+    """
+    def add_arguments(self, parser):
+        parser.add_argument("--database", default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        self.stdout.write("Rebuild product search index")
+        if not create_search_index(options["database"]):
+            raise CommandError("Full-text search requires SQLite with FTS5")
+        rebuild_search_index(options["database"])
+        self.stdout.write(self.style.SUCCESS("Product search index rebuilt"))
@@ -0,0 +1,13 @@
+from django.core.management import BaseCommand
+
+from shopapp.reports import rebuild_sales_rollups
+
+
+class Command(BaseCommand):
+    """
+    Recomputes daily product sales rollups from all order items.
+    """
+    def handle(self, *args, **options):
+        self.stdout.write("Rebuild sales rollups")
+        count = rebuild_sales_rollups()
+        self.stdout.write(self.style.SUCCESS(f"Stored {count} daily rollups"))
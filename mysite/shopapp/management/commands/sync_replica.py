@@ -0,0 +1,33 @@
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from mysite.db_routers import REPLICA_DB_ALIAS
+
+
+class Command(BaseCommand):
+    """
+    Copies the default SQLite database to the replica file with SQLite's
+    online backup API, once or every ``--interval`` seconds.
+    """
+    def add_arguments(self, parser):
+        parser.add_argument("--interval", type=float, default=0, help="Repeat every N seconds")
+        parser.add_argument("--output", help="Replica file, defaults to the NAME of the replica database")
+
+    def handle(self, *args, **options):
+        output = options["output"] or settings.DATABASES.get(REPLICA_DB_ALIAS, {}).get("NAME")
+        if not output:
+            raise CommandError(f"No {REPLICA_DB_ALIAS!r} database configured, pass --output")
+        connection = connections[DEFAULT_DB_ALIAS]
+        if not hasattr(connection, "backup_to"):
+            raise CommandError("The default database must use mysite.db_backends.sqlite3")
+        while True:
+            started = time.monotonic()
+            connection.backup_to(Path(output))
+            self.stdout.write(f"Synced {output} in {time.monotonic() - started:.2f} s")
+            if not options["interval"]:
+                break
+            time.sleep(options["interval"])
@@ -0,0 +1,43 @@
+from django.db import migrations
+from django.db.models import Count
+
+
+def dedupe_product_names(apps, schema_editor):
+    """
+    Renames all but the oldest product of every duplicated name to
+    "<name> (<pk>)", so the name can become unique. Products are not
+    merged or deleted: orders refer to them.
+    """
+    Product = apps.get_model("shopapp", "Product")
+    max_length = Product._meta.get_field("name").max_length
+    duplicates = (
+        Product.objects
+        .values("name")
+        .annotate(count=Count("pk"))
+        .filter(count__gt=1)
+        .values_list("name", flat=True)
+    )
+    taken = set(Product.objects.values_list("name", flat=True))
+    for name in list(duplicates):
+        for product in Product.objects.filter(name=name).order_by("pk")[1:]:
+            suffix = f" ({product.pk})"
+            new_name = name[:max_length - len(suffix)] + suffix
+            number = 0
+            while new_name in taken:
+                number += 1
+                suffix = f" ({product.pk}-{number})"
+                new_name = name[:max_length - len(suffix)] + suffix
+            taken.add(new_name)
+            product.name = new_name
+            product.save(update_fields=["name"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(dedupe_product_names, migrations.RunPython.noop),
+    ]
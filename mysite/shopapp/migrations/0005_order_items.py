@@ -0,0 +1,86 @@
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+import django.db.models.deletion
+
+
+def backfill_order_totals(apps, schema_editor):
+    """
+    Snapshots the current product price into the existing line items and
+    computes the denormalized order totals, like ``backfill_order_totals``.
+    """
+    Order = apps.get_model("shopapp", "Order")
+    OrderItem = apps.get_model("shopapp", "OrderItem")
+    Product = apps.get_model("shopapp", "Product")
+    OrderItem.objects.filter(price__isnull=True).update(price=Subquery(
+        Product.objects.filter(pk=OuterRef("product_id")).values("price")[:1]
+    ))
+    items = OrderItem.objects.filter(order=OuterRef("pk")).order_by().values("order")
+    Order.objects.update(
+        total=Coalesce(
+            Subquery(items.annotate(value=Sum(F("quantity") * F("price"))).values("value")),
+            Value(0),
+            output_field=models.DecimalField(max_digits=12, decimal_places=2),
+        ),
+        item_count=Coalesce(
+            Subquery(items.annotate(value=Sum("quantity")).values("value")),
+            Value(0),
+            output_field=models.PositiveIntegerField(),
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0004_order_created_at_index'),
+    ]
+
+    operations = [
+        # OrderItem takes over the table of the auto-created relation, so
+        # only the state changes here; the new columns are added below.
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='OrderItem',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='shopapp.order')),
+                        ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='order_items', to='shopapp.product')),
+                    ],
+                    options={
+                        'verbose_name': 'Order item',
+                        'verbose_name_plural': 'Order items',
+                        'db_table': 'shopapp_order_products',
+                        'unique_together': {('order', 'product')},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name='order',
+                    name='products',
+                    field=models.ManyToManyField(related_name='orders', through='shopapp.OrderItem', to='shopapp.product'),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='quantity',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='price',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=8, null=True),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_order_totals, migrations.RunPython.noop),
+    ]
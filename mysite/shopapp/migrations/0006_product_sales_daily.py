@@ -0,0 +1,52 @@
+from django.db import migrations, models
+from django.db.models import F, Sum
+from django.db.models.functions import TruncDate
+import django.db.models.deletion
+
+
+def build_sales_rollups(apps, schema_editor):
+    """
+    Fills the rollups from the existing orders, like ``rebuild_rollups``.
+    """
+    OrderItem = apps.get_model("shopapp", "OrderItem")
+    ProductSalesDaily = apps.get_model("shopapp", "ProductSalesDaily")
+    rows = (
+        OrderItem.objects
+        .annotate(day=TruncDate("order__created_at"))
+        .order_by()
+        .values("product_id", "day")
+        .annotate(
+            units=Sum("quantity"),
+            revenue=Sum(F("quantity") * F("price"), default=0),
+        )
+    )
+    ProductSalesDaily.objects.bulk_create(
+        (ProductSalesDaily(**row) for row in rows.iterator()),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0005_order_items'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSalesDaily',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(db_index=True)),
+                ('units', models.PositiveIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_sales', to='shopapp.product')),
+            ],
+            options={
+                'verbose_name': 'Daily product sales',
+                'verbose_name_plural': 'Daily product sales',
+                'unique_together': {('product', 'day')},
+            },
+        ),
+        migrations.RunPython(build_sales_rollups, migrations.RunPython.noop),
+    ]
@@ -1,5 +1,7 @@
 from django.contrib.auth.models import User
 from django.db import models
+from django.db.models import F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
 from django.conf import settings
 
 from django.utils.translation import gettext_lazy as _
@@ -24,7 +26,7 @@ class Product(models.Model):
         verbose_name = _("Product")
         verbose_name_plural = _("Products")
 
-    name = models.CharField(max_length=100, db_index=True)
+    name = models.CharField(max_length=100, unique=True)
     description = models.TextField(null=False, blank=True, db_index=True)
     price = models.DecimalField(default=0, max_digits=8, decimal_places=2)
     discount = models.SmallIntegerField(default=0, db_index=True)
@@ -34,6 +36,8 @@ class Product(models.Model):
     created_by = models.ForeignKey(User, on_delete=models.CASCADE)
 
     preview = models.ImageField(null=True, blank=True, upload_to=product_preview_directly_path)
+    # Resized copies of the preview, see shopapp.images.
+    preview_variants = models.JSONField(default=dict, blank=True, editable=False)
 
     def __str__(self):
         return f"Product(pk={self.pk}, name={self.name!r})"
@@ -48,6 +52,46 @@ class Product(models.Model):
         return f"Product(pk={self.pk}, name={self.name!r})"
 
 
+def calculated_order_totals() -> dict:
+    """
+    Subquery expressions computing ``total`` and ``item_count`` of an
+    order from its line items, for ``annotate()`` and ``update()``.
+    """
+    items = (
+        OrderItem.objects
+        .filter(order=OuterRef("pk"))
+        .order_by()
+        .values("order")
+    )
+    return {
+        "total": Coalesce(
+            Subquery(items.annotate(value=Sum(F("quantity") * F("price"))).values("value")),
+            Value(0),
+            output_field=models.DecimalField(max_digits=12, decimal_places=2),
+        ),
+        "item_count": Coalesce(
+            Subquery(items.annotate(value=Sum("quantity")).values("value")),
+            Value(0),
+            output_field=models.PositiveIntegerField(),
+        ),
+    }
+
+
+class OrderQuerySet(models.QuerySet):
+    def with_calculated_totals(self) -> "OrderQuerySet":
+        totals = calculated_order_totals()
+        return self.annotate(
+            calculated_total=totals["total"],
+            calculated_item_count=totals["item_count"],
+        )
+
+    def inconsistent_totals(self) -> "OrderQuerySet":
+        return self.with_calculated_totals().exclude(
+            total=F("calculated_total"),
+            item_count=F("calculated_item_count"),
+        )
+
+
 class Order(models.Model):
     """
     Модель Order представляет заказ, который можно
@@ -61,11 +105,75 @@ class Order(models.Model):
 
     delivery_address = models.TextField(null=True, blank=True)
     promocode = models.CharField(max_length=20, null=False, blank=True)
-    created_at = models.DateTimeField(auto_now_add=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
     user = models.ForeignKey(User, on_delete=models.PROTECT)
-    products = models.ManyToManyField(Product, related_name="orders")
+    products = models.ManyToManyField(Product, related_name="orders", through="OrderItem")
 
     receipt = models.FileField(null=True, upload_to='orders/receipts/')
 
+    objects = OrderQuerySet.as_manager()
+
+    # Denormalized from the line items, see recalculate_totals().
+    total = models.DecimalField(default=0, max_digits=12, decimal_places=2)
+    item_count = models.PositiveIntegerField(default=0)
+
     def __str__(self) -> str:
         return f"Order(pk={self.pk})"
+
+    def calculate_totals(self) -> dict:
+        return self.items.aggregate(
+            total=Coalesce(
+                Sum(F("quantity") * F("price")),
+                Value(0),
+                output_field=models.DecimalField(max_digits=12, decimal_places=2),
+            ),
+            item_count=Coalesce(Sum("quantity"), Value(0)),
+        )
+
+    def recalculate_totals(self) -> None:
+        totals = self.calculate_totals()
+        self.total = totals["total"]
+        self.item_count = totals["item_count"]
+        Order.objects.filter(pk=self.pk).update(**totals)
+
+
+class OrderItem(models.Model):
+    """
+    Модель OrderItem представляет строку заказа: товар, количество
+    и цену на момент покупки.
+    """
+    class Meta:
+        # Keeps the table of the former auto-created M2M relation.
+        db_table = "shopapp_order_products"
+        unique_together = [("order", "product")]
+        verbose_name = _("Order item")
+        verbose_name_plural = _("Order items")
+
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name="items")
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="order_items")
+    quantity = models.PositiveIntegerField(default=1)
+    # Filled from Product.price when the item is added, if not given.
+    price = models.DecimalField(null=True, blank=True, max_digits=8, decimal_places=2)
+
+    def __str__(self) -> str:
+        return f"OrderItem(order={self.order_id}, product={self.product_id})"
+
+
+class ProductSalesDaily(models.Model):
+    """
+    Модель ProductSalesDaily хранит предрассчитанные продажи товара
+    за день: количество и выручку. Поддерживается сигналами заказов,
+    пересчитывается командой ``rebuild_rollups``.
+    """
+    class Meta:
+        unique_together = [("product", "day")]
+        verbose_name = _("Daily product sales")
+        verbose_name_plural = _("Daily product sales")
+
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="daily_sales")
+    day = models.DateField(db_index=True)
+    units = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(default=0, max_digits=14, decimal_places=2)
+
+    def __str__(self) -> str:
+        return f"ProductSalesDaily(product={self.product_id}, day={self.day})"
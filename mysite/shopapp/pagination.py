@@ -0,0 +1,225 @@
+"""
+Постраничная навигация для API магазина.
+
+``KeysetPagination`` листает по ключу (значения полей сортировки + pk)
+вместо OFFSET и не выполняет COUNT(*). Клиент выбирает её параметром
+``?pagination=cursor``; по умолчанию остаётся PageNumberPagination.
+
+``CatalogCountPaginator`` нужен HTML-страницам каталога: COUNT(*) по
+товарам кэшируется до следующего изменения каталога.
+"""
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from typing import List, Optional, Tuple
+
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import F, Q, QuerySet
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+from .caching import CATALOG_CACHE_TIMEOUT, catalog_cache_key
+
+# (attname, descending)
+OrderingKey = List[Tuple[str, bool]]
+
+
+def _field_after(name: str, value, descending: bool) -> Q:
+    """
+    Rows strictly after ``value`` in one column; NULLs sort first
+    ascending and last descending.
+    """
+    if descending:
+        if value is None:
+            return Q(pk__in=[])
+        return Q(**{f"{name}__lt": value}) | Q(**{f"{name}__isnull": True})
+    if value is None:
+        return Q(**{f"{name}__isnull": False})
+    return Q(**{f"{name}__gt": value})
+
+
+def _field_equal(name: str, value) -> Q:
+    if value is None:
+        return Q(**{f"{name}__isnull": True})
+    return Q(**{name: value})
+
+
+def keyset_after(ordering: OrderingKey, values: list) -> Q:
+    """
+    Lexicographic "row comes after ``values``" condition for ``ordering``.
+    """
+    condition = Q(pk__in=[])
+    equal = Q()
+    for (name, descending), value in zip(ordering, values):
+        condition |= equal & _field_after(name, value, descending)
+        equal &= _field_equal(name, value)
+    return condition
+
+
+class KeysetPagination(BasePagination):
+    cursor_query_param = "cursor"
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = "page_size"
+    max_page_size = 100
+    invalid_cursor_message = "Invalid cursor"
+
+    def get_page_size(self, request) -> int:
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(page_size, self.max_page_size))
+
+    def get_ordering(self, queryset: QuerySet) -> OrderingKey:
+        """
+        Ordering set by OrderingFilter (or the model default), restricted
+        to concrete columns and always ending with pk as the tie-breaker.
+        """
+        order_by = queryset.query.order_by
+        if not order_by and queryset.query.default_ordering:
+            order_by = queryset.model._meta.ordering
+        opts = queryset.model._meta
+        ordering = []
+        for item in order_by:
+            if not isinstance(item, str):
+                continue
+            descending = item.startswith("-")
+            name = item.lstrip("-")
+            if name == "pk":
+                name = opts.pk.name
+            try:
+                model_field = opts.get_field(name)
+            except FieldDoesNotExist:
+                continue
+            if not model_field.concrete:
+                continue
+            ordering.append((model_field.attname, descending))
+            if model_field.primary_key:
+                break
+        if opts.pk.attname not in (name for name, _descending in ordering):
+            ordering.append((opts.pk.attname, False))
+        return ordering
+
+    def decode_cursor(self, request) -> Optional[dict]:
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            cursor = json.loads(urlsafe_b64decode(encoded.encode("ascii")))
+            if not isinstance(cursor["v"], list):
+                raise ValueError
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+        return cursor
+
+    def encode_cursor(self, values: list, reverse: bool) -> str:
+        cursor = {"v": values}
+        if reverse:
+            cursor["r"] = 1
+        encoded = urlsafe_b64encode(
+            json.dumps(cursor, cls=DjangoJSONEncoder).encode()
+        ).decode("ascii")
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def paginate_queryset(self, queryset: QuerySet, request, view=None):
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(queryset)
+
+        cursor = self.decode_cursor(request)
+        reverse = bool(cursor and cursor.get("r"))
+        if cursor and len(cursor["v"]) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+
+        # Previous pages are read backwards from the cursor and flipped.
+        ordering = [(name, descending != reverse) for name, descending in self.ordering]
+        queryset = queryset.order_by(*(
+            F(name).desc(nulls_last=True) if descending else F(name).asc(nulls_first=True)
+            for name, descending in ordering
+        ))
+        if cursor:
+            queryset = queryset.filter(keyset_after(ordering, cursor["v"]))
+
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+
+        self.has_next = has_more if not reverse else True
+        self.has_previous = has_more if reverse else cursor is not None
+        self.page = results
+        return results
+
+    def _get_values(self, instance) -> list:
+        return [getattr(instance, name) for name, _descending in self.ordering]
+
+    def get_next_link(self) -> Optional[str]:
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self._get_values(self.page[-1]), reverse=False)
+
+    def get_previous_link(self) -> Optional[str]:
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self._get_values(self.page[0]), reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response({
+            "next": self.get_next_link(),
+            "previous": self.get_previous_link(),
+            "results": data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "properties": {
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "previous": {"type": "string", "nullable": True, "format": "uri"},
+                "results": schema,
+            },
+        }
+
+
+class SelectablePaginationMixin:
+    """
+    Lets API clients switch a viewset to keyset pagination with
+    ``?pagination=cursor``.
+    """
+    pagination_query_param = "pagination"
+    keyset_pagination_class = KeysetPagination
+
+    @property
+    def paginator(self):
+        if not hasattr(self, "_paginator"):
+            params = self.request.query_params if self.request else {}
+            if params.get(self.pagination_query_param) == "cursor":
+                self._paginator = self.keyset_pagination_class()
+            else:
+                self._paginator = super().paginator
+        return self._paginator
+
+
+class CatalogCountPaginator(Paginator):
+    """
+    Paginator whose total count is cached under ``count_key`` until the
+    catalog version changes.
+    """
+    def __init__(self, *args, count_key: str, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.count_key = count_key
+
+    @cached_property
+    def count(self) -> int:
+        return cache.get_or_set(
+            catalog_cache_key(self.count_key),
+            self.object_list.count,
+            CATALOG_CACHE_TIMEOUT,
+        )
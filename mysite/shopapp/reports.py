@@ -0,0 +1,145 @@
+"""
+Предрассчитанные отчёты о продажах.
+
+Продажи хранятся в ``ProductSalesDaily`` по ячейкам (товар, день).
+Изменения заказов пересчитывают только затронутые ячейки, а отчёты
+читают готовые строки вместо обхода заказов.
+"""
+import datetime
+from typing import Iterable, Optional
+
+from django.db import transaction
+from django.db.models import Case, CharField, F, Q, QuerySet, Sum, Value, When
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import OrderItem, ProductSalesDaily
+
+ROLLUP_BATCH_SIZE = 1000
+
+# (label, min discount, max discount), bounds inclusive
+DISCOUNT_BUCKETS = (
+    ("0%", 0, 0),
+    ("1-9%", 1, 9),
+    ("10-24%", 10, 24),
+    ("25-49%", 25, 49),
+    ("50%+", 50, 100),
+)
+
+
+def _sales_rows(items: QuerySet) -> QuerySet:
+    return (
+        items
+        .annotate(day=TruncDate("order__created_at"))
+        .order_by()
+        .values("product_id", "day")
+        .annotate(
+            units=Sum("quantity"),
+            revenue=Sum(F("quantity") * F("price"), default=0),
+        )
+    )
+
+
+def _save_rows(rows: Iterable[dict]) -> int:
+    rollups = [
+        ProductSalesDaily(
+            product_id=row["product_id"],
+            day=row["day"],
+            units=row["units"],
+            revenue=row["revenue"],
+        )
+        for row in rows
+    ]
+    ProductSalesDaily.objects.bulk_create(rollups, batch_size=ROLLUP_BATCH_SIZE)
+    return len(rollups)
+
+
+def _day_ranges(days: Iterable[datetime.date]) -> Q:
+    """
+    Matches ``order__created_at`` on the given local days; consecutive
+    days become one range, so the index on ``created_at`` is used.
+    """
+    ranges = []
+    for day in sorted(days):
+        if ranges and ranges[-1][1] == day:
+            ranges[-1][1] = day + datetime.timedelta(days=1)
+        else:
+            ranges.append([day, day + datetime.timedelta(days=1)])
+    condition = Q()
+    for start, end in ranges:
+        condition |= Q(
+            order__created_at__gte=timezone.make_aware(datetime.datetime.combine(start, datetime.time.min)),
+            order__created_at__lt=timezone.make_aware(datetime.datetime.combine(end, datetime.time.min)),
+        )
+    return condition
+
+
+def refresh_sales_rollups(product_ids: Iterable[int], days: Iterable[datetime.date]) -> None:
+    """
+    Recomputes the rollup cells of the given products on the given days.
+    """
+    product_ids = set(product_ids)
+    days = set(days)
+    if not product_ids or not days:
+        return
+    items = OrderItem.objects.filter(_day_ranges(days), product_id__in=product_ids)
+    with transaction.atomic():
+        ProductSalesDaily.objects.filter(product_id__in=product_ids, day__in=days).delete()
+        _save_rows(_sales_rows(items))
+
+
+def rebuild_sales_rollups() -> int:
+    with transaction.atomic():
+        ProductSalesDaily.objects.all().delete()
+        return _save_rows(_sales_rows(OrderItem.objects.all()).iterator())
+
+
+def filter_period(
+        rollups: QuerySet,
+        date_from: Optional[datetime.date] = None,
+        date_to: Optional[datetime.date] = None,
+) -> QuerySet:
+    if date_from:
+        rollups = rollups.filter(day__gte=date_from)
+    if date_to:
+        rollups = rollups.filter(day__lte=date_to)
+    return rollups
+
+
+def sales_by_day(rollups: QuerySet) -> QuerySet:
+    return (
+        rollups
+        .order_by("day")
+        .values("day")
+        .annotate(units=Sum("units"), revenue=Sum("revenue"))
+    )
+
+
+def top_products(rollups: QuerySet, limit: int = 10) -> QuerySet:
+    return (
+        rollups
+        .values("product_id", name=F("product__name"))
+        .annotate(units=Sum("units"), revenue=Sum("revenue"))
+        .order_by("-revenue", "product_id")[:limit]
+    )
+
+
+def sales_by_discount(rollups: QuerySet) -> QuerySet:
+    """
+    Revenue grouped by the products' current discount.
+    """
+    bucket = Case(
+        *(
+            When(product__discount__range=(low, high), then=Value(label))
+            for label, low, high in DISCOUNT_BUCKETS
+        ),
+        default=Value("other"),
+        output_field=CharField(),
+    )
+    return (
+        rollups
+        .annotate(bucket=bucket)
+        .order_by("bucket")
+        .values("bucket")
+        .annotate(units=Sum("units"), revenue=Sum("revenue"))
+    )
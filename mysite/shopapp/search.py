@@ -0,0 +1,124 @@
+"""
+Полнотекстовый поиск по товарам на SQLite FTS5.
+
+Виртуальная таблица повторяет ``Product.name``/``description`` и
+поддерживается в актуальном состоянии триггерами, поэтому изменения через
+``bulk_create`` и ``queryset.update`` тоже попадают в индекс. На других
+СУБД и без FTS5 поиск откатывается к обычному ``SearchFilter``.
+"""
+import logging
+from typing import Iterable
+
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections
+from django.db.models import QuerySet
+from django.db.models.expressions import RawSQL
+from rest_framework.filters import SearchFilter
+
+from .models import Product
+
+log = logging.getLogger(__name__)
+
+FTS_TABLE = "shopapp_product_fts"
+
+
+def _sql_statements() -> list:
+    table = Product._meta.db_table
+    pk = Product._meta.pk.column
+    insert = (
+        f"INSERT INTO {FTS_TABLE}(rowid, name, description) "
+        f"VALUES (new.{pk}, new.name, new.description);"
+    )
+    delete = (
+        f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, description) "
+        f"VALUES ('delete', old.{pk}, old.name, old.description);"
+    )
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+        f"name, description, content='{table}', content_rowid='{pk}')",
+        f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON {table} "
+        f"BEGIN {insert} END",
+        f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON {table} "
+        f"BEGIN {delete} END",
+        f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF name, description "
+        f"ON {table} BEGIN {delete} {insert} END",
+    ]
+
+
+# (alias, database name) -> whether the FTS table exists
+_index_exists = {}
+
+
+def search_index_exists(using: str = DEFAULT_DB_ALIAS) -> bool:
+    connection = connections[using]
+    if connection.vendor != "sqlite":
+        return False
+    key = (using, str(connection.settings_dict["NAME"]))
+    if key not in _index_exists:
+        _index_exists[key] = FTS_TABLE in connection.introspection.table_names()
+    return _index_exists[key]
+
+
+def create_search_index(using: str = DEFAULT_DB_ALIAS) -> bool:
+    """
+    Creates the FTS5 table and triggers; returns False if unsupported.
+    """
+    connection = connections[using]
+    if connection.vendor != "sqlite":
+        return False
+    _index_exists.pop((using, str(connection.settings_dict["NAME"])), None)
+    existed = search_index_exists(using)
+    try:
+        with connection.cursor() as cursor:
+            for statement in _sql_statements():
+                cursor.execute(statement)
+    except OperationalError:
+        log.warning("SQLite FTS5 is not available, product search uses LIKE")
+        return False
+    if not existed:
+        rebuild_search_index(using)
+    _index_exists[(using, str(connection.settings_dict["NAME"]))] = True
+    return True
+
+
+def rebuild_search_index(using: str = DEFAULT_DB_ALIAS) -> None:
+    with connections[using].cursor() as cursor:
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+
+
+def build_match_query(terms: Iterable[str]) -> str:
+    """
+    Turns user search terms into an FTS5 query: every term must match,
+    as a quoted prefix so FTS operators in the input are not interpreted.
+    """
+    return " ".join(
+        '"{}"*'.format(term.replace('"', '""'))
+        for term in terms
+    )
+
+
+def full_text_search(queryset: QuerySet, terms: Iterable[str], rank: bool = True) -> QuerySet:
+    match = build_match_query(terms)
+    pk = f"{Product._meta.db_table}.{Product._meta.pk.column}"
+    queryset = queryset.filter(pk__in=RawSQL(
+        f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s",
+        [match],
+    ))
+    if rank:
+        queryset = queryset.annotate(search_rank=RawSQL(
+            f"SELECT rank FROM {FTS_TABLE} "
+            f"WHERE {FTS_TABLE} MATCH %s AND rowid = {pk}",
+            [match],
+        )).order_by("search_rank", "pk")
+    return queryset
+
+
+class ProductFullTextSearchFilter(SearchFilter):
+    """
+    SearchFilter backed by the FTS5 index, ordered by bm25 rank unless
+    the client asks for an explicit ordering.
+    """
+    def filter_queryset(self, request, queryset, view):
+        terms = self.get_search_terms(request)
+        if not terms or not search_index_exists(queryset.db):
+            return super().filter_queryset(request, queryset, view)
+        return full_text_search(queryset, terms)
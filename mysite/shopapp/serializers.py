@@ -19,6 +19,13 @@ class ProductSerializer(serializers.ModelSerializer):
 
 
 class OrderSerializer(serializers.ModelSerializer):
+    # Writable although Order.products goes through OrderItem.
+    products = serializers.PrimaryKeyRelatedField(
+        many=True,
+        queryset=Product.objects.all(),
+        required=False,
+    )
+
     class Meta:
         model = Order
         fields = [
@@ -29,4 +36,35 @@ class OrderSerializer(serializers.ModelSerializer):
             'user',
             'products',
             'receipt',
-        ]
\ No newline at end of file
+            'total',
+            'item_count',
+        ]
+        read_only_fields = [
+            'total',
+            'item_count',
+        ]
+
+
+class SalesReportQuerySerializer(serializers.Serializer):
+    date_from = serializers.DateField(required=False)
+    date_to = serializers.DateField(required=False)
+    limit = serializers.IntegerField(required=False, default=10, min_value=1, max_value=100)
+
+
+class DailySalesSerializer(serializers.Serializer):
+    day = serializers.DateField()
+    units = serializers.IntegerField()
+    revenue = serializers.DecimalField(max_digits=14, decimal_places=2)
+
+
+class ProductSalesSerializer(serializers.Serializer):
+    product_id = serializers.IntegerField()
+    name = serializers.CharField()
+    units = serializers.IntegerField()
+    revenue = serializers.DecimalField(max_digits=14, decimal_places=2)
+
+
+class DiscountSalesSerializer(serializers.Serializer):
+    bucket = serializers.CharField()
+    units = serializers.IntegerField()
+    revenue = serializers.DecimalField(max_digits=14, decimal_places=2)
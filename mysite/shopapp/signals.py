@@ -0,0 +1,101 @@
+from typing import Iterable
+
+from django.db.models import OuterRef, Subquery
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .caching import bump_catalog_version, touch_change_stamp
+from .images import schedule_variants
+from .models import Order, OrderItem, Product
+from .reports import refresh_sales_rollups
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def product_changed(sender, **kwargs) -> None:
+    bump_catalog_version()
+
+
+@receiver(post_save, sender=Product)
+def product_preview_changed(sender, instance: Product, raw: bool = False, **kwargs) -> None:
+    if not raw:
+        schedule_variants(instance)
+
+
+@receiver(post_save, sender=Order)
+@receiver(post_delete, sender=Order)
+def order_changed(sender, **kwargs) -> None:
+    touch_change_stamp("order")
+
+
+def update_order_totals(order_ids: Iterable[int]) -> None:
+    for order in Order.objects.filter(pk__in=order_ids).only("pk"):
+        order.recalculate_totals()
+    touch_change_stamp("order")
+
+
+def update_sales_rollups(order_ids: Iterable[int], product_ids: Iterable[int]) -> None:
+    days = {
+        timezone.localdate(created_at)
+        for created_at in Order.objects.filter(pk__in=order_ids).values_list("created_at", flat=True)
+    }
+    refresh_sales_rollups(product_ids, days)
+
+
+@receiver(pre_save, sender=OrderItem)
+def snapshot_order_item_price(sender, instance: OrderItem, **kwargs) -> None:
+    if instance.price is None:
+        instance.price = instance.product.price
+    if instance.pk and not kwargs.get("raw"):
+        # The item may be moved to another product, both need a refresh.
+        instance._previous_product_id = (
+            OrderItem.objects
+            .filter(pk=instance.pk)
+            .values_list("product_id", flat=True)
+            .first()
+        )
+
+
+@receiver(post_save, sender=OrderItem)
+@receiver(post_delete, sender=OrderItem)
+def order_item_changed(sender, instance: OrderItem, **kwargs) -> None:
+    update_order_totals([instance.order_id])
+    product_ids = {instance.product_id, getattr(instance, "_previous_product_id", None)}
+    update_sales_rollups([instance.order_id], product_ids - {None})
+
+
+@receiver(m2m_changed, sender=Order.products.through)
+def order_products_changed(sender, instance, action, reverse, pk_set, **kwargs) -> None:
+    """
+    ``order.products.add()``/``remove()``/``clear()`` bypass OrderItem
+    signals, so prices are snapshotted and totals and rollups refreshed here.
+    """
+    if action == "pre_clear":
+        # The affected rows are unknown once they are gone.
+        if reverse:
+            instance._cleared_pks = list(instance.orders.values_list("pk", flat=True))
+        else:
+            instance._cleared_pks = list(instance.products.values_list("pk", flat=True))
+        return
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+
+    related_ids = pk_set if pk_set is not None else instance._cleared_pks
+    if reverse:
+        order_ids, product_ids = related_ids, [instance.pk]
+    else:
+        order_ids, product_ids = [instance.pk], related_ids
+
+    if action == "post_add":
+        items = OrderItem.objects.filter(price__isnull=True)
+        if reverse:
+            items = items.filter(product=instance, order_id__in=pk_set)
+        else:
+            items = items.filter(order=instance, product_id__in=pk_set)
+        items.update(price=Subquery(
+            Product.objects.filter(pk=OuterRef("product_id")).values("price")[:1]
+        ))
+
+    update_order_totals(order_ids)
+    update_sales_rollups(order_ids, product_ids)
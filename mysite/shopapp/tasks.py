@@ -0,0 +1,44 @@
+"""
+Фоновые задачи магазина, выполняются командой ``manage.py run_jobs``.
+"""
+from typing import Optional
+
+from jobsapp.jobs import task
+from jobsapp.models import Job
+
+from .caching import bump_catalog_version
+from .common import save_csv_products, ImportReport
+from .images import get_variant_model, update_variants
+from .models import Product
+
+
+@task("shopapp.import_products_csv")
+def import_products_csv(job: Job, encoding: Optional[str] = None, upsert: bool = False) -> dict:
+    size = max(job.input_file.size, 1)
+    job.input_file.open("rb")
+    file = job.input_file.file
+    try:
+        def on_batch(report: ImportReport) -> None:
+            job.set_progress(file.tell() * 100 // size)
+
+        report = save_csv_products(
+            file,
+            encoding=encoding,
+            created_by=job.created_by,
+            upsert=upsert,
+            on_batch=on_batch,
+        )
+    finally:
+        job.input_file.close()
+    return report.as_dict()
+
+
+@task("shopapp.generate_image_variants")
+def generate_image_variants(job: Job, model: str, pk: int) -> dict:
+    instance = get_variant_model(model).objects.filter(pk=pk).first()
+    if instance is None:
+        return {"images": 0}
+    variants = update_variants(instance)
+    if isinstance(instance, Product):
+        bump_catalog_version()
+    return {"images": len(variants.get("images", []))}
@@ -0,0 +1,52 @@
+from django import template
+from django.db.models.fields.files import ImageFieldFile
+from django.utils.html import format_html
+
+from shopapp.images import variants_are_current
+
+register = template.Library()
+
+
+def _srcset(image: ImageFieldFile, variants: list) -> str:
+    return ", ".join(
+        f"{image.storage.url(variant['name'])} {variant['width']}w"
+        for variant in variants
+    )
+
+
+@register.simple_tag
+def image_srcset(image: ImageFieldFile, variants: dict, alt: str = "", sizes: str = "100vw") -> str:
+    """
+    Renders ``<picture>`` with WebP and JPEG ``srcset`` from the stored
+    variants, or a plain ``<img>`` of the original until they are ready.
+
+    Usage: ``{% image_srcset product.preview product.preview_variants alt=product.name sizes="320px" %}``
+    """
+    if not image:
+        return ""
+    if not variants_are_current(image, variants) or not variants.get("images"):
+        return format_html('<img src="{}" alt="{}">', image.url, alt)
+
+    webp = [variant for variant in variants["images"] if variant["type"] == "image/webp"]
+    jpeg = [variant for variant in variants["images"] if variant["type"] == "image/jpeg"]
+    if not jpeg:
+        return format_html('<img src="{}" alt="{}">', image.url, alt)
+    largest = jpeg[-1]
+
+    source = ""
+    if webp:
+        source = format_html(
+            '<source type="image/webp" srcset="{}" sizes="{}">',
+            _srcset(image, webp),
+            sizes,
+        )
+    return format_html(
+        '<picture>{}<img src="{}" srcset="{}" sizes="{}" width="{}" height="{}" alt="{}" loading="lazy"></picture>',
+        source,
+        image.storage.url(largest["name"]),
+        _srcset(image, jpeg),
+        sizes,
+        largest["width"],
+        largest["height"],
+        alt,
+    )
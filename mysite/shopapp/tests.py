@@ -1,14 +1,35 @@
+import gzip
+import json
+import time
+from io import BytesIO, StringIO
 from random import choices
+from tempfile import mkdtemp
+from unittest.mock import patch
 from string import ascii_letters
 
 from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command, CommandError
 
 from django.contrib.auth.models import User, Permission
-from django.test import TestCase
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
 from django.urls import reverse
+from PIL import Image
 
-from shopapp.models import Product, Order
+from shopapp.caching import (aget_or_compute, cache_view_page, get_change_stamp,
+                             get_or_compute, touch_change_stamp)
+from shopapp.common import save_csv_products
+from jobsapp.jobs import enqueue, run_job
+from jobsapp.models import Job
+from myauth.models import Profile
+from mysite.cache_backends import TwoTierCache
+from mysite.queries import QueryBudgetExceeded
+from mysite.write_queue import WriteTimeout
+from shopapp.models import Product, Order, OrderItem, ProductSalesDaily
 from shopapp.utils import add_two_numbers
+from shopapp.views import OrdersListView
 
 
 class AddTwoNumbersTestCase(TestCase):
@@ -77,6 +98,48 @@ class ProductsListViewTestCase(TestCase):
         )
         self.assertTemplateUsed(response, 'shopapp/products_list.html')
 
+    def test_products_paginated_with_cached_count(self):
+        creator = User.objects.get(pk=1)
+        Product.objects.bulk_create(
+            Product(name=f"Paged product {number}", price=1, created_by=creator)
+            for number in range(30)
+        )
+        cache.clear()
+        url = reverse("shopapp:products_list")
+        first = self.client.get(url, HTTP_USER_AGENT='Mozilla/5.0')
+        self.assertEqual(len(first.context["products"]), 20)
+        self.assertEqual(first.context["products_count"], 33)
+
+        # update() sends no signals: the cached count stays until a bump.
+        Product.objects.filter(name="Paged product 0").update(archived=True)
+        cached = self.client.get(url, {"page": 2}, HTTP_USER_AGENT='Mozilla/5.0')
+        self.assertEqual(cached.context["products_count"], 33)
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.get(name="Paged product 1").delete()
+        fresh = self.client.get(url, {"page": 2}, HTTP_USER_AGENT='Mozilla/5.0')
+        self.assertEqual(fresh.context["products_count"], 31)
+
+    def test_products_keyset_navigation(self):
+        creator = User.objects.get(pk=1)
+        Product.objects.bulk_create(
+            Product(name=f"Keyset product {number}", price=1, created_by=creator)
+            for number in range(30)
+        )
+        cache.clear()
+        url = reverse("shopapp:products_list")
+        received = []
+        params = {}
+        while True:
+            response = self.client.get(url, params, HTTP_USER_AGENT='Mozilla/5.0')
+            received.extend(product.pk for product in response.context["products"])
+            if response.context["next_after"] is None:
+                break
+            params = {"after": response.context["next_after"]}
+        self.assertEqual(
+            received,
+            list(Product.objects.filter(archived=False).values_list("pk", flat=True)),
+        )
+
 
 class OrdersListViewTestCase(TestCase):
 
@@ -103,6 +166,45 @@ class OrdersListViewTestCase(TestCase):
         self.assertIn(str(settings.LOGIN_URL), response.url)
 
 
+class OrdersListPaginationTestCase(TestCase):
+    fixtures = [
+        'users-fixture.json',
+        'products-fixture.json',
+        'orders-fixture.json',
+    ]
+
+    def setUp(self) -> None:
+        self.user = User.objects.get(pk=2)
+        self.client.force_login(self.user)
+
+    def test_products_preview_is_capped(self):
+        creator = User.objects.get(pk=1)
+        order = Order.objects.create(user=self.user, delivery_address="Many products")
+        for number in range(7):
+            order.products.add(Product.objects.create(
+                name=f"Bulk product {number}", price=1, created_by=creator,
+            ))
+
+        response = self.client.get(reverse("shopapp:orders_list"), HTTP_USER_AGENT='Mozilla/5.0')
+        listed = next(o for o in response.context["orders"] if o.pk == order.pk)
+        self.assertEqual(len(listed.preview_products), 5)
+        self.assertEqual(listed.product_count, 7)
+        self.assertContains(response, "7 products in total")
+
+    def test_orders_are_paginated(self):
+        Order.objects.bulk_create(
+            Order(user=self.user, delivery_address=f"Address {number}")
+            for number in range(25)
+        )
+        url = reverse("shopapp:orders_list")
+        first = self.client.get(url, HTTP_USER_AGENT='Mozilla/5.0')
+        self.assertEqual(len(first.context["orders"]), 20)
+        with self.assertNumQueries(5):
+            # session, user, count, page, prefetch
+            second = self.client.get(url, {"page": 2}, HTTP_USER_AGENT='Mozilla/5.0')
+        self.assertEqual(len(second.context["orders"]), 6)
+
+
 class ProductsExportViewTestCase(TestCase):
     fixtures = [
         'users-fixture.json',
@@ -110,6 +212,9 @@ class ProductsExportViewTestCase(TestCase):
         'orders-fixture.json',
     ]
 
+    def setUp(self) -> None:
+        cache.clear()
+
     def test_get_products_view(self):
         response = self.client.get(
             reverse("shopapp:products-export"),
@@ -133,6 +238,74 @@ class ProductsExportViewTestCase(TestCase):
             expected_data,
         )
 
+    def test_get_products_view_invalidated_on_change(self):
+        url = reverse("shopapp:products-export")
+        self.client.get(url, HTTP_USER_AGENT='Mozilla/5.0')
+
+        product = Product.objects.order_by("pk").first()
+        product.name = "Renamed product"
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+
+        response = self.client.get(url, HTTP_USER_AGENT='Mozilla/5.0')
+        self.assertEqual(response.json()["products"][0]["name"], "Renamed product")
+
+    def test_get_products_view_compressed(self):
+        url = reverse("shopapp:products-export")
+        plain = self.client.get(url, HTTP_USER_AGENT='Mozilla/5.0')
+        self.assertNotIn("Content-Encoding", plain)
+
+        response = self.client.get(
+            url,
+            HTTP_USER_AGENT='Mozilla/5.0',
+            HTTP_ACCEPT_ENCODING='gzip, br;q=0',
+        )
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", response["Vary"])
+        self.assertEqual(gzip.decompress(response.content), plain.content)
+
+    async def test_get_products_view_ndjson(self):
+        response = await self.async_client.get(
+            reverse("shopapp:products-export"),
+            {"format": "ndjson"},
+            headers={'User-Agent': 'Mozilla/5.0'},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_async)
+        lines = b"".join([chunk async for chunk in response.streaming_content]).decode().splitlines()
+        self.assertEqual(
+            [json.loads(line)["pk"] for line in lines],
+            [pk async for pk in Product.objects.order_by("pk").values_list("pk", flat=True)],
+        )
+
+    async def test_get_products_view_async(self):
+        response = await self.async_client.get(
+            reverse("shopapp:products-export"),
+            headers={'User-Agent': 'Mozilla/5.0'},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [product["pk"] for product in response.json()["products"]],
+            [pk async for pk in Product.objects.order_by("pk").values_list("pk", flat=True)],
+        )
+        self.assertIn("X-Request-ID", response)
+
+    def test_get_products_view_keyset(self):
+        pks = list(Product.objects.order_by("pk").values_list("pk", flat=True))
+        received_pks = []
+        after = 0
+        while after is not None:
+            response = self.client.get(
+                reverse("shopapp:products-export"),
+                {"after": after, "limit": 1},
+                HTTP_USER_AGENT='Mozilla/5.0',
+            )
+            self.assertEqual(response.status_code, 200)
+            data = response.json()
+            received_pks.extend(product["pk"] for product in data["products"])
+            after = data["next_after"]
+        self.assertEqual(received_pks, pks)
+
 
 class OrderDetailViewTestCase(TestCase):
     @classmethod
@@ -184,6 +357,7 @@ class OrdersExportViewTestCase(TestCase):
     @classmethod
     def tearDownClass(cls):
         cls.user.delete()
+        super().tearDownClass()
 
     def setUp(self) -> None:
         self.client.force_login(self.user)
@@ -219,3 +393,655 @@ class OrdersExportViewTestCase(TestCase):
             orders_data["orders"],
             expected_data,
         )
+
+
+class ProductsDownloadCSVTestCase(TestCase):
+    fixtures = [
+        'users-fixture.json',
+        'products-fixture.json',
+    ]
+
+    def test_download_csv_stream(self):
+        response = self.client.get(
+            reverse("shopapp:product-download-csv"),
+            {"stream": 1, "ordering": "price"},
+            HTTP_USER_AGENT='Mozilla/5.0',
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], "name,description,price,discount")
+        expected_names = list(
+            Product.objects.order_by("price").values_list("name", flat=True)
+        )
+        self.assertEqual(
+            [line.split(",")[0] for line in lines[1:]],
+            expected_names,
+        )
+
+    def test_download_csv_stream_off(self):
+        url = reverse("shopapp:product-download-csv")
+        for value in ("0", "false"):
+            with self.subTest(stream=value):
+                response = self.client.get(url, {"stream": value}, HTTP_USER_AGENT='Mozilla/5.0')
+                self.assertEqual(response.status_code, 200)
+                self.assertFalse(response.streaming)
+
+        response = self.client.get(url, {"stream": "maybe"}, HTTP_USER_AGENT='Mozilla/5.0')
+        self.assertEqual(response.status_code, 400)
+
+
+class SaveCSVProductsTestCase(TestCase):
+    fixtures = [
+        'users-fixture.json',
+        'products-fixture.json',
+    ]
+
+    def test_import_reports_row_errors(self):
+        csv_data = (
+            "name,price,discount,created_by\n"
+            "Phone,10.50,5,1\n"
+            "Broken,not-a-price,0,1\n"
+            "Watch,20,0,999\n"
+            "Camera,30,0,\n"
+        )
+        user = User.objects.get(pk=2)
+        report = save_csv_products(
+            BytesIO(csv_data.encode()),
+            encoding="utf-8",
+            created_by=user,
+            batch_size=2,
+        )
+        self.assertEqual(report.imported, 2)
+        self.assertEqual([error["row"] for error in report.errors], [3, 4])
+        self.assertEqual(Product.objects.get(name="Phone").created_by_id, 1)
+        self.assertEqual(Product.objects.get(name="Camera").created_by, user)
+
+    def test_conflicting_row_fails_alone(self):
+        csv_data = (
+            "name,price,created_by\n"
+            "Lamp,12,1\n"
+            "Desktop,999.99,1\n"
+            "Watch,20,999\n"
+            "Chair,30,1\n"
+        )
+        report = save_csv_products(BytesIO(csv_data.encode()), encoding="utf-8")
+        self.assertEqual(report.imported, 2)
+        self.assertEqual(sorted(error["row"] for error in report.errors), [3, 4])
+        self.assertEqual(Product.objects.filter(name__in=["Lamp", "Chair"]).count(), 2)
+        self.assertEqual(Product.objects.filter(name="Desktop").count(), 1)
+
+    def test_duplicate_rows_are_reported(self):
+        csv_data = (
+            "name,price,created_by\n"
+            "Lamp,12,1\n"
+            "Lamp,13,1\n"
+            "Chair,30,x\n"
+            "Lamp,14,1\n"
+        )
+        report = save_csv_products(BytesIO(csv_data.encode()), encoding="utf-8", upsert=True)
+        self.assertEqual(report.imported, 1)
+        self.assertEqual(report.errors[0], {"row": 3, "errors": {"name": ["Duplicate of row 2."]}})
+        self.assertEqual((report.errors[1]["row"], list(report.errors[1]["errors"])), (4, ["created_by"]))
+        self.assertEqual(report.errors[2], {"row": 5, "errors": {"name": ["Duplicate of row 2."]}})
+        self.assertEqual(str(Product.objects.get(name="Lamp").price), "12.00")
+
+    def test_import_upsert_by_name(self):
+        desktop = Product.objects.get(name="Desktop")
+        csv_data = "name,price\nDesktop,999.99\nKeyboard,15\n"
+        report = save_csv_products(
+            BytesIO(csv_data.encode()),
+            encoding="utf-8",
+            created_by=User.objects.get(pk=1),
+            upsert=True,
+        )
+        self.assertEqual(report.errors, [])
+        desktop.refresh_from_db()
+        self.assertEqual(str(desktop.price), "999.99")
+        self.assertEqual(desktop.description, "Cool Desktop")
+        self.assertTrue(Product.objects.filter(name="Keyboard").exists())
+
+
+@override_settings(MEDIA_ROOT=mkdtemp())
+class ProductsUploadCSVTestCase(TestCase):
+    fixtures = [
+        'users-fixture.json',
+    ]
+
+    def test_upload_csv_enqueues_job(self):
+        self.client.force_login(User.objects.get(pk=1))
+        response = self.client.post(
+            reverse("shopapp:product-upload-csv"),
+            {"file": SimpleUploadedFile("products.csv", b"name,price\nLamp,12\n")},
+            HTTP_USER_AGENT='Mozilla/5.0',
+        )
+        self.assertEqual(response.status_code, 202)
+        job = Job.objects.get(pk=response.json()["job"])
+        self.assertFalse(Product.objects.filter(name="Lamp").exists())
+
+        self.assertEqual(run_job(job.pk), Job.State.DONE)
+        job.refresh_from_db()
+        self.assertEqual(job.result["imported"], 1)
+        self.assertEqual(Product.objects.get(name="Lamp").created_by_id, 1)
+
+
+class ProductsCursorPaginationTestCase(TestCase):
+    fixtures = [
+        'users-fixture.json',
+        'products-fixture.json',
+    ]
+
+    def setUp(self) -> None:
+        Product.objects.bulk_create([
+            Product(name=f"Item {index}", price=index % 3, created_by_id=1)
+            for index in range(7)
+        ])
+
+    def collect(self, url: str) -> list:
+        pks = []
+        while url:
+            response = self.client.get(url, HTTP_USER_AGENT='Mozilla/5.0')
+            self.assertEqual(response.status_code, 200)
+            data = response.json()
+            self.assertNotIn("count", data)
+            pks.extend(product["pk"] for product in data["results"])
+            url = data["next"]
+        return pks
+
+    def test_cursor_pagination_with_ordering(self):
+        url = reverse("shopapp:product-list") + "?pagination=cursor&page_size=2&ordering=-price"
+        expected = list(
+            Product.objects.order_by("-price", "pk").values_list("pk", flat=True)
+        )
+        self.assertEqual(self.collect(url), expected)
+
+    def test_cursor_pagination_previous(self):
+        url = reverse("shopapp:product-list") + "?pagination=cursor&page_size=3&ordering=price"
+        first = self.client.get(url, HTTP_USER_AGENT='Mozilla/5.0').json()
+        second = self.client.get(first["next"], HTTP_USER_AGENT='Mozilla/5.0').json()
+        self.assertIsNone(first["previous"])
+        previous = self.client.get(second["previous"], HTTP_USER_AGENT='Mozilla/5.0').json()
+        self.assertEqual(previous["results"], first["results"])
+
+
+class ProductFullTextSearchTestCase(TestCase):
+    fixtures = [
+        'users-fixture.json',
+        'products-fixture.json',
+    ]
+
+    def search(self, term: str) -> list:
+        response = self.client.get(
+            reverse("shopapp:product-list"),
+            {"search": term},
+            HTTP_USER_AGENT='Mozilla/5.0',
+        )
+        self.assertEqual(response.status_code, 200)
+        return [product["name"] for product in response.json()["results"]]
+
+    def test_search_follows_changes(self):
+        self.assertEqual(self.search("tab"), ["Tablet"])
+
+        Product.objects.filter(name="Tablet").update(description="Cool Phablet")
+        self.assertEqual(self.search("phablet"), ["Tablet"])
+
+        Product.objects.filter(name="Tablet").delete()
+        self.assertEqual(self.search("tablet"), [])
+
+    def test_search_ignores_fts_syntax(self):
+        self.assertEqual(self.search('cool" OR "desk'), [])
+
+
+class OrderTotalsTestCase(TestCase):
+    fixtures = [
+        'users-fixture.json',
+        'products-fixture.json',
+    ]
+
+    def setUp(self) -> None:
+        self.order = Order.objects.create(delivery_address="Test address", user_id=1)
+        self.desktop = Product.objects.get(name="Desktop")
+        self.tablet = Product.objects.get(name="Tablet")
+
+    def assertTotals(self, total: str, item_count: int):
+        self.order.refresh_from_db()
+        self.assertEqual(str(self.order.total), total)
+        self.assertEqual(self.order.item_count, item_count)
+
+    def test_totals_follow_line_items(self):
+        self.order.products.add(self.desktop, self.tablet)
+        self.assertTotals("1690.00", 2)
+
+        # The price is a snapshot taken when the item was added.
+        Product.objects.filter(pk=self.desktop.pk).update(price=1)
+        self.assertTotals("1690.00", 2)
+
+        item = OrderItem.objects.get(order=self.order, product=self.tablet)
+        item.quantity = 3
+        item.save()
+        self.assertTotals("2602.00", 4)
+
+        self.order.products.remove(self.tablet)
+        self.assertTotals("1234.00", 1)
+
+        self.desktop.orders.clear()
+        self.assertTotals("0.00", 0)
+
+    def test_check_order_totals(self):
+        self.order.products.add(self.desktop)
+        Order.objects.filter(pk=self.order.pk).update(total=0)
+        with self.assertRaises(CommandError):
+            call_command("check_order_totals", stdout=StringIO())
+
+        call_command("check_order_totals", fix=True, stdout=StringIO())
+        self.assertTotals("1234.00", 1)
+
+
+class SalesReportTestCase(TestCase):
+    fixtures = [
+        'users-fixture.json',
+        'products-fixture.json',
+    ]
+
+    def setUp(self) -> None:
+        self.client.force_login(User.objects.get(username="admin"))
+        self.desktop = Product.objects.get(name="Desktop")
+        self.tablet = Product.objects.get(name="Tablet")
+        first = Order.objects.create(delivery_address="First", user_id=1)
+        first.products.add(self.desktop, self.tablet)
+        second = Order.objects.create(delivery_address="Second", user_id=1)
+        second.products.add(self.tablet, through_defaults={"quantity": 2})
+
+    def get(self, name: str, **params) -> list:
+        response = self.client.get(reverse(name), params, HTTP_USER_AGENT='Mozilla/5.0')
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_rollups_follow_orders(self):
+        rollup = ProductSalesDaily.objects.get(product=self.tablet)
+        self.assertEqual(rollup.units, 3)
+        self.assertEqual(str(rollup.revenue), "1368.00")
+
+        Order.objects.get(delivery_address="Second").delete()
+        self.assertEqual(ProductSalesDaily.objects.get(product=self.tablet).units, 1)
+
+        ProductSalesDaily.objects.all().delete()
+        call_command("rebuild_rollups", stdout=StringIO())
+        self.assertEqual(ProductSalesDaily.objects.get(product=self.tablet).units, 1)
+
+    def test_reports(self):
+        sales = self.get("shopapp:report-sales")
+        self.assertEqual(len(sales), 1)
+        self.assertEqual(sales[0]["units"], 4)
+        self.assertEqual(sales[0]["revenue"], "2602.00")
+
+        top = self.get("shopapp:report-top-products", limit=1)
+        self.assertEqual([row["name"] for row in top], ["Tablet"])
+
+        buckets = self.get("shopapp:report-by-discount")
+        self.assertEqual(
+            {row["bucket"]: row["units"] for row in buckets},
+            {"10-24%": 4},
+        )
+
+        self.assertEqual(self.get("shopapp:report-sales", date_to="2000-01-01"), [])
+
+
+class ConditionalGetTestCase(TestCase):
+    fixtures = [
+        'users-fixture.json',
+        'products-fixture.json',
+    ]
+
+    def setUp(self) -> None:
+        cache.clear()
+
+    def test_product_list_not_modified(self):
+        url = reverse("shopapp:product-list")
+        response = self.client.get(url, HTTP_USER_AGENT='Mozilla/5.0')
+        etag = response["ETag"]
+        self.assertTrue(etag.startswith("W/"))
+
+        response = self.client.get(url, HTTP_USER_AGENT='Mozilla/5.0', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        response = self.client.get(
+            url,
+            {"ordering": "price"},
+            HTTP_USER_AGENT='Mozilla/5.0',
+            HTTP_IF_NONE_MATCH=etag,
+        )
+        self.assertEqual(response.status_code, 200)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.filter(name="Desktop").first().save()
+        response = self.client.get(url, HTTP_USER_AGENT='Mozilla/5.0', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_stamp_bumped_on_commit(self):
+        before = get_change_stamp("product")
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.filter(name="Desktop").first().save()
+            self.assertEqual(get_change_stamp("product"), before)
+        bumped = get_change_stamp("product")
+        self.assertGreater(bumped, before)
+
+        # Bumps from the same clock tick still get distinct stamps.
+        with patch("shopapp.caching.time.time_ns", return_value=before), \
+                self.captureOnCommitCallbacks(execute=True):
+            touch_change_stamp("product")
+        self.assertEqual(get_change_stamp("product"), bumped + 1)
+
+    def test_product_details_not_modified(self):
+        product = Product.objects.get(name="Desktop")
+        url = reverse("shopapp:product_details", kwargs={"pk": product.pk})
+        response = self.client.get(url, HTTP_USER_AGENT='Mozilla/5.0')
+        self.assertIn("Last-Modified", response)
+
+        response = self.client.get(
+            url,
+            HTTP_USER_AGENT='Mozilla/5.0',
+            HTTP_IF_NONE_MATCH=response["ETag"],
+        )
+        self.assertEqual(response.status_code, 304)
+
+
+class ProductsListCacheTestCase(TestCase):
+    fixtures = [
+        'users-fixture.json',
+        'products-fixture.json',
+    ]
+
+    def get(self, **params):
+        return self.client.get(
+            reverse("shopapp:product-list"),
+            params,
+            HTTP_USER_AGENT='Mozilla/5.0',
+            HTTP_ACCEPT='application/json',
+            **self.extra,
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.extra = {}
+
+    def test_list_cache_hit_and_invalidation(self):
+        self.assertEqual(self.get(ordering="price", search="")["X-Cache"], "MISS")
+        response = self.get(search="", ordering="price")
+        self.assertEqual(response["X-Cache"], "HIT")
+        self.assertEqual(response.json()["count"], 3)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.create(name="Lamp", created_by_id=1)
+        response = self.get(ordering="price")
+        self.assertEqual(response["X-Cache"], "MISS")
+        self.assertEqual(response.json()["count"], 4)
+
+    def test_list_cache_varies_on_user(self):
+        self.get()
+        self.client.force_login(User.objects.get(username="admin"))
+        self.assertEqual(self.get()["X-Cache"], "MISS")
+        self.client.force_login(User.objects.create_user(username="jane"))
+        self.get()
+        self.client.force_login(User.objects.get(username="john"))
+        self.assertEqual(self.get()["X-Cache"], "MISS")
+        self.assertEqual(self.get()["X-Cache"], "HIT")
+
+    @override_settings(ALLOWED_HOSTS=["testserver", "shop.example.com"])
+    def test_list_cache_varies_on_host_and_scheme(self):
+        self.get()
+        self.extra = {"HTTP_HOST": "shop.example.com"}
+        self.assertEqual(self.get()["X-Cache"], "MISS")
+        self.extra["secure"] = True
+        self.assertEqual(self.get()["X-Cache"], "MISS")
+        self.assertEqual(self.get()["X-Cache"], "HIT")
+
+
+SHARED_CACHE_DIR = mkdtemp()
+
+
+@override_settings(MEDIA_ROOT=mkdtemp(), CACHES={
+    "default": {
+        "BACKEND": "mysite.cache_backends.TwoTierCache",
+        "OPTIONS": {"SHARED": "shared"},
+    },
+    # The web and the job worker containers mount the same directory.
+    "shared": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": SHARED_CACHE_DIR,
+    },
+    "worker_shared": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": SHARED_CACHE_DIR,
+    },
+})
+class WorkerCacheInvalidationTestCase(TestCase):
+    fixtures = [
+        'users-fixture.json',
+        'products-fixture.json',
+    ]
+
+    def get(self):
+        return self.client.get(
+            reverse("shopapp:product-list"),
+            HTTP_USER_AGENT='Mozilla/5.0',
+            HTTP_ACCEPT='application/json',
+        )
+
+    def test_job_bump_invalidates_cached_page(self):
+        self.get()
+        self.assertEqual(self.get()["X-Cache"], "HIT")
+
+        job = enqueue(
+            "shopapp.import_products_csv",
+            created_by=User.objects.get(pk=1),
+            input_file=SimpleUploadedFile("products.csv", b"name,price\nLamp,12\n"),
+        )
+        # The worker has its own cache objects, only the directory is shared.
+        worker_cache = TwoTierCache(None, {"OPTIONS": {"SHARED": "worker_shared"}})
+        with patch("shopapp.caching.cache", worker_cache), \
+                self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(run_job(job.pk), Job.State.DONE)
+
+        response = self.get()
+        self.assertEqual(response["X-Cache"], "MISS")
+        self.assertEqual(response.json()["count"], 4)
+
+
+class GetOrComputeTestCase(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+
+    def test_single_flight_and_stale_while_revalidate(self):
+        calls = []
+
+        def compute():
+            calls.append(1)
+            return len(calls)
+
+        self.assertEqual(get_or_compute("test_compute", compute, version=1), 1)
+        self.assertEqual(get_or_compute("test_compute", compute, version=1), 1)
+        self.assertEqual(len(calls), 1)
+
+        # Someone else is rebuilding: the stale value is served meanwhile.
+        cache.add("computed:test_compute:lock", 1)
+        self.assertEqual(get_or_compute("test_compute", compute, version=2), 1)
+        cache.delete("computed:test_compute:lock")
+
+        self.assertEqual(get_or_compute("test_compute", compute, version=2), 2)
+        self.assertEqual(get_or_compute("test_compute", compute, version=2), 2)
+        self.assertEqual(len(calls), 2)
+
+    def test_lock_of_another_worker_is_kept(self):
+        def compute():
+            # Our lock expired meanwhile and another worker took it.
+            cache.set("computed:test_lock:lock", "other")
+            return 1
+
+        self.assertEqual(get_or_compute("test_lock", compute), 1)
+        self.assertEqual(cache.get("computed:test_lock:lock"), "other")
+
+    def test_wait_is_capped(self):
+        cache.add("computed:test_wait:lock", "other")
+        started = time.monotonic()
+        self.assertEqual(get_or_compute("test_wait", lambda: 1, max_wait=0.2), 1)
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual(cache.get("computed:test_wait:lock"), "other")
+
+    async def test_async_wait_is_capped(self):
+        async def compute():
+            return 1
+
+        await cache.aadd("computed:test_await:lock", "other")
+        self.assertEqual(await aget_or_compute("test_await", compute, max_wait=0.2), 1)
+        self.assertEqual(await aget_or_compute("test_await", compute), 1)
+        self.assertEqual(await cache.aget("computed:test_await:lock"), "other")
+
+
+    def test_cache_view_page_stores_only_plain_ok_responses(self):
+        responses = []
+
+        @cache_view_page(60)
+        def view(request):
+            response = HttpResponse(str(len(responses)), status=responses[-1])
+            if request.GET.get("cookie"):
+                response.set_cookie("session_hint", "1")
+            return response
+
+        def get(path):
+            return view(RequestFactory().get(path)).content
+
+        responses.append(404)
+        self.assertEqual(get("/missing/"), b"1")
+        responses.append(404)
+        self.assertEqual(get("/missing/"), b"2")
+
+        responses.append(200)
+        self.assertEqual(get("/page/?cookie=1"), b"3")
+        responses.append(200)
+        self.assertEqual(get("/page/?cookie=1"), b"4")
+
+        self.assertEqual(get("/page/"), b"4")
+        responses.append(200)
+        self.assertEqual(get("/page/"), b"4")
+
+
+def make_image(width: int, height: int, name: str = "preview.png") -> SimpleUploadedFile:
+    buffer = BytesIO()
+    Image.new("RGBA", (width, height), (200, 50, 50, 255)).save(buffer, "PNG")
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type="image/png")
+
+
+@override_settings(MEDIA_ROOT=mkdtemp())
+class ImageVariantsTestCase(TestCase):
+    fixtures = [
+        'users-fixture.json',
+    ]
+
+    def test_upload_generates_variants(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            product = Product.objects.create(
+                name="Pictured product",
+                created_by=User.objects.get(pk=1),
+                preview=make_image(800, 400),
+            )
+        original = product.preview.read()
+        job = Job.objects.get(task="shopapp.generate_image_variants")
+        self.assertEqual(run_job(job.pk), Job.State.DONE)
+
+        product.refresh_from_db()
+        variants = product.preview_variants
+        self.assertEqual(variants["source"], product.preview.name)
+        self.assertEqual(
+            sorted((image["width"], image["type"]) for image in variants["images"]),
+            [(width, content_type) for width in (160, 320, 640) for content_type in ("image/jpeg", "image/webp")],
+        )
+        self.assertEqual(variants["images"][0]["height"], 80)
+        with product.preview.open("rb") as file:
+            self.assertEqual(file.read(), original)
+
+        response = self.client.get(reverse("shopapp:products_list"), HTTP_USER_AGENT='Mozilla/5.0')
+        self.assertContains(response, '<source type="image/webp"')
+        self.assertContains(response, "-640w.jpg 640w")
+
+        # Saving without a new upload does not queue another job.
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+        self.assertEqual(Job.objects.filter(task="shopapp.generate_image_variants").count(), 1)
+
+    def test_backfill_command(self):
+        product = Product(name="Small picture", created_by=User.objects.get(pk=1))
+        product.preview.save("small.png", make_image(100, 100), save=False)
+        Product.objects.bulk_create([product])
+
+        call_command("backfill_image_variants", stdout=StringIO())
+        variants = Product.objects.get(name="Small picture").preview_variants
+        self.assertEqual(
+            [(image["width"], image["type"]) for image in variants["images"]],
+            [(100, "image/webp"), (100, "image/jpeg")],
+        )
+
+
+@patch("shopapp.views.submit_write", side_effect=WriteTimeout("busy", retry_after=3))
+class WriteTimeoutTestCase(TestCase):
+    fixtures = [
+        'users-fixture.json',
+    ]
+
+    def test_form_view_answers_503(self, submit_write):
+        self.client.force_login(User.objects.get(pk=1))
+        with self.assertLogs("mysite.write_queue", "WARNING"):
+            response = self.client.post(
+                reverse("shopapp:product_create"),
+                {"name": "Lamp", "price": 12, "description": "", "discount": 0},
+                HTTP_USER_AGENT='Mozilla/5.0',
+            )
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response["Retry-After"], "3")
+
+    def test_api_answers_503(self, submit_write):
+        with self.assertLogs("mysite.write_queue", "WARNING"):
+            response = self.client.post(
+                reverse("shopapp:product-list"),
+                {"name": "Lamp", "price": 12, "created_by": 1},
+                HTTP_USER_AGENT='Mozilla/5.0',
+            )
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response["Retry-After"], "3")
+        self.assertIn("detail", response.json())
+
+
+@override_settings(QUERY_BUDGET_STRICT=True)
+class QueryBudgetTestCase(TestCase):
+    fixtures = [
+        'users-fixture.json',
+        'products-fixture.json',
+        'orders-fixture.json',
+    ]
+
+    def setUp(self) -> None:
+        self.client.force_login(User.objects.get(pk=1))
+        creator = User.objects.get(pk=1)
+        for number in range(10):
+            order = Order.objects.create(user=creator, delivery_address=f"Address {number}")
+            order.products.add(Product.objects.create(
+                name=f"Budget product {number}", price=1, created_by=creator,
+            ))
+            Profile.objects.create(user=User.objects.create_user(username=f"budget{number}"))
+
+    def test_pages_stay_within_budget(self):
+        for url in (
+            reverse("shopapp:orders_list"),
+            reverse("shopapp:order_details", kwargs={"pk": Order.objects.first().pk}),
+            reverse("shopapp:products_list"),
+            reverse("myauth:users-list"),
+        ):
+            with self.subTest(url=url):
+                response = self.client.get(url, HTTP_USER_AGENT='Mozilla/5.0')
+                self.assertEqual(response.status_code, 200)
+
+    def test_exceeded_budget_raises(self):
+        with patch.object(OrdersListView, "query_budget", 1):
+            with self.assertRaises(QueryBudgetExceeded):
+                self.client.get(reverse("shopapp:orders_list"), HTTP_USER_AGENT='Mozilla/5.0')
@@ -26,6 +26,7 @@ from .views import (
 
     ProductViewSet,
     OrderViewSet,
+    SalesReportViewSet,
 
     UserOrderListsView,
     UserOrdersDataExportView,
@@ -36,6 +37,7 @@ app_name = "shopapp"
 routers = DefaultRouter()
 routers.register("products", ProductViewSet)
 routers.register("orders", OrderViewSet)
+routers.register("reports", SalesReportViewSet, basename="report")
 
 urlpatterns = [
     path("", ShopIndexView.as_view(), name='index'),
@@ -3,6 +3,7 @@
 
 Разные view Интернет-магазина: по товарам, заказам и т.д.
 """
+import json
 import logging
 from timeit import default_timer
 
@@ -10,10 +11,19 @@ from csv import DictWriter
 from typing import Type
 
 from django.contrib.auth.decorators import permission_required
-from django.http import HttpResponse, HttpRequest, HttpResponseRedirect, JsonResponse
-from django.shortcuts import render, redirect
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import (HttpResponse,
+                         HttpResponseBadRequest,
+                         HttpRequest,
+                         HttpResponseRedirect,
+                         JsonResponse,
+                         StreamingHttpResponse)
+from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.models import Group, User
 from django.contrib.auth.mixins import LoginRequiredMixin, PermissionRequiredMixin, UserPassesTestMixin
+from django.core.paginator import Paginator
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import Count, F, FileField, Prefetch, QuerySet
 from django.urls import reverse, reverse_lazy
 from django.views import View
 from django.views.generic import ListView, DetailView, CreateView, UpdateView, DeleteView
@@ -21,31 +31,78 @@ from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.request import Request
 
 from django.utils.decorators import method_decorator
-from django.views.decorators.cache import cache_page
 
+from jobsapp.jobs import enqueue
 from myauth.models import Profile
-from .models import Product, Order
+from mysite.write_queue import submit_write
+from .models import Product, Order, ProductSalesDaily
 from .forms import GroupForm
 
 from django.utils.translation import gettext_lazy as _
 
-from rest_framework.viewsets import ModelViewSet
+from rest_framework.viewsets import ModelViewSet, ViewSet
+from rest_framework.permissions import IsAdminUser
 from rest_framework.filters import SearchFilter, OrderingFilter
 from rest_framework.decorators import action
 from rest_framework.parsers import MultiPartParser
 from rest_framework.response import Response
-
-from .serializers import ProductSerializer, OrderSerializer
-
-from .common import save_csv_products
+from rest_framework import status
+from rest_framework.fields import BooleanField
+
+from .pagination import CatalogCountPaginator, SelectablePaginationMixin
+from .search import ProductFullTextSearchFilter
+from . import reports
+from .serializers import (ProductSerializer,
+                          OrderSerializer,
+                          SalesReportQuerySerializer,
+                          DailySalesSerializer,
+                          ProductSalesSerializer,
+                          DiscountSalesSerializer)
+
+from .caching import (aget_catalog_version,
+                      aget_or_compute,
+                      cache_api_response,
+                      condition_on_stamp,
+                      encode_payloads,
+                      get_change_stamp,
+                      get_or_compute,
+                      payload_response,
+                      CATALOG_CACHE_TIMEOUT,
+                      CATALOG_STAMP)
+from .common import aiter_ndjson, iter_csv_rows
 
 from drf_spectacular.utils import extend_schema, OpenApiResponse
 
-from django.core.cache import cache
 
 log = logging.getLogger(__name__)
 
 
+class QueuedSaveMixin:
+    """
+    Saves the form of a create/update view through the write queue.
+    """
+    def form_valid(self, form):
+        # Uploads are stored first: the batch transaction must not wait on them.
+        instance = form.instance
+        for field in instance._meta.concrete_fields:
+            file = getattr(instance, field.attname) if isinstance(field, FileField) else None
+            if file and not file._committed:
+                file.save(file.name, file.file, save=False)
+        self.object = submit_write(form.save)
+        return HttpResponseRedirect(self.get_success_url())
+
+
+class QueuedSaveViewSetMixin:
+    """
+    Saves the serializer of a viewset through the write queue.
+    """
+    def perform_create(self, serializer):
+        submit_write(serializer.save)
+
+    def perform_update(self, serializer):
+        submit_write(serializer.save)
+
+
 class ShopIndexView(View):
     def get(self, request: HttpRequest) -> HttpResponse:
         products = [
@@ -60,7 +117,7 @@ class ShopIndexView(View):
         }
         log.debug('Products for shop index: %s', products)
         log.info('Rendering shop index')
-        print("shop index context", context)
+        log.debug("Shop index context: %s", context)
         return render(request, 'shopapp/shop-index.html', context=context)
 
 
@@ -82,20 +139,58 @@ class GroupsListView(View):
 
 # Продукты
 
+@method_decorator(condition_on_stamp(CATALOG_STAMP, weak=True), name="dispatch")
 class ProductDetailsView(DetailView):
     template_name = 'shopapp/products-details.html'
     model = Product
     context_object_name = 'product'
 
 
+@method_decorator(condition_on_stamp(CATALOG_STAMP, weak=True), name="dispatch")
 class ProductsListView(ListView):
     template_name = 'shopapp/products_list.html'
     # model = Product
-    queryset = Product.objects.filter(archived=False)
+    queryset = (
+        Product.objects
+        .filter(archived=False)
+        .only("name", "price", "discount", "preview", "preview_variants")
+        .order_by("name")
+    )
     context_object_name = "products"
+    paginate_by = 20
+    paginator_class = CatalogCountPaginator
+    query_budget = 4
+
+    def get_paginator(self, *args, **kwargs):
+        return super().get_paginator(*args, count_key="active_products_count", **kwargs)
+
+    def paginate_queryset(self, queryset, page_size):
+        """
+        ``?after=<name>`` switches to keyset navigation: the next page is
+        read from the unique name index instead of skipping OFFSET rows.
+        """
+        after = self.request.GET.get("after")
+        if after is None:
+            return super().paginate_queryset(queryset, page_size)
+        products = list(queryset.filter(name__gt=after)[:page_size + 1])
+        self.has_next = len(products) > page_size
+        return None, None, products[:page_size], True
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        products = context["products"] = list(context["products"])
+        if context["page_obj"] is not None:
+            has_next = context["page_obj"].has_next()
+            products_count = context["paginator"].count
+        else:
+            has_next = self.has_next
+            products_count = self.get_paginator(self.get_queryset(), self.paginate_by).count
+        context["products_count"] = products_count
+        context["next_after"] = products[-1].name if has_next and products else None
+        return context
 
 
-class ProductCreateView(CreateView):
+class ProductCreateView(QueuedSaveMixin, CreateView):
     permission_required = ["shopapp.add_product"]
 
     model = Product
@@ -109,7 +204,7 @@ class ProductCreateView(CreateView):
     #     return response
 
 
-class ProductUpdateView(UserPassesTestMixin, UpdateView):
+class ProductUpdateView(UserPassesTestMixin, QueuedSaveMixin, UpdateView):
     model = Product
     fields = 'name', 'price', 'description', 'discount', 'preview'
     template_name_suffix = "_update_form"
@@ -138,7 +233,7 @@ class ProductDeleteView(DeleteView):
     def form_valid(self, form):
         success_url = self.get_success_url()
         self.object.archived = True
-        self.object.save()
+        submit_write(self.object.save)
         return HttpResponseRedirect(success_url)
 
     def get_success_url(self):
@@ -149,7 +244,7 @@ class ProductDeleteView(DeleteView):
 
 
 @extend_schema(description='Product views CRUD')
-class ProductViewSet(ModelViewSet):
+class ProductViewSet(QueuedSaveViewSetMixin, SelectablePaginationMixin, ModelViewSet):
     """
     Набор представлений для действий над Product.
     Полный CRUD для сущностей товара.
@@ -159,7 +254,7 @@ class ProductViewSet(ModelViewSet):
     serializer_class = ProductSerializer
 
     filter_backends = [
-        SearchFilter,
+        ProductFullTextSearchFilter,
         DjangoFilterBackend,
         OrderingFilter,
     ]
@@ -189,19 +284,19 @@ class ProductViewSet(ModelViewSet):
                                  'Empty response, product by ID not found.'),
         }
     )
+    @method_decorator(condition_on_stamp(CATALOG_STAMP))
     def retrieve(self, *args, **kwargs):
         return super().retrieve(*args, **kwargs)
 
-    @method_decorator(cache_page(60 * 2))
+    @method_decorator(condition_on_stamp(CATALOG_STAMP, weak=True))
+    @method_decorator(cache_api_response("products", stamps=[CATALOG_STAMP]))
     def list(self, *args, **kwargs):
-        print("Hello products list")
+        log.debug("Products list requested")
         return super().list(*args, **kwargs)
 
     @action(methods=["get"], detail=False)
     def download_csv(self, request: Request):
-        response = HttpResponse(content_type='text/csv')
         filename = "products-export.csv"
-        response['Content-Disposition'] = f"attachment; filename={filename}"
         queryset = self.filter_queryset(self.get_queryset())
         fields = [
             "name",
@@ -209,6 +304,19 @@ class ProductViewSet(ModelViewSet):
             "price",
             "discount",
         ]
+
+        # "0"/"false" must not stream; unknown values are a 400.
+        stream = BooleanField().run_validation(request.query_params.get("stream", False))
+        if stream:
+            response = StreamingHttpResponse(
+                iter_csv_rows(queryset, fields),
+                content_type='text/csv',
+            )
+            response['Content-Disposition'] = f"attachment; filename={filename}"
+            return response
+
+        response = HttpResponse(content_type='text/csv')
+        response['Content-Disposition'] = f"attachment; filename={filename}"
         queryset = queryset.only(*fields)
         writer = DictWriter(response, fieldnames=fields)
         writer.writeheader()
@@ -227,43 +335,88 @@ class ProductViewSet(ModelViewSet):
         parser_classes=[MultiPartParser],
     )
     def upload_csv(self, request: Request):
-        products = save_csv_products(
-            request.FILES["file"].file,
+        job = enqueue(
+            "shopapp.import_products_csv",
+            created_by=request.user if request.user.is_authenticated else None,
+            input_file=request.FILES["file"],
             encoding=request.encoding,
+            upsert=request.data.get("upsert") in ("1", "true", "True"),
+        )
+        return Response(
+            {
+                "job": job.pk,
+                "status_url": reverse("jobsapp:job-status", kwargs={"pk": job.pk}),
+            },
+            status=status.HTTP_202_ACCEPTED,
         )
-        serializer = self.get_serializer(products, many=True)
-        return Response(serializer.data)
 
 
 # Заказы
 
 
+# Products shown per order on the orders list, the rest is summarized.
+ORDER_PRODUCTS_PREVIEW = 5
+ORDERS_PER_PAGE = 20
+ORDER_ITEMS_PER_PAGE = 50
+
+ORDER_USER_FIELDS = ("user__username", "user__first_name", "user__last_name")
+
+
+def orders_with_user() -> QuerySet:
+    return (
+        Order.objects
+        .select_related("user")
+        .only(
+            "delivery_address", "promocode", "total", "item_count",
+            "user", *ORDER_USER_FIELDS,
+        )
+    )
+
+
 class OrderDetailsView(PermissionRequiredMixin, DetailView):
     model = Order
     permission_required = "shopapp.view_order"
-
-    queryset = (Order
-                .objects.select_related("user")
-                .prefetch_related('products').all()
-                )
+    queryset = orders_with_user()
     context_object_name = 'order'
+    query_budget = 8
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        items = (
+            self.object.items
+            .select_related("product")
+            .only("quantity", "price", "product__name", "product__price")
+            .order_by("pk")
+        )
+        context["items_page"] = Paginator(items, ORDER_ITEMS_PER_PAGE).get_page(
+            self.request.GET.get("page")
+        )
+        return context
 
 
 class OrdersListView(LoginRequiredMixin, ListView):
-    queryset = (Order.objects
-                .select_related("user")
-                .prefetch_related('products')
-                )
+    queryset = (
+        orders_with_user()
+        .annotate(product_count=Count("items"))
+        .prefetch_related(Prefetch(
+            "products",
+            queryset=Product.objects.only("name", "price").order_by("pk")[:ORDER_PRODUCTS_PREVIEW],
+            to_attr="preview_products",
+        ))
+        .order_by("pk")
+    )
     context_object_name = 'orders'
+    paginate_by = ORDERS_PER_PAGE
+    query_budget = 6
 
 
-class OrderCreateView(CreateView):
+class OrderCreateView(QueuedSaveMixin, CreateView):
     model = Order
     fields = 'user', 'delivery_address', 'promocode'
     success_url = reverse_lazy('shopapp:orders_list')
 
 
-class OrderUpdateView(UpdateView):
+class OrderUpdateView(QueuedSaveMixin, UpdateView):
     model = Order
     fields = 'user', 'delivery_address', 'promocode'
     template_name_suffix = "_update_form"
@@ -279,7 +432,7 @@ class OrderDeleteView(DeleteView):
     def form_valid(self, form):
         success_url = self.get_success_url()
         self.object.archived = True
-        self.object.save()
+        submit_write(self.object.save)
         return HttpResponseRedirect(success_url)
 
     def get_success_url(self):
@@ -289,45 +442,109 @@ class OrderDeleteView(DeleteView):
         )
 
 
-class ProductsDataExportView(View):
-    def get(self, request: HttpRequest) -> JsonResponse:
-        cache_key = "products_data_export"
-        products_data = cache.get(cache_key)
-        if products_data is None:
-            products = Product.objects.order_by("pk").all()
-            products_data = [
-                {
-                    "pk": product.pk,
-                    "name": product.name,
-                    "price": product.price,
-                    "archived": product.archived,
-                }
-                for product in products
-            ]
-        # elem = products_data[0]
-        # name = elem["name"]
-        # print("name: ", name)
-        cache.set(cache_key, products_data, 300)
-        return JsonResponse({"products": products_data})
-
-
-class OrdersDataExportView(View):
-    def get(self, request: HttpRequest) -> JsonResponse:
-        orders = Order.objects.order_by("pk").all()
-        orders_data = [
-            {
-                "pk": order.pk,
-                "delivery_address": order.delivery_address,
-                "promocode": order.promocode,
-                "created_by": order.user_id,
-                # "archived": order.archived,
-            }
-            for order in orders
-        ]
-        return JsonResponse({"orders": orders_data})
+class DataExportMixin:
+    """
+    Общая логика выгрузки данных.
+
+    Режимы:
+    - по умолчанию: весь набор одним JSON-документом;
+    - ``?format=ndjson``: потоковая выгрузка, одна запись на строку;
+    - ``?after=<pk>&limit=<n>``: постраничная выгрузка по ключу pk.
+
+    Обработчики асинхронные: под ASGI медленный клиент занимает корутину,
+    а не поток воркера. Данные читаются с реплики (``mysite.db_routers``).
+    """
+    export_key: str
+    default_export_limit = 100
+    max_export_limit = 1000
+    use_replica = True
+
+    def get_export_rows(self) -> QuerySet:
+        """
+        Returns a ``values()`` queryset ordered by pk.
+        """
+        raise NotImplementedError
+
+    async def get_export_data(self) -> list:
+        return [row async for row in self.get_export_rows()]
+
+    async def get(self, request: HttpRequest, *args, **kwargs) -> HttpResponse:
+        if request.GET.get("format") == "ndjson":
+            return StreamingHttpResponse(
+                aiter_ndjson(self.get_export_rows()),
+                content_type="application/x-ndjson",
+            )
+        if "after" in request.GET or "limit" in request.GET:
+            return await self.get_keyset_page(request)
+        return await self.get_full_export(request)
+
+    async def get_full_export(self, request: HttpRequest) -> HttpResponse:
+        return JsonResponse({self.export_key: await self.get_export_data()})
+
+    async def get_keyset_page(self, request: HttpRequest) -> HttpResponse:
+        try:
+            after = int(request.GET.get("after") or 0)
+            limit = int(request.GET.get("limit") or self.default_export_limit)
+        except ValueError:
+            return HttpResponseBadRequest("'after' and 'limit' must be integers")
+        limit = max(1, min(limit, self.max_export_limit))
+
+        rows = [row async for row in self.get_export_rows().filter(pk__gt=after)[:limit]]
+        next_after = rows[-1]["pk"] if len(rows) == limit else None
+        return JsonResponse({
+            self.export_key: rows,
+            "next_after": next_after,
+        })
+
+
+class ProductsDataExportView(DataExportMixin, View):
+    export_key = "products"
+
+    def get_export_rows(self) -> QuerySet:
+        return (
+            Product.objects
+            .order_by("pk")
+            .values("pk", "name", "price", "archived")
+        )
+
+    async def get_full_export(self, request: HttpRequest) -> HttpResponse:
+        async def build_payloads() -> dict:
+            # Cached under the catalog version, so a lagging replica
+            # would leave an outdated export cached as the current one.
+            rows = [row async for row in self.get_export_rows().using(DEFAULT_DB_ALIAS)]
+            content = json.dumps({self.export_key: rows}, cls=DjangoJSONEncoder)
+            return encode_payloads(content.encode())
+
+        # The final JSON and its compressed variants are cached as bytes,
+        # so a hit costs neither unpickling objects nor encoding them.
+        # While one worker rebuilds a changed catalog the others keep
+        # serving the previous export instead of all querying at once.
+        payloads = await aget_or_compute(
+            "products_data_export",
+            build_payloads,
+            timeout=CATALOG_CACHE_TIMEOUT,
+            version=await aget_catalog_version(),
+        )
+        return payload_response(request, payloads, "application/json")
+
+
+class OrdersDataExportView(DataExportMixin, View):
+    export_key = "orders"
+
+    def get_export_rows(self) -> QuerySet:
+        return (
+            Order.objects
+            .order_by("pk")
+            .values(
+                "pk",
+                "delivery_address",
+                "promocode",
+                created_by=F("user_id"),
+            )
+        )
 
 
-class OrderViewSet(ModelViewSet):
+class OrderViewSet(QueuedSaveViewSetMixin, SelectablePaginationMixin, ModelViewSet):
     """
     Набор представлений для действий над Order.
     Полный CRUD для сущностей заказа.
@@ -357,6 +574,57 @@ class OrderViewSet(ModelViewSet):
         'user',
     ]
 
+    @method_decorator(condition_on_stamp("order"))
+    def retrieve(self, *args, **kwargs):
+        return super().retrieve(*args, **kwargs)
+
+    @method_decorator(condition_on_stamp("order", weak=True))
+    @method_decorator(cache_api_response("orders", stamps=["order"]))
+    def list(self, *args, **kwargs):
+        return super().list(*args, **kwargs)
+
+
+@extend_schema(
+    description='Sales reports from daily rollups',
+    parameters=[SalesReportQuerySerializer],
+)
+class SalesReportViewSet(ViewSet):
+    """
+    Отчёты о продажах по предрассчитанным дневным агрегатам.
+    Только чтение, без обхода заказов.
+    """
+    permission_classes = [IsAdminUser]
+    use_replica = True
+
+    def get_rollups(self, request: Request):
+        query = SalesReportQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        rollups = reports.filter_period(
+            ProductSalesDaily.objects.all(),
+            query.validated_data.get("date_from"),
+            query.validated_data.get("date_to"),
+        )
+        return rollups, query.validated_data
+
+    @extend_schema(responses=DailySalesSerializer(many=True))
+    @action(methods=["get"], detail=False)
+    def sales(self, request: Request):
+        rollups, _params = self.get_rollups(request)
+        return Response(DailySalesSerializer(reports.sales_by_day(rollups), many=True).data)
+
+    @extend_schema(responses=ProductSalesSerializer(many=True))
+    @action(methods=["get"], detail=False, url_path="top-products")
+    def top_products(self, request: Request):
+        rollups, params = self.get_rollups(request)
+        data = reports.top_products(rollups, limit=params["limit"])
+        return Response(ProductSalesSerializer(data, many=True).data)
+
+    @extend_schema(responses=DiscountSalesSerializer(many=True))
+    @action(methods=["get"], detail=False, url_path="by-discount")
+    def by_discount(self, request: Request):
+        rollups, _params = self.get_rollups(request)
+        return Response(DiscountSalesSerializer(reports.sales_by_discount(rollups), many=True).data)
+
 
 class UserOrderListsView(ListView):
     template_name = "shopapp/user_orders_list.html"
@@ -376,19 +644,18 @@ class UserOrderListsView(ListView):
 class UserOrdersDataExportView(View):
 
     def get(self, *args, **kwargs) -> JsonResponse:
-        cache_key = "user_orders"
-        data_json = cache.get(cache_key)
+        user = get_object_or_404(User, pk=self.kwargs['user_id'])
 
-        if data_json is None:
-            user = User.objects.get(pk=self.kwargs['user_id'])
+        def export_user_orders() -> dict:
             orders = Order.objects.order_by('pk').filter(user=user)
-            user_orders = [
-                {
-                    "pk": order.pk,
-                    "delivery_address": order.delivery_address,
-                    "promocode": order.promocode,
-                }
-                for order in orders
-            ]
-            cache.set(cache_key, data_json, 300)
-            return JsonResponse({"orders": user_orders})
\ No newline at end of file
+            user_orders = list(orders.values("pk", "delivery_address", "promocode"))
+            content = json.dumps({"orders": user_orders}, cls=DjangoJSONEncoder)
+            return encode_payloads(content.encode())
+
+        payloads = get_or_compute(
+            f"user_orders_export:{user.pk}",
+            export_user_orders,
+            timeout=300,
+            version=get_change_stamp("order"),
+        )
+        return payload_response(self.request, payloads, "application/json")